@@ -0,0 +1,452 @@
+"""in-process stand-ins for the discord gateway/api and mongodb, so a
+Discordant can be driven without any network access."""
+import asyncio
+import copy
+import itertools
+import re
+from datetime import datetime
+
+import discord
+
+from discordant import Discordant
+
+_ids = itertools.count(200000000000000000)
+
+
+def next_id():
+    return str(next(_ids))
+
+
+class FakePermissions:
+    def __init__(self, admin=False):
+        self.kick_members = admin
+        self.ban_members = admin
+        self.manage_messages = admin
+        self.read_messages = True
+
+
+class FakeRole:
+    def __init__(self, name, position=0):
+        self.id = next_id()
+        self.name = name
+        self.position = position
+        self.permissions = FakePermissions()
+        self.mention = "<@&{}>".format(self.id)
+
+    def __ge__(self, other):
+        return self.position >= other.position
+
+    def __gt__(self, other):
+        return self.position > other.position
+
+    def __le__(self, other):
+        return self.position <= other.position
+
+    def __lt__(self, other):
+        return self.position < other.position
+
+
+class FakeChannel:
+    def __init__(self, server, name, type=discord.ChannelType.text):
+        self.id = next_id()
+        self.server = server
+        self.name = name
+        self.type = type
+        self.mention = "<#{}>".format(self.id)
+        self.messages = []
+
+    def permissions_for(self, member):
+        return FakePermissions(True)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeUser:
+    def __init__(self, name, bot=False):
+        self.id = next_id()
+        self.name = name
+        self.discriminator = "{:04d}".format(int(self.id) % 10000)
+        self.bot = bot
+        self.avatar = None
+        self.avatar_url = ""
+        self.default_avatar_url = "https://example.com/avatar.png"
+        self.mention = "<@{}>".format(self.id)
+        self.created_at = datetime.utcnow()
+
+    def __str__(self):
+        return "{}#{}".format(self.name, self.discriminator)
+
+
+class FakeMember(FakeUser):
+    def __init__(self, server, name, admin=False, bot=False):
+        super().__init__(name, bot)
+        self.server = server
+        self.nick = None
+        self.roles = [server.default_role]
+        self.voice_channel = None
+        self.joined_at = datetime.utcnow()
+        self.server_permissions = FakePermissions(admin)
+        self.colour = 0
+
+    @property
+    def top_role(self):
+        return max(self.roles, key=lambda x: x.position)
+
+
+class FakeServer:
+    def __init__(self, name, member_count, channel_count):
+        self.id = next_id()
+        self.name = name
+        self.default_role = FakeRole("@everyone")
+        self.roles = [self.default_role] + [
+            FakeRole(x, i + 1) for i, x in enumerate(
+                ["Voice", "VC Shown", "Muted", "Staff"])]
+        self.channels = [FakeChannel(self, "channel{}".format(i))
+                         for i in range(channel_count)]
+        self.voice_channels = [
+            FakeChannel(self, "voice{}".format(i), discord.ChannelType.voice)
+            for i in range(3)]
+        self.channels += self.voice_channels
+        self.default_channel = self.channels[0]
+        self.afk_channel = None
+        self.members = [FakeMember(self, "member{}".format(i))
+                        for i in range(member_count)]
+        self._members = {x.id: x for x in self.members}
+
+    def add_member(self, member):
+        self.members.append(member)
+        self._members[member.id] = member
+
+    def get_member(self, uid):
+        return self._members.get(uid)
+
+    def get_channel(self, channel_id):
+        return discord.utils.get(self.channels, id=channel_id)
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content):
+        self.id = next_id()
+        self.channel = channel
+        self.server = getattr(channel, "server", None)
+        self.author = author
+        self.content = content
+        self.clean_content = content
+        self.timestamp = datetime.utcnow()
+        self.mentions = []
+        self.channel_mentions = []
+
+
+class _LogsFrom:
+    def __init__(self, messages):
+        self._messages = iter(messages)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._messages)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _FakeHTTP:
+    """the raw discord api calls the bot makes without a client method."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def delete_message(self, channel_id, message_id, guild_id=None):
+        return await self.bot._api()
+
+    async def delete_messages(self, channel_id, message_ids, guild_id=None):
+        return await self.bot._api()
+
+
+class FakeDiscordant(Discordant):
+    """a Discordant whose discord api calls are served in process, each
+    taking api_latency seconds."""
+
+    api_latency = 0.0
+
+    def setup_fake(self, servers, api_latency=0.0):
+        self.fake_servers = servers
+        self.api_latency = api_latency
+        self.api_calls = 0
+        self.http = _FakeHTTP(self)
+        user = FakeUser("discordant", True)
+        for server in servers:
+            member = FakeMember(server, user.name, True, True)
+            member.id = user.id
+            member.mention = user.mention
+            member.roles.append(server.roles[-1])
+            server.add_member(member)
+        self._fake_user = user
+
+    @property
+    def user(self):
+        return self._fake_user
+
+    @property
+    def private_channels(self):
+        return []
+
+    def get_channel(self, channel_id):
+        for server in self.fake_servers:
+            channel = discord.utils.get(server.channels, id=channel_id)
+            if channel:
+                return channel
+        return None
+
+    def get_server(self, server_id):
+        return discord.utils.get(self.fake_servers, id=server_id)
+
+    async def _api(self, result=None):
+        self.api_calls += 1
+        await asyncio.sleep(self.api_latency)
+        return result
+
+    async def send_message(self, destination, content=None, *, tts=False,
+                           embed=None):
+        if isinstance(destination, FakeUser):
+            destination = FakeChannel(None, "dm")
+        message = FakeMessage(destination, self.user, content or "")
+        return await self._api(message)
+
+    async def send_file(self, destination, fp, *, filename=None,
+                        content=None, tts=False):
+        return await self._api(FakeMessage(destination, self.user, ""))
+
+    async def edit_message(self, message, new_content=None, *, embed=None):
+        message.content = new_content
+        return await self._api(message)
+
+    async def delete_message(self, message):
+        return await self._api()
+
+    async def delete_messages(self, messages):
+        return await self._api()
+
+    async def get_message(self, channel, id):
+        message = discord.utils.get(channel.messages, id=id)
+        if not message:
+            raise discord.NotFound(None, "Unknown Message")
+        return await self._api(message)
+
+    def logs_from(self, channel, limit=100, *, before=None, after=None,
+                  around=None, reverse=False):
+        messages = channel.messages
+        if after:
+            messages = [x for x in messages if x.timestamp > after.timestamp]
+        return _LogsFrom(messages[-limit:] if limit < len(messages)
+                         else messages)
+
+    async def add_roles(self, member, *roles):
+        member.roles += [x for x in roles if x not in member.roles]
+        return await self._api()
+
+    async def remove_roles(self, member, *roles):
+        member.roles = [x for x in member.roles if x not in roles]
+        return await self._api()
+
+    async def change_presence(self, *, game=None, status=None, afk=False):
+        return await self._api()
+
+    async def get_bans(self, server):
+        return await self._api([])
+
+    async def ban(self, member, delete_message_days=1):
+        return await self._api()
+
+    async def unban(self, server, user):
+        return await self._api()
+
+
+class MemoryCursor:
+    def __init__(self, documents):
+        self._documents = documents
+
+    def sort(self, key, direction=1):
+        if key != "$natural":
+            self._documents.sort(key=lambda x: x.get(key),
+                                 reverse=direction < 0)
+        elif direction < 0:
+            self._documents.reverse()
+        return self
+
+    def limit(self, n):
+        if n:
+            self._documents = self._documents[:n]
+        return self
+
+    def skip(self, n):
+        self._documents = self._documents[n:]
+        return self
+
+    async def to_list(self, length):
+        return [copy.copy(x) for x in self._documents[:length]]
+
+    @property
+    def fetch_next(self):
+        future = asyncio.Future()
+        future.set_result(bool(self._documents))
+        return future
+
+    def next_object(self):
+        return copy.copy(self._documents.pop(0))
+
+
+class MemoryCollection:
+    """enough of a motor collection for the queries the bot makes."""
+
+    def __init__(self):
+        self.documents = []
+        self._ids = itertools.count()
+
+    def find(self, query=None, *args, **kwargs):
+        query = query or {}
+        order = None
+        if "$query" in query:
+            order = query.get("$orderby")
+            query = query["$query"]
+        cursor = MemoryCursor([x for x in self.documents
+                               if _matches(x, query)])
+        if order:
+            for key, direction in order.items():
+                cursor.sort(key, direction)
+        return cursor
+
+    async def find_one(self, query=None, *args, **kwargs):
+        documents = await self.find(query).limit(1).to_list(1)
+        return documents[0] if documents else None
+
+    async def insert_one(self, document):
+        document.setdefault("_id", next(self._ids))
+        self.documents.append(copy.copy(document))
+
+    async def insert_many(self, documents, ordered=True):
+        for document in documents:
+            await self.insert_one(document)
+
+    async def insert(self, document):
+        await self.insert_one(document)
+
+    async def update_one(self, query, update, upsert=False):
+        for document in self.documents:
+            if _matches(document, query):
+                _apply(document, update)
+                return
+        if upsert:
+            document = {k: v for k, v in query.items()
+                        if not isinstance(v, dict)}
+            _apply(document, update)
+            await self.insert_one(document)
+
+    async def find_one_and_update(self, query, update, upsert=False):
+        for document in self.documents:
+            if _matches(document, query):
+                before = copy.copy(document)
+                _apply(document, update)
+                return before
+        if upsert:
+            await self.update_one(query, update, upsert)
+        return None
+
+    async def update(self, query, update, upsert=False, multi=False):
+        if multi:
+            await self.update_many(query, update)
+        else:
+            await self.update_one(query, update, upsert)
+
+    async def update_many(self, query, update):
+        for document in self.documents:
+            if _matches(document, query):
+                _apply(document, update)
+
+    async def save(self, document):
+        for i, x in enumerate(self.documents):
+            if x["_id"] == document["_id"]:
+                self.documents[i] = copy.copy(document)
+                return
+        await self.insert_one(document)
+
+    async def remove(self, query):
+        self.documents = [x for x in self.documents if not _matches(x, query)]
+
+    async def delete_many(self, query):
+        await self.remove(query)
+
+    async def count(self, query=None):
+        return len([x for x in self.documents if _matches(x, query or {})])
+
+    async def create_index(self, *args, **kwargs):
+        pass
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    async def command(self, *args, **kwargs):
+        return {"ok": 1}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection()
+        return self._collections[name]
+
+
+_operators = {
+    "$gt": lambda x, y: x is not None and x > y,
+    "$gte": lambda x, y: x is not None and x >= y,
+    "$lt": lambda x, y: x is not None and x < y,
+    "$lte": lambda x, y: x is not None and x <= y,
+    "$ne": lambda x, y: x != y,
+    "$in": lambda x, y: x in y,
+    "$nin": lambda x, y: x not in y,
+    "$exists": lambda x, y: (x is not None) == y,
+    "$all": lambda x, y: x is not None and all(v in x for v in y),
+}
+
+
+def _matches(document, query):
+    for key, condition in query.items():
+        value = document.get(key)
+        if isinstance(condition, dict):
+            if not all(_operators[op](value, arg)
+                       for op, arg in condition.items()):
+                return False
+        elif isinstance(condition, type(re.compile(""))):
+            if not isinstance(value, str) or not condition.search(value):
+                return False
+        elif isinstance(value, list) and not isinstance(condition, list):
+            if condition not in value:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _apply(document, update):
+    if not any(x.startswith("$") for x in update):
+        _id = document.get("_id")
+        document.clear()
+        document.update(update)
+        if _id is not None:
+            document["_id"] = _id
+        return
+    for key, value in update.get("$set", {}).items():
+        document[key] = value
+    for key, value in update.get("$inc", {}).items():
+        document[key] = document.get(key, 0) + value
+    for key, value in update.get("$push", {}).items():
+        document.setdefault(key, []).append(value)
+    for key, value in update.get("$pull", {}).items():
+        document[key] = [x for x in document.get(key, []) if x != value]
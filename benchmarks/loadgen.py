@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""end-to-end load generator: drives a Discordant with synthetic events.
+
+    python -m benchmarks.loadgen [-d 30] [-m 50] [--members 5000] [-o out.json]
+
+the discord api and mongodb are served in process (see benchmarks.fakes),
+each api call taking --api-latency seconds, so the numbers reflect the
+bot's own dispatch, command and handler overhead under concurrency."""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+import psutil
+
+import discordant.guilds as guilds
+import discordant.perf as perf
+from benchmarks.fakes import FakeDiscordant, FakeMember, FakeMessage, \
+    FakeServer, MemoryDatabase
+from benchmarks.micro import git_commit
+
+CONFIG = os.path.join(os.path.dirname(__file__), os.pardir,
+                      "config-example.json")
+# weighted so chatter dominates, like a real server
+DEFAULT_MIX = ["!userinfo", "!tag", "!tz JST", "!help", "!uptime", "!showvc",
+               "!bans", "!nosuchcommand"] + [""] * 24
+CHATTER = ["こんにちは", "what does 勉強 mean?", "lol", "おはよう！",
+           "anyone in vc?", "https://example.com/some/link", "ok"]
+
+
+class LoadGenerator:
+    def __init__(self, bot, servers, rng, mix):
+        self.bot = bot
+        self.servers = servers
+        self.rng = rng
+        self.mix = mix
+        self.latencies = {}
+        self.errors = Counter()
+        self.pending = set()
+
+    def fire(self, name, coro):
+        task = asyncio.ensure_future(self._timed(name, coro))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def _timed(self, name, coro):
+        start = time.perf_counter()
+        try:
+            await coro
+        except Exception:
+            self.errors[name] += 1
+        finally:
+            self.latencies.setdefault(name, []).append(
+                time.perf_counter() - start)
+
+    def message(self):
+        server = self.rng.choice(self.servers)
+        channel = self.rng.choice([x for x in server.channels
+                                   if x not in server.voice_channels])
+        author = self.rng.choice(server.members)
+        content = self.rng.choice(self.mix) or self.rng.choice(CHATTER)
+        message = FakeMessage(channel, author, content)
+        channel.messages.append(message)
+        name = "command " + content.split()[0] if content.startswith(
+            self.bot.command_char) else "message"
+        self.fire(name, self.bot.on_message(message))
+
+    def member_join(self):
+        server = self.rng.choice(self.servers)
+        member = FakeMember(server, "joined{}".format(len(server.members)))
+        server.add_member(member)
+        self.fire("member_join", self.bot.on_member_join(member))
+
+    def voice_state_update(self):
+        server = self.rng.choice(self.servers)
+        member = self.rng.choice(server.members)
+        before = copy.copy(member)
+        member.voice_channel = self.rng.choice(server.voice_channels + [None])
+        self.fire("voice_state_update",
+                  self.bot.on_voice_state_update(before, member))
+
+    async def stream(self, rate, func, until):
+        if rate <= 0:
+            return
+        loop = asyncio.get_event_loop()
+        interval = 1 / rate
+        deadline = loop.time()
+        while deadline < until:
+            func()
+            deadline += interval
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+
+
+def write_config(servers, path, fixtures=None, http_latency=0.0):
+    with open(CONFIG) as f:
+        config = json.load(f)
+    config["login"]["token"] = "loadgen"
+    config["client"]["controllers"] = []
+    config["guilds"] = {}
+    for server in servers:
+        channels = server.channels
+        config["guilds"][server.id] = {
+            "moderation": {"log_channel": channels[2].id,
+                           "warning_log_channel": channels[3].id,
+                           "staff_channel": channels[4].id},
+            "client": {"testing_channel": channels[1].id}}
+    config["metrics"]["prometheus_file"] = ""
+    config["cache"]["audio"]["directory"] = os.path.join(
+        tempfile.gettempdir(), "discordant-loadgen-audio")
+    # lookup commands can only run offline against recorded responses
+    config["http"] = {"mode": "replay" if fixtures else "live",
+                      "fixtures": fixtures, "latency": http_latency}
+    with open(path, "w") as f:
+        json.dump(config, f)
+
+
+def summarize(samples, duration):
+    p50, p95, p99 = perf.percentiles(samples, 50, 95, 99)
+    return {"count": len(samples), "rate": len(samples) / duration,
+            "p50": p50, "p95": p95, "p99": p99, "max": max(samples)}
+
+
+def stats_table(title, stats):
+    print("\n{:<44} {:>7} {:>6} {:>9} {:>9} {:>9}".format(
+        title, "count", "errors", "p50 ms", "p99 ms", "mongo s"))
+    for name, s in sorted(stats.items()):
+        p50, p99 = s.percentiles(50, 99)
+        print("{:<44} {:>7} {:>6} {:>9.1f} {:>9.1f} {:>9.2f}".format(
+            name, s.count, s.errors, p50 * 1000, p99 * 1000,
+            s.upstream["mongo"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-d", "--duration", type=float, default=30,
+                        help="seconds to generate load for")
+    parser.add_argument("-m", "--message-rate", type=float, default=50,
+                        help="messages per second")
+    parser.add_argument("-j", "--join-rate", type=float, default=1,
+                        help="member joins per second")
+    parser.add_argument("-v", "--voice-rate", type=float, default=5,
+                        help="voice state updates per second")
+    parser.add_argument("--members", type=int, default=5000,
+                        help="members per server")
+    parser.add_argument("--channels", type=int, default=20,
+                        help="text channels per server")
+    parser.add_argument("-g", "--guilds", type=int, default=1,
+                        help="servers the bot is configured for")
+    parser.add_argument("--api-latency", type=float, default=0.05,
+                        help="seconds each discord api call takes")
+    parser.add_argument("--fixtures",
+                        help="replay http responses recorded here")
+    parser.add_argument("--http-latency", type=float, default=0.1,
+                        help="seconds each replayed http request takes")
+    parser.add_argument("--mix", nargs="+",
+                        help="message contents to pick from, '' for chatter")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="result json path")
+    args = parser.parse_args()
+
+    process = psutil.Process()
+    rss_start = process.memory_info().rss
+    servers = [FakeServer("guild{}".format(i), args.members,
+                          max(args.channels, 5)) for i in range(args.guilds)]
+    fd, config_file = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        write_config(servers, config_file, args.fixtures, args.http_latency)
+        bot = FakeDiscordant(config_file)
+    finally:
+        os.remove(config_file)
+    bot.setup_fake(servers, args.api_latency)
+    bot.mongodb = perf.Timed(MemoryDatabase(), bot.metrics)
+    perf.Timed.proxied_types += ("Memory",)
+    loop = bot.loop
+    loop.run_until_complete(bot.on_ready())
+
+    gen = LoadGenerator(bot, servers, random.Random(args.seed),
+                        args.mix or DEFAULT_MIX)
+    rss_ready = process.memory_info().rss
+    guild_memory = guilds.memory_usage(bot)
+    start = time.perf_counter()
+    until = loop.time() + args.duration
+    loop.run_until_complete(asyncio.gather(
+        gen.stream(args.message_rate, gen.message, until),
+        gen.stream(args.join_rate, gen.member_join, until),
+        gen.stream(args.voice_rate, gen.voice_state_update, until)))
+    generated = time.perf_counter() - start
+    if gen.pending:
+        # commands like !showvc sleep before cleaning up after themselves
+        loop.run_until_complete(asyncio.wait(gen.pending, timeout=30))
+    elapsed = time.perf_counter() - start
+    bot.tasks.cancel_all()
+    rss_end = process.memory_info().rss
+
+    events = {name: summarize(samples, generated)
+              for name, samples in gen.latencies.items()}
+    total = sum(x["count"] for x in events.values())
+    print("{} events in {:.1f} s ({:.1f}/s), drained after {:.1f} s, "
+          "{} discord api calls, {} unfinished".format(
+              total, generated, total / generated, elapsed, bot.api_calls,
+              len(gen.pending)))
+    print("\n{:<44} {:>7} {:>6} {:>9} {:>9} {:>9}".format(
+        "event", "count", "errors", "p50 ms", "p95 ms", "p99 ms"))
+    for name, s in sorted(events.items()):
+        print("{:<44} {:>7} {:>6} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            name, s["count"], gen.errors[name], s["p50"] * 1000,
+            s["p95"] * 1000, s["p99"] * 1000))
+    stats_table("command", bot.metrics.commands)
+    stats_table("handler", bot.metrics.handlers)
+    print("\nRSS: {:.1f} MiB at start, {:.1f} MiB ready, {:.1f} MiB at end "
+          "({:+.1f} MiB under load)".format(
+              rss_start / 2 ** 20, rss_ready / 2 ** 20, rss_end / 2 ** 20,
+              (rss_end - rss_ready) / 2 ** 20))
+    print("Per server: {:.1f} MiB of cached objects, {:.1f} MiB of RSS "
+          "before load".format(
+              sum(guild_memory.values()) / len(guild_memory) / 2 ** 20,
+              (rss_ready - rss_start) / len(servers) / 2 ** 20))
+
+    if args.output:
+        for name, s in events.items():
+            s["errors"] = gen.errors[name]
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(), "args": vars(args),
+                       "elapsed": elapsed, "api_calls": bot.api_calls,
+                       "events": events,
+                       "rss": {"start": rss_start, "ready": rss_ready,
+                               "end": rss_end},
+                       "guild_memory": guild_memory},
+                      f, indent=2, sort_keys=True)
+        print("Saved results to", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""offline microbenchmarks for the hot utility and parsing paths.
+
+    python -m benchmarks.micro [-o results.json] [-c baseline.json] [name ...]
+
+results are written as json (by default to benchmarks/results/<commit>.json)
+so runs from different commits can be compared with --compare."""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from lxml import html
+from PIL import Image
+
+import discordant.commands.general as general
+import discordant.commands.mod as mod
+import discordant.perf as perf
+import discordant.utils as utils
+from discordant import Discordant
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+RESULTS = os.path.join(os.path.dirname(__file__), "results")
+
+_benchmarks = []
+
+
+def benchmark(name):
+    def wrapper(func):
+        _benchmarks.append((name, func))
+        return func
+
+    return wrapper
+
+
+class FakeMember:
+    def __init__(self, i):
+        self.id = str(100000000000000000 + i)
+        self.name = "user{}".format(i)
+        self.nick = "nick{}".format(i) if i % 3 == 0 else None
+        self.discriminator = "{:04d}".format(i % 10000)
+        self.mention = "<@{}>".format(self.id)
+        self.colour = 0
+
+    def __str__(self):
+        return "{}#{}".format(self.name, self.discriminator)
+
+
+class FakeSingleFlight:
+    """serves the fixture named by page instead of doing requests."""
+
+    def __init__(self):
+        self.pages = {}
+        for name in os.listdir(FIXTURES):
+            with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+                self.pages[name] = f.read()
+        self.page = None
+
+    async def do(self, key, func):
+        url, kind = key
+        text = self.pages[self.page]
+        return html.fromstring(text) if kind == "html" else text
+
+
+class FakeOutbox:
+    """packs and sends right away, without the per channel rate limit, so
+    the scrapers are what gets measured."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def send(self, channel, text, max_chars=2000):
+        return [await self.bot.send_message(channel, x)
+                for x in utils.pack_message(text, max_chars)]
+
+
+class FakeBot:
+    def __init__(self, members):
+        self.config = {}
+        self.loop = asyncio.get_event_loop()
+        self.metrics = perf.Metrics()
+        self.single_flight = FakeSingleFlight()
+        self.outbox = FakeOutbox(self)
+        self.user = members[0]
+        self.sent = 0
+
+    async def send_message(self, channel, content=None, embed=None):
+        self.sent += 1
+
+
+class FakeMessage:
+    server = None
+    channel = None
+
+
+MEMBERS = [FakeMember(i) for i in range(50000)]
+BOT = FakeBot(MEMBERS)
+NOW = datetime.utcnow()
+HISTORY = []
+for _i in range(5000):
+    HISTORY.append({"action": "warning" if _i % 2 else "remove warning",
+                    "date": NOW - timedelta(hours=5000 - _i),
+                    "duration": 48})
+HISTORY.reverse()
+LONG_OUTPUT = "\n".join("{}. 勉強 - study, learning, diligence".format(i)
+                        for i in range(5000))
+KWARGS = 'someone "with spaces" duration=48 reason="spamming in #general" ' \
+         'context=true limit=5 a b c d e f'
+STROKE_STRIP = Image.new("RGBA", (109 * 20, 109), (255, 255, 255, 255))
+
+
+def _run(coro):
+    return BOT.loop.run_until_complete(coro)
+
+
+@benchmark("general_search.exact_last")
+def _():
+    utils._general_search(MEMBERS[-1].name, MEMBERS)
+
+
+@benchmark("general_search.miss")
+def _():
+    utils._general_search("nobody", MEMBERS)
+
+
+@benchmark("get_user.mention")
+def _():
+    utils.get_user(MEMBERS[-1].mention, MEMBERS)
+
+
+@benchmark("get_user.discriminator")
+def _():
+    utils.get_user(str(MEMBERS[-1]), MEMBERS)
+
+
+@benchmark("is_punished.5000")
+def _():
+    _run(utils._is_punished(HISTORY, "warning"))
+
+
+@benchmark("long_message.split")
+def _():
+    utils.long_message(LONG_OUTPUT)
+
+
+@benchmark("long_message.truncate")
+def _():
+    utils.long_message(LONG_OUTPUT, truncate=True)
+
+
+@benchmark("split_every")
+def _():
+    utils.split_every(LONG_OUTPUT, 2000)
+
+
+@benchmark("get_kwargs")
+def _():
+    utils.get_kwargs(KWARGS, ["duration", "reason"])
+
+
+@benchmark("strip_kwargs")
+def _():
+    utils.strip_kwargs(KWARGS, ["duration", "reason"])
+
+
+@benchmark("schema.parse")
+def _():
+    mod._mod_schema.parse(KWARGS)
+
+
+@benchmark("timezone.code")
+def _():
+    general._get_timezone_by_code("JST")
+
+
+@benchmark("timezone.invalid")
+def _():
+    try:
+        general._get_timezone_by_code("XYZ")
+    except ValueError:
+        pass
+
+
+@benchmark("crop_and_shift_img")
+def _():
+    general._crop_and_shift_img(STROKE_STRIP)
+
+
+@benchmark("scrape.jisho_kanji")
+def _():
+    general._jisho_kanji_info(BOT, html.fromstring(
+        BOT.single_flight.pages["jisho_kanji.html"]))
+
+
+@benchmark("scrape.jisho_sentences")
+def _():
+    BOT.single_flight.page = "jisho_sentences.html"
+    _run(general._jisho_sentences(BOT, 20, "勉強", FakeMessage()))
+
+
+@benchmark("scrape.jisho_names")
+def _():
+    BOT.single_flight.page = "jisho_names.html"
+    _run(general._jisho_names(BOT, 20, "田中", FakeMessage()))
+
+
+@benchmark("scrape.alc")
+def _():
+    BOT.single_flight.page = "alc.html"
+    cmd = utils.get_cmd(Discordant, "alc")
+    _run(getattr(Discordant, cmd.name)(BOT, (40, "study"), FakeMessage()))
+
+
+@benchmark("scrape.yourei")
+def _():
+    BOT.single_flight.page = "yourei.html"
+    _run(general._example_sentence_search(
+        BOT, (60, "勉強", True), FakeMessage(), "yourei",
+        "http://yourei.jp/"))
+
+
+def measure(func, repeat=5, min_time=0.2):
+    """returns the per-call times of the fastest and median of repeat runs,
+    each run calling func enough times to take at least min_time."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {"min": min(times), "median": statistics.median(times),
+            "number": number, "repeat": repeat}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print("\n{:<28} {:>12} {:>12} {:>8}".format(
+        "benchmark", "baseline", "current", "ratio"))
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        old = baseline["benchmarks"][name]["min"]
+        ratio = result["min"] / old if old else float("inf")
+        flag = " !" if ratio > threshold else ""
+        print("{:<28} {:>10.2f}us {:>10.2f}us {:>7.2f}x{}".format(
+            name, old * 1e6, result["min"] * 1e6, ratio, flag))
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("names", nargs="*",
+                        help="only run benchmarks starting with these")
+    parser.add_argument("-o", "--output", help="result json path")
+    parser.add_argument("-c", "--compare", help="baseline result json")
+    parser.add_argument("-t", "--threshold", type=float, default=1.1,
+                        help="slowdown ratio counted as a regression")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {"commit": git_commit(),
+               "date": datetime.utcnow().isoformat(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "benchmarks": {}}
+    for name, func in _benchmarks:
+        if args.names and not name.startswith(tuple(args.names)):
+            continue
+        result = measure(func, args.repeat)
+        results["benchmarks"][name] = result
+        print("{:<28} {:>12.2f}us (x{})".format(
+            name, result["min"] * 1e6, result["number"]))
+
+    output = args.output or os.path.join(
+        RESULTS, results["commit"] + ".json")
+    if not os.path.exists(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Saved results to", output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("Regressions:", ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
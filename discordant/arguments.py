@@ -0,0 +1,138 @@
+import re
+from collections import namedtuple
+
+Positional = namedtuple('Positional', ['name', 'type', 'optional', 'rest',
+                                       'default', 'min', 'max', 'label'])
+Kwarg = namedtuple('Kwarg', ['name', 'type', 'default', 'min', 'max',
+                             'label'])
+
+# a word, or a quoted string, optionally after a key=
+_TOKEN = re.compile(r'''(?:(\w+)=)?("[^"]*"|'[^']*'|\S+)''')
+
+
+class ArgumentError(Exception):
+    pass
+
+
+def boolean(s):
+    if s.lower() in ("true", "t", "yes", "y", "1", "on"):
+        return True
+    if s.lower() in ("false", "f", "no", "n", "0", "off"):
+        return False
+    raise ValueError(s)
+
+
+_type_labels = {int: "int", float: "number", boolean: "bool", str: "str"}
+
+
+def positional(name, type=str, optional=False, rest=False, default=None,
+               min=None, max=None, label=None):
+    """rest takes every positional word left over, as it was typed (a
+    kwarg in between them is left out)."""
+    return Positional(name, type, optional, rest, default, min, max,
+                      label or name)
+
+
+def kwarg(name, type=str, default=None, min=None, max=None, label=None):
+    return Kwarg(name, type, default, min, max,
+                 label or _type_labels.get(type, name))
+
+
+def _unquote(s):
+    if len(s) > 1 and s[0] == s[-1] and s[0] in "\"'":
+        return s[1:-1]
+    return s
+
+
+def _convert(arg, value):
+    try:
+        value = arg.type(value)
+    except ValueError:
+        raise ArgumentError("Invalid {}: {}".format(arg.name, value))
+    if arg.min is not None and value < arg.min:
+        raise ArgumentError("{} must be at least {}.".format(
+            arg.name, arg.min))
+    if arg.max is not None and value > arg.max:
+        raise ArgumentError("{} must be at most {}.".format(
+            arg.name, arg.max))
+    return value
+
+
+class Schema:
+    """a command's arguments. parse splits the argument string in one pass
+    and gives a namedtuple with a field for each positional and kwarg
+    (a kwarg named like a positional fills the same field)."""
+
+    def __init__(self, *positionals, kwargs=()):
+        self.positionals = positionals
+        self.kwargs = {x.name: x for x in kwargs}
+        self._kwarg_order = [x.name for x in kwargs]
+        names = [x.name for x in positionals]
+        self.Args = namedtuple('Args', names + [
+            x for x in self._kwarg_order if x not in names])
+        self._defaults = {x.name: x.default for x in kwargs}
+        self._defaults.update((x.name, x.default) for x in positionals)
+
+    def syntax(self, name):
+        """the usage line for help, in the !help syntax."""
+        parts = ["!" + name]
+        for arg in self.positionals:
+            parts.append(("[{}]" if arg.optional else "<{}>").format(
+                arg.label))
+        names = [x.name for x in self.positionals]
+        for key in self._kwarg_order:
+            # one that can also be given by position is already listed
+            if key not in names:
+                parts.append("[{}={}]".format(key, self.kwargs[key].label))
+        return " ".join(parts)
+
+    def parse(self, args):
+        words, gaps, values = [], [], {}
+        end = None  # where the last word ended, if it was the last token
+        for match in _TOKEN.finditer(args):
+            key = match.group(1)
+            if key in self.kwargs:
+                values[key] = _convert(self.kwargs[key],
+                                       _unquote(match.group(2)))
+                end = None
+            else:
+                # the spacing before each word, for rest
+                gaps.append(" " if end is None else args[end:match.start()])
+                words.append(match.group(0))
+                end = match.end()
+        required = sum(1 for x in self.positionals
+                       if not x.optional and x.name not in values)
+        i = 0
+        for arg in self.positionals:
+            if arg.name in values:
+                # given as a kwarg, so the words are for the others
+                if arg.rest and i < len(words):
+                    raise ArgumentError(
+                        "{} was given twice.".format(arg.label))
+                continue
+            if not arg.optional:
+                required -= 1
+            if arg.rest:
+                if i < len(words):
+                    value = words[i] + "".join(
+                        x + y for x, y in zip(gaps[i + 1:], words[i + 1:]))
+                    i = len(words)
+                    values[arg.name] = _convert(arg, value)
+                elif not arg.optional:
+                    raise ArgumentError("Missing {}.".format(arg.label))
+                continue
+            if i >= len(words) or arg.optional and len(words) - i <= required:
+                # optional ones are skipped to leave the required ones a word
+                if not arg.optional:
+                    raise ArgumentError("Missing {}.".format(arg.label))
+                continue
+            if arg.optional and arg.type is not str:
+                try:
+                    arg.type(_unquote(words[i]))
+                except ValueError:
+                    continue
+            values[arg.name] = _convert(arg, _unquote(words[i]))
+            i += 1
+        if i < len(words):
+            raise ArgumentError("Unexpected argument: " + words[i])
+        return self.Args(**dict(self._defaults, **values))
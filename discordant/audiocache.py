@@ -0,0 +1,118 @@
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+NOT_FOUND = object()
+
+_cache = None
+
+
+class AudioCache:
+    """size capped lru cache of audio files on disk. 404s are cached as
+    empty marker files, which expire after negative_ttl seconds."""
+
+    def __init__(self, directory, max_size, negative_ttl=7 * 24 * 60 * 60):
+        self.directory = directory
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # file name -> size, oldest first
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        files = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith((".mp3", ".404")) and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self.size += size
+
+    @staticmethod
+    def key(kana, kanji=None):
+        return hashlib.sha1(
+            (kana + "\0" + (kanji or "")).encode("utf-8")).hexdigest()
+
+    def get(self, kana, kanji=None):
+        """returns the path of a cached file, NOT_FOUND for a cached 404,
+        or None if nothing is cached."""
+        key = self.key(kana, kanji)
+        for name in (key + ".mp3", key + ".404"):
+            if name not in self._entries:
+                continue
+            path = os.path.join(self.directory, name)
+            if name.endswith(".404") and \
+                    os.path.getmtime(path) + self.negative_ttl < time.time():
+                self._remove(name)
+                break
+            self._entries.move_to_end(name)
+            # mtime doubles as the access time across restarts
+            os.utime(path, None)
+            self.hits += 1
+            return path if name.endswith(".mp3") else NOT_FOUND
+        self.misses += 1
+        return None
+
+    def put_not_found(self, kana, kanji=None):
+        name = self.key(kana, kanji) + ".404"
+        open(os.path.join(self.directory, name), "wb").close()
+        self._add(name, 0)
+
+    async def put_response(self, kana, kanji, response, chunk_size=65536):
+        """streams an aiohttp response body to disk and returns its path."""
+        name = self.key(kana, kanji) + ".mp3"
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = await response.content.read(chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    size += len(chunk)
+            path = os.path.join(self.directory, name)
+            os.replace(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+        self._add(name, size)
+        return path
+
+    def _add(self, name, size):
+        if name in self._entries:
+            self._remove_entry(name)
+        self._entries[name] = size
+        self.size += size
+        while self.size > self.max_size and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+
+    def _remove_entry(self, name):
+        self.size -= self._entries.pop(name)
+
+    def _remove(self, name):
+        self._remove_entry(name)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def get_audio_cache(self):
+    global _cache
+    if _cache is None:
+        cfg = self.config.get("cache", {}).get("audio", {})
+        directory = cfg.get("directory", "cache/audio")
+        if self.shard_id is not None:
+            # shard processes would evict each other's files otherwise
+            directory = os.path.join(directory, "shard{}".format(
+                self.shard_id))
+        _cache = AudioCache(directory,
+                            cfg.get("max_size", 100 * 2 ** 20),
+                            cfg.get("negative_ttl", 7 * 24 * 60 * 60))
+    return _cache
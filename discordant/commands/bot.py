@@ -3,12 +3,19 @@ import os
 import os.path
 import time
 
-import aiohttp
 import discord.game
-import psutil
 
+import discordant.arguments as arguments
+import discordant.export as export
+import discordant.guilds as guilds
+import discordant.monitor as monitor
+import discordant.perf as perf
 import discordant.utils as utils
+import discordant.web as web
 from discordant import Discordant
+from discordant.lazy import lazy_import
+
+psutil = lazy_import("psutil")
 
 
 @Discordant.register_command("client", ["settings"],
@@ -25,9 +32,8 @@ async def _client_settings(self, args, message):
     if "avatar" in kwargs:
         if utils.is_url(kwargs["avatar"]):
             try:
-                with aiohttp.ClientSession() as session:
-                    async with session.get(kwargs["avatar"]) as response:
-                        kwargs["avatar"] = await response.read()
+                kwargs["avatar"] = await web.fetch(
+                    self, kwargs["avatar"], "bytes")
             except Exception as e:
                 await self.send_message(message.channel,
                                         "Request failed: " + str(e))
@@ -93,14 +99,180 @@ async def _stats(self, args, message):
     uptime = time.time() - process.create_time()
     m, s = divmod(uptime, 60)
     h, m = divmod(m, 60)
+    output = ("uptime: {} hours, {} minutes, {} seconds" +
+              "\ncommands parsed: {}" +
+              "\nupstream requests: {} ({} saved by sharing)" +
+              "\nmemory usage: {} MiB").format(
+        int(h), int(m), int(s),
+        self.commands_parsed,
+        self.single_flight.calls, self.single_flight.shared,
+        process.memory_info().rss / float(2 ** 20))
+    output += "\noutbound queue: {} texts in {} channels".format(
+        self.outbox.depth, len(self.outbox.busiest(len(self.outbox.queues))))
+    output += "\npending deletions: {} ({} deleted in {} requests)".format(
+        self.deletions.depth, self.deletions.deleted, self.deletions.requests)
+    loop_monitor = monitor.get_monitor()
+    if loop_monitor:
+        output += ("\nloop lag (p50/p95/p99): {:.1f}/{:.1f}/{:.1f} ms" +
+                   "\nloop stalls: {}").format(
+            *[x * 1000 for x in loop_monitor.percentiles(50, 95, 99)],
+            loop_monitor.stalls)
+    await self.send_message(message.channel, output)
+
+
+@Discordant.register_command("perf", perm_func=utils.is_controller)
+async def _perf(self, args, message):
+    """!perf [command/events]
+    displays per command (or event handler) latency and upstream time,
+    slowest first."""
+    events = args == "events"
+    stats_dict = self.metrics.handlers if events else self.metrics.commands
+    rows = sorted(stats_dict.items(), key=lambda x: x[1].total, reverse=True)
+    if args and not events:
+        rows = [x for x in rows if x[0] == args]
+    if not rows:
+        await self.send_message(message.channel, "No calls recorded.")
+        return
+    width = max(12, *[len(x[0]) for x in rows])
+    output = ("{:<" + str(width) + "} {:>6} {:>4} {:>7} {:>7} {:>7} {:>7}" +
+              " {:>7} {:>7}").format(
+        "handler" if events else "command", "count", "err", "p50", "p95",
+        "p99", "http", "mongo", "discord")
+    for name, stats in rows:
+        ms = [x * 1000 for x in stats.percentiles(50, 95, 99)] + [
+            stats.upstream[x] * 1000 / stats.count for x in perf.UPSTREAMS]
+        output += ("\n{:<" + str(width) + "} {:>6} {:>4}" +
+                   " {:>7.1f}" * 6).format(name, stats.count, stats.errors,
+                                           *ms)
+    await utils.send_long_message(
+        self, message.channel,
+        utils.python_format(output + "\n(latency and mean upstream time "
+                                     "per call in ms)"))
+
+
+@Discordant.register_command("tasks", perm_func=utils.is_controller)
+async def _tasks(self, args, message):
+    """!tasks [cancel <name>]
+    lists or cancels the bot's background tasks."""
+    split = args.split()
+    if len(split) == 2 and split[0] == "cancel":
+        await self.send_message(
+            message.channel,
+            "Cancelled " + split[1] + "." if self.tasks.cancel(split[1])
+            else "No running task named " + split[1] + ".")
+        return
+    if not self.tasks.tasks:
+        await self.send_message(message.channel, "No background tasks.")
+        return
+    output = "\n".join([
+        "{} - {}, started {} ago, {} runs, {} failures{}".format(
+            x.name, "running" if x.running else "stopped",
+            _duration_str(time.time() - x.started), x.runs, x.failures,
+            " (last: {})".format(x.last_error) if x.last_error else "")
+        for x in sorted(self.tasks.tasks.values(), key=lambda x: x.name)])
+    await utils.send_long_message(
+        self, message.channel, utils.python_format(output))
+
+
+@Discordant.register_command("guilds", ["servers"],
+                             perm_func=utils.is_controller)
+async def _guilds(self, args, message):
+    """!guilds
+    lists the configured servers with their background tasks and the
+    approximate memory their cached objects take up."""
+    if not self.guilds:
+        await self.send_message(message.channel, "No configured servers.")
+        return
+    usage = await self.loop.run_in_executor(
+        None, guilds.memory_usage, self)
+    output = ""
+    for server_id, guild in self.guilds.items():
+        tasks = [x for x in self.tasks.tasks.values()
+                 if x.running and server_id in x.name.split(":")]
+        output += ("{} ({}): {} members, {} channels, {} running tasks, "
+                   "{}\n").format(
+            guild.server.name, server_id, len(guild.server.members),
+            len(guild.server.channels), len(tasks),
+            "{:.1f} MiB".format(usage[server_id] / float(2 ** 20))
+            if server_id in usage else "memory unknown")
+    await utils.send_long_message(
+        self, message.channel, utils.python_format(output))
+
+
+@Discordant.register_command(
+    "export", context=True, perm_func=utils.is_controller,
+    schema=arguments.Schema(
+        arguments.positional("collection", export.collection_name,
+                             label="punishments/logs"),
+        kwargs=[arguments.kwarg("since", export.parse_date,
+                                label="YYYY-MM-DD"),
+                arguments.kwarg("until", export.parse_date,
+                                label="YYYY-MM-DD"),
+                arguments.kwarg("user"),
+                arguments.kwarg("channel"),
+                arguments.kwarg("format", export.export_format,
+                                default="csv", label="csv/jsonl")]))
+async def _export(self, args, message, context):
+    """exports this server's punishments or message logs to a gzipped file,
+    which is uploaded here if it's small enough and kept on disk otherwise."""
+    user_id = channel_id = None
+    if args.user:
+        user = utils.get_user(args.user, context.server.members, message)
+        user_id = user.id if user else args.user
+    if args.channel:
+        channel = utils.get_channel(
+            args.channel, context.server.channels, message)
+        channel_id = channel.id if channel else args.channel
+    cfg = self.config.get("export", {})
+    path = export.default_path(cfg.get("directory", "exports"),
+                               args.collection, args.format,
+                               context.server.id)
+    query = export.build_query(args.collection, context.server.id,
+                               args.since, args.until, user_id, channel_id)
+    try:
+        count = await export.export(self.mongodb, args.collection, path,
+                                    args.format, query, self.loop)
+    except Exception as e:
+        await self.send_message(message.channel, "Export failed: " + str(e))
+        return
+    text = "Exported {} documents.".format(count)
+    if os.path.getsize(path) <= cfg.get("upload_limit", 8 * 2 ** 20):
+        await self.send_file(message.channel, path, content=text)
+    else:
+        await self.send_message(message.channel, "{} Too large to upload, "
+                                "saved to {}".format(text, path))
+
+
+@Discordant.register_command(
+    "reload", perm_func=utils.is_controller,
+    schema=arguments.Schema(arguments.positional("module")))
+async def _reload(self, args, message):
+    """re-imports a command module (e.g. general or events) and swaps in its
+    commands, handlers and events without reconnecting. caches and running
+    background tasks are kept; if the new code fails, the old stays."""
+    start = time.perf_counter()
+    try:
+        module = self.reload_module(args.module)
+    except ValueError as e:
+        await self.send_message(message.channel, str(e))
+        return
+    except RuntimeError as e:
+        await self.send_message(
+            message.channel, "Reload failed, kept the old version:\n" +
+            utils.python_format(e))
+        return
+    commands, handlers, events = self.module_registrations(module.__name__)
     await self.send_message(
         message.channel,
-        ("uptime: {} hours, {} minutes, {} seconds" +
-         "\ncommands parsed: {}" +
-         "\nmemory usage: {} MiB").format(
-            int(h), int(m), int(s),
-            self.commands_parsed,
-            process.memory_info().rss / float(2 ** 20)))
+        "Reloaded {}: {} commands, {} handlers, {} events in {:.0f} ms."
+        .format(module.__name__, len(commands), len(handlers), len(events),
+                (time.perf_counter() - start) * 1000))
+
+
+def _duration_str(seconds):
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return "{}h {}m {}s".format(h, m, s)
 
 
 @Discordant.register_command("userinfo", ["uinfo", "u", "ui"], context=True,
@@ -1,19 +1,28 @@
-import asyncio
 import io
+import logging
 import math
 import re
 import urllib.parse
-from datetime import datetime
+from datetime import datetime, timedelta
 
-import aiohttp
 import discord.game
-import pytz
-from PIL import Image
-from lxml import html
-from pytz import timezone
 
+import discordant.arguments as arguments
+import discordant.audiocache as audiocache
+import discordant.kanji as kanji
+import discordant.rollups as rollups
+import discordant.sentences as sentences
 import discordant.utils as utils
+import discordant.web as web
 from discordant import Discordant
+from discordant.lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+html = lazy_import("lxml.html")
+mongo_errors = lazy_import("pymongo.errors")
+pytz = lazy_import("pytz")
+
+logger = logging.getLogger(__name__)
 
 
 @Discordant.register_command("help", ["info", "h", "cmds", "commands"],
@@ -21,14 +30,6 @@ from discordant import Discordant
 async def _help(self, args, message, context):
     """!help [command/section]
     displays command help and information."""
-    sections = {}
-    for cmd in self._commands.values():
-        if cmd.perm_func and not cmd.perm_func(self, context.author):
-            continue
-        if cmd.section in sections:
-            sections[cmd.section].append(cmd)
-        else:
-            sections[cmd.section] = [cmd]
     cmd = utils.get_cmd(self, args) if args else None
     if cmd:
         if cmd.perm_func and not cmd.perm_func(self, context.author):
@@ -37,31 +38,15 @@ async def _help(self, args, message, context):
             return
         await self.send_message(message.channel, cmd.help)
         return
-    if args:
-        if args in sections:
-            sections = {args: sections[args]}
-        else:
-            await self.send_message(message.channel,
-                                    "Command could not be found.")
-            return
+    menus = self.help_menus(context.author)
+    if (args or None) not in menus:
+        await self.send_message(message.channel,
+                                "Command could not be found.")
+        return
     msg = None
     try:
-        await utils.send_long_message(self, message.author, _help_menu(
-            sections))
-        await self.send_message(
-            message.author,
-            "type !help [command/section] to display more information "
-            "about a certain command or section.")
-        await self.send_message(
-            message.author,
-            "**command help syntax**:\n"
-            "[]     optional argument\n"
-            "<>    required argument\n"
-            "\\*       any number of arguments\n"
-            "k=v  kwargs style argument (each key-value pair is "
-            "separated by space, and the key and value are separated by the"
-            " \"=\" character).\n"
-            "\\*\\*     any number of kwargs")
+        await utils.send_long_message(
+            self, message.author, menus[args or None])
     except discord.errors.Forbidden:
         msg = await self.send_message(
             message.channel, "Please enable your PMs.")
@@ -69,18 +54,7 @@ async def _help(self, args, message, context):
         if not msg:
             msg = await self.send_message(
                 message.channel, "Check your PMs.")
-        await _delete_after(self, 5, [message, msg])
-
-
-def _help_menu(sections):
-    output = "**commands**:"
-    for section, cmd_list in sections.items():
-        tab_4 = " " * 4
-        output += "\n  __{}__:\n".format(section) + \
-                  "\n".join([tab_4 + "*{}* - ".format(cmd.aliases[0]) +
-                             cmd.help.replace("\n", tab_4 + "\n").split(
-                                 " - ", 1)[1] for cmd in cmd_list])
-    return output
+        await self.deletions.schedule([message, msg], 5)
 
 
 def _tz_args(args):
@@ -91,18 +65,19 @@ def _tz_args(args):
     return len_s == 1 or len_s >= 3, split
 
 
+def _get_timezone_by_code(code):
+    code = code.upper()
+    for tz_str in pytz.all_timezones:
+        tz = pytz.timezone(tz_str)
+        if tz.tzname(datetime.now()) == code:
+            return tz
+    raise ValueError(code + ": not a valid time zone code")
+
+
 @Discordant.register_command("timezone", ["tz"], arg_func=_tz_args)
 async def _convert_timezone(self, args_split, message):
     """!timezone <time> <from> <\*to> or !timezone <\*timezone>
     displays time in given timezone(s)."""
-    def get_timezone_by_code(code):
-        code = code.upper()
-        for tz_str in pytz.all_timezones:
-            tz = timezone(tz_str)
-            if tz.tzname(datetime.now()) == code:
-                return tz
-        raise ValueError(code + ": not a valid time zone code")
-
     def read_time(dt_str):
         formats = ["%I%p", "%I:%M%p", "%H", "%H:%M"]
         for f in formats:
@@ -131,14 +106,14 @@ async def _convert_timezone(self, args_split, message):
             "ahead" if delta > 0 else "behind")
 
     def dt_format(dt, tz_str, relative):
-        new_dt = dt.astimezone(get_timezone_by_code(tz_str))
+        new_dt = dt.astimezone(_get_timezone_by_code(tz_str))
         return new_dt.strftime("%I:%M %p %Z") + (
             ", " + relative_date_str(dt, new_dt) if relative else "")
 
     try:
         is_t = is_time(args_split[0])
         if is_t:
-            dt = get_timezone_by_code(args_split[1]).localize(read_time(
+            dt = _get_timezone_by_code(args_split[1]).localize(read_time(
                 args_split[0]))
             tz_strs = args_split[2:]
             output = "{} is{}".format(
@@ -155,27 +130,18 @@ async def _convert_timezone(self, args_split, message):
                                 ": Not a valid time format or time zone code.")
 
 
-def _search_args(args, keys=None):
-    if not utils.has_args(args):
-        return False
-    limit = 1
-    query = args
-    kwargs = {}
-    if keys:
-        kwargs = utils.get_kwargs(args, keys)
-        query = utils.strip_kwargs(args, keys)
-    result = re.match(r"^([0-9]+)\s+(.*)$", query)
-    if result:
-        limit, query = [result.group(x) for x in (1, 2)]
-    args_tuple = (int(limit), query) + ((kwargs,) if keys else ())
-    return True, args_tuple
+_search_schema = arguments.Schema(
+    arguments.positional("limit", int, optional=True, default=1, min=1),
+    arguments.positional("query", rest=True))
+_sentence_search_schema = arguments.Schema(
+    *_search_schema.positionals,
+    kwargs=[arguments.kwarg("context", arguments.boolean, default=False)])
 
 
 @Discordant.register_command("jisho", ["j", "kanji", "k"],
-                             arg_func=_search_args, context=True)
+                             schema=_search_schema, context=True)
 async def _jisho_search(self, args_tuple, message, context):
-    """!jisho [limit] <query>
-    searches japanese-english dictionary <http://jisho.org>.
+    """searches japanese-english dictionary <http://jisho.org>.
     see <http://jisho.org/docs> for search options."""
     limit, query = args_tuple
     if context.cmd_name[0] == "k":
@@ -192,9 +158,7 @@ async def _jisho_search(self, args_tuple, message, context):
     url = "http://jisho.org/api/v1/search/words?keyword=" + \
           urllib.parse.quote(query, encoding="utf-8")
     try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.json()
+        data = await web.fetch(self, url, "json")
     except Exception as e:
         await self.send_message(message.channel, "Request failed: " + str(e))
         return
@@ -209,7 +173,7 @@ async def _jisho_search(self, args_tuple, message, context):
         return f.format(*obj.values()) if len(obj) == 1 else f.format(**obj)
 
     embed = discord.Embed(
-        colour=self.default_server.get_member(self.user.id).colour,
+        colour=utils.bot_colour(self, message.server),
         url="http://jisho.org/search/" + query)
 
     for result in results:
@@ -261,20 +225,27 @@ async def _jisho_search(self, args_tuple, message, context):
 
 
 async def _jisho_kanji(self, limit, query, message):
+    kanjidic = await kanji.get_kanjidic(self)
+    if kanjidic:
+        characters = [x for x in query.replace("#kanji", "") if x in kanjidic]
+        if characters:
+            for character in characters[:limit]:
+                await self.send_message(
+                    message.channel, embed=await _local_kanji_info(
+                        self, kanjidic[character], message.server))
+            return
     url = "http://jisho.org/search/" + urllib.parse.quote(
         query, encoding="utf-8")
     try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.text()
+        tree = await web.fetch(self, url, "html")
     except Exception as e:
         await self.send_message(message.channel, "Request failed: " + str(e))
         return
-    tree = html.fromstring(data)
     info_div = tree.xpath('//div[@class="kanji details"]')
     if info_div:
         await self.send_message(
-            message.channel, embed=_jisho_kanji_info(self, tree))
+            message.channel,
+            embed=_jisho_kanji_info(self, tree, message.server))
         return
     results_div = tree.xpath('//div[@class="kanji_light_block"]')
     if not results_div:
@@ -286,21 +257,19 @@ async def _jisho_kanji(self, limit, query, message):
         k_url = result_div.xpath(
             'a[@class="light-details_link"]')[0].attrib["href"]
         try:
-            with aiohttp.ClientSession() as session:
-                async with session.get(k_url) as response:
-                    k_data = await response.text()
+            k_tree = await web.fetch(self, k_url, "html")
         except Exception as e:
             await self.send_message(
                 message.channel, "Request failed: {}, {}".format(k_url, e))
             continue
         await self.send_message(
             message.channel,
-            embed=_jisho_kanji_info(self, html.fromstring(k_data)))
+            embed=_jisho_kanji_info(self, k_tree, message.server))
     # await utils.send_long_message(
     #     self, message.channel, output, message.server is not None)
 
 
-def _jisho_kanji_info(self, tree):
+def _jisho_kanji_info(self, tree, server=None):
     details = tree.xpath('//div[@class="kanji details"]')[0]
     character = utils.remove_spaces(
         details.xpath('//h1[@class="character"]')[0].text_content())
@@ -320,32 +289,58 @@ def _jisho_kanji_info(self, tree):
     parts_div = radicals_divs[1]
     parts = "Parts: " + ", ".join(
         utils.remove_spaces(parts_div.xpath("./dd")[0].text_content(), True))
+    return _kanji_embed(self, character, meanings, strokes, stats, readings,
+                        radical, parts, server)
+    # return "**{}** {}\n*{}. {}*\n{}\n{}\n{}".format(
+    #     character, meanings, strokes, stats, readings, radical, parts)
+
+
+async def _local_kanji_info(self, info, server=None):
+    readings = []
+    for name, lst in [("Kun", info.kun), ("On", info.on),
+                      ("Nanori", info.nanori)]:
+        if lst:
+            readings.append(name + ": " + ", ".join(lst))
+    radical = "Radical: " + ("{} ({})".format(
+        kanji.radical_char(info.radical), info.radical)
+                             if info.radical else "unknown")
+    svg = kanji.kanjivg_file(self, info.literal)
+    parts = await self.loop.run_in_executor(
+        None, kanji.kanjivg_parts, svg) if svg else []
+    return _kanji_embed(
+        self, info.literal, ", ".join(info.meanings),
+        "{} strokes".format(info.strokes), kanji.kanji_stats(info),
+        "\n".join(readings) or "None", radical,
+        "Parts: " + (", ".join(parts) if parts else info.literal), server)
+
+
+def _kanji_embed(self, character, meanings, strokes, stats, readings,
+                 radical, parts, server=None):
     embed = discord.Embed(
         title=character,
         url="http://jisho.org/search/" + character + "%23kanji",
-        colour=self.default_server.get_member(self.user.id).colour,
+        colour=utils.bot_colour(self, server),
         description="**{}**\n{}. {}".format(character, strokes, stats),
         image="")
-    embed.add_field(name="Meanings:", value=meanings, inline=False)
+    embed.add_field(name="Meanings:", value=meanings or "None", inline=False)
     embed.add_field(name="Readings:", value=readings, inline=False)
     embed.add_field(
         name="Radical/Parts:",
         value="{}\n{}".format(radical, parts), inline=False)
     return embed
-    # return "**{}** {}\n*{}. {}*\n{}\n{}\n{}".format(
-    #     character, meanings, strokes, stats, readings, radical, parts)
 
 async def _jisho_sentences(self, limit, query, message, sentence_url=None):
+    if not sentence_url and await _local_sentences(
+            self, limit, query.replace("#sentences", ""), message, True,
+            "**{i}.** "):
+        return
     url = sentence_url or "http://jisho.org/search/" + urllib.parse.quote(
         query, encoding="utf-8")
     try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.text()
+        tree = await web.fetch(self, url, "html")
     except Exception as e:
         await self.send_message(message.channel, "Request failed: " + str(e))
         return
-    tree = html.fromstring(data)
     sentences = tree.xpath('//ul[@class="sentences"]') or tree.xpath(
         '//article[@class="sentences columns small-8"]')
     if not sentences:
@@ -367,13 +362,10 @@ async def _jisho_names(self, limit, query, message):
     url = "http://jisho.org/search/" + urllib.parse.quote(
         query, encoding="utf-8")
     try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.text()
+        tree = await web.fetch(self, url, "html")
     except Exception as e:
         await self.send_message(message.channel, "Request failed: " + str(e))
         return
-    tree = html.fromstring(data)
     names = tree.xpath('//div[@class="names"]')
     if not names:
         await self.send_message(message.channel, "No results found.")
@@ -392,18 +384,15 @@ async def _jisho_names(self, limit, query, message):
         self, message.channel, output, message.server is not None)
 
 
-@Discordant.register_command("alc", arg_func=_search_args)
+@Discordant.register_command("alc", schema=_search_schema)
 async def _alc_search(self, args_tuple, message):
-    """!alc [limit] <query>
-    searches english-japanese dictionary <http://alc.co.jp>."""
+    """searches english-japanese dictionary <http://alc.co.jp>."""
     limit, query = args_tuple
     url = "http://eow.alc.co.jp/search?q=" + \
           urllib.parse.quote(
               re.sub(r"\s+", "+", query), encoding="utf-8", safe="+")
     try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.text()
+        data = await web.fetch(self, url)
     except Exception as e:
         await self.send_message(message.channel, "Request failed: " + str(e))
         return
@@ -469,19 +458,43 @@ async def _alc_link(self, match, message):
     await _dict_search_link(self, match, message, "alc", 1)
 
 
+async def _local_sentences(self, limit, query, message, translate, fmt):
+    try:
+        index = await sentences.get_sentence_index(self)
+    except Exception:
+        # a broken corpus file shouldn't take the scraped results down too
+        logger.exception("Loading the Tatoeba sentence index failed")
+        return False
+    if not index:
+        return False
+    results = index.search(query, limit)
+    if not results:
+        return False
+    highlight = sentences.highlight_regex(query)
+    fmt = (fmt if len(results) > 1 else "") + "{jp}" + (
+        " {en}" if translate else "")
+    await utils.send_long_message(
+        self, message.channel,
+        "\n".join([fmt.format(i=i + 1,
+                               jp=highlight.sub(r"**\1**", x.japanese),
+                               en=x.english)
+                   for i, x in enumerate(results)]),
+        message.server is not None)
+    return True
+
+
 async def _example_sentence_search(self, args_tuple, message, cmd, url):
-    limit, query, kwargs = args_tuple
-    context = kwargs["context"].lower() in ("true", "t", "yes", "y", "1") \
-        if "context" in kwargs else False
+    limit, query, context = args_tuple
+    # tatoeba has no surrounding sentences, so context shows the translation
+    if cmd == "yourei" and await _local_sentences(
+            self, limit, query, message, context, "{i}. "):
+        return
     url = url + urllib.parse.quote(re.sub(r"\s+", "-", query), encoding="utf-8")
     try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.text()
+        tree = await web.fetch(self, url, "html")
     except Exception as e:
         await self.send_message(message.channel, "Request failed: " + str(e))
         return
-    tree = html.fromstring(data)
     query = '//li[contains(@class, "sentence") and span[@class="the-sentence"]]'
     results = tree.xpath(query)[:limit]
     if not results:
@@ -494,15 +507,15 @@ async def _example_sentence_search(self, args_tuple, message, cmd, url):
         return ("" if japanese else " ").join(
             lst[0].xpath("text() | */text()")) if lst else ""
 
+    match = re.search(r'"([^"]*)"', tree.xpath("//script[1]/text()")[0])
+    pattern = re.compile(match.group(1).replace("\\\\", "\\"), re.I)
+
     def result_text(element):
-        text = sentence_text(element)
-        match = re.search(r'"([^"]*)"', tree.xpath("//script[1]/text()")[0])
-        pattern = match.group(1).replace("\\\\", "\\")
-        text = re.sub(pattern, r"**\1**", text, flags=re.I)
+        text = pattern.sub(r"**\1**", sentence_text(element))
         if context:
-            sentences = [x for x in [sentence_text(element, "prev"), text,
-                                     sentence_text(element, "next")] if x]
-            text = ("" if japanese else " ").join(sentences)
+            texts = [x for x in [sentence_text(element, "prev"), text,
+                                 sentence_text(element, "next")] if x]
+            text = ("" if japanese else " ").join(texts)
         return text
 
     await utils.send_long_message(
@@ -513,22 +526,16 @@ async def _example_sentence_search(self, args_tuple, message, cmd, url):
         message.server is not None)
 
 
-def _search_args_context(args):
-    return _search_args(args, ["context"])
-
-
-@Discordant.register_command("yourei", arg_func=_search_args_context)
+@Discordant.register_command("yourei", schema=_sentence_search_schema)
 async def _yourei_search(self, args_tuple, message):
-    """!yourei [limit] <query> [context=bool]
-    searches japanese example sentences from <http://yourei.jp>."""
+    """searches japanese example sentences from <http://yourei.jp>."""
     await _example_sentence_search(
         self, args_tuple, message, "yourei", "http://yourei.jp/")
 
 
-# @Discordant.register_command("nyanglish", arg_func=_search_args_context)
+# @Discordant.register_command("nyanglish", schema=_sentence_search_schema)
 #async def _nyanglish_search(self, args_tuple, message):
-#    """!nyanglish [limit] <query> [context=bool]
-#    searches english example sentences from <http://nyanglish.com>."""
+#    """searches english example sentences from <http://nyanglish.com>."""
 #    await _example_sentence_search(
 #        self, args_tuple, message, "nyanglish", "http://nyanglish.com/")
 
@@ -539,36 +546,50 @@ async def _yourei_link(self, match, message):
         self, match, message, match.group(1).split(".")[0], 2)
 
 
-async def _delete_after(self, time, args):
-    await asyncio.sleep(time)
-    f = getattr(
-        self, "delete_message" + ("s" if isinstance(args, list) else ""))
-    await f(args)
-
-
 @Discordant.register_command("strokeorder", ["so"], arg_func=utils.has_args)
 async def _stroke_order(self, args, message):
     """!strokeorder <character>
     shows stroke order for a kanji character."""
     file = str(ord(args[0])) + "_frames.png"
-    url = "http://classic.jisho.org/static/images/stroke_diagrams/" + file
     try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 404:
-                    await self.send_message(message.channel,
-                                            args[0] + ": Kanji not found.")
-                    return
-                raw_response = await response.read()
+        png = await self.single_flight.do(
+            ("strokeorder", args[0]),
+            lambda: _stroke_order_png(self, args[0], file))
+    except web.NotFound:
+        await self.send_message(message.channel,
+                                args[0] + ": Kanji not found.")
+        return
     except Exception as e:
         await self.send_message(message.channel, "Request failed: " + str(e))
         return
-    orig_image = Image.open(io.BytesIO(raw_response))
-    image = _crop_and_shift_img(orig_image)
+    await self.send_file(message.channel, io.BytesIO(png), filename=file)
+
+
+async def _stroke_order_png(self, character, file):
+    svg = kanji.kanjivg_file(self, character)
+    if svg:
+        return await self.loop.run_in_executor(
+            None, _render_stroke_order, svg)
+    url = "http://classic.jisho.org/static/images/stroke_diagrams/" + file
+    raw_response = await web.fetch(self, url, "bytes")
+    return await self.loop.run_in_executor(
+        None, _shift_stroke_order, raw_response)
+
+
+def _render_stroke_order(svg):
+    return _png_bytes(_crop_and_shift_img(kanji.render_stroke_frames(
+        kanji.kanjivg_strokes(svg))))
+
+
+def _shift_stroke_order(raw_response):
+    return _png_bytes(_crop_and_shift_img(Image.open(io.BytesIO(
+        raw_response))))
+
+
+def _png_bytes(image):
     buffer = io.BytesIO()
     image.save(buffer, format="PNG")
-    buffer.seek(0)
-    await self.send_file(message.channel, buffer, filename=file)
+    return buffer.getvalue()
 
 
 def _crop_and_shift_img(img):
@@ -595,9 +616,7 @@ async def _stroke_order(self, args, message):
     url = "http://jisho.org/api/v1/search/words?keyword=" + \
           urllib.parse.quote(query, encoding="utf-8")
     try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.json()
+        data = await web.fetch(self, url, "json")
     except Exception as e:
         await self.send_message(message.channel, "Request failed: " + str(e))
         return
@@ -606,25 +625,44 @@ async def _stroke_order(self, args, message):
         await self.send_message(message.channel, "No results found.")
         return
     japanese = data_arr[0]["japanese"][0]
-    url = "http://assets.languagepod101.com/dictionary/japanese/audiomp3.php?"
-    params = "kana=" + urllib.parse.quote(japanese["reading"], encoding="utf-8")
-    if len(japanese) > 1:
-        params += "&kanji=" + urllib.parse.quote(
-            japanese["word"], encoding="utf-8")
-    url += params
-    try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 404:
-                    await self.send_message(message.channel,
-                                            query + ": Audio file not found")
-                    return
-                buffer = io.BytesIO(await response.read())
-    except Exception as e:
-        await self.send_message(message.channel, "Request failed: " + str(e))
+    kana = japanese["reading"]
+    kanji_str = japanese["word"] if len(japanese) > 1 else None
+    cache = audiocache.get_audio_cache(self)
+    path = cache.get(kana, kanji_str)
+    if path is None:
+        url = "http://assets.languagepod101.com/dictionary/japanese/" \
+              "audiomp3.php?"
+        params = "kana=" + urllib.parse.quote(kana, encoding="utf-8")
+        if kanji_str:
+            params += "&kanji=" + urllib.parse.quote(
+                kanji_str, encoding="utf-8")
+        url += params
+        try:
+            path = await self.metrics.track("http", self.single_flight.do(
+                ("audio", kana, kanji_str),
+                lambda: _download_audio(
+                    web.get_transport(self), cache, url, kana, kanji_str)))
+        except Exception as e:
+            await self.send_message(
+                message.channel, "Request failed: " + str(e))
+            return
+    if path is audiocache.NOT_FOUND:
+        await self.send_message(message.channel,
+                                query + ": Audio file not found")
         return
-    await self.send_file(
-        message.channel, buffer, filename=query + ".mp3")
+    with open(path, "rb") as f:
+        await self.send_file(message.channel, f, filename=query + ".mp3")
+
+
+async def _download_audio(transport, cache, url, kana, kanji_str):
+    async with transport.get(url) as response:
+        if response.status == 404:
+            cache.put_not_found(kana, kanji_str)
+            return audiocache.NOT_FOUND
+        if response.status != 200:
+            # error pages mustn't end up cached as audio
+            raise web.BadStatus(url, response.status)
+        return await cache.put_response(kana, kanji_str, response)
 
 
 @Discordant.register_command("showvc", ["hidevc"], context=True)
@@ -639,7 +677,7 @@ async def _show_voice_channels_toggle(self, args, message, context):
         query,
         dict(query, value=show),
         upsert=True)
-    role = discord.utils.get(self.default_server.roles, name="VC Shown")
+    role = discord.utils.get(context.server.roles, name="VC Shown")
     if show:
         await self.add_roles(context.author, role)
         msg = await self.send_message(message.channel, ":white_check_mark:")
@@ -649,7 +687,7 @@ async def _show_voice_channels_toggle(self, args, message, context):
         msg = await self.send_message(
             message.channel, ":negative_squared_cross_mark:")
     if message.server:
-        await _delete_after(self, 5, [message, msg])
+        await self.deletions.schedule([message, msg], 5)
 
 
 # @Discordant.register_command("readingcircle", ["rc"], context=True)
@@ -670,7 +708,7 @@ async def _reading_circle(self, args, message, context):
     except (AttributeError, IndexError):
         msg = await self.send_message(message.channel, context.cmd.help)
     if message.server:
-        await _delete_after(self, 5, [message, msg])
+        await self.deletions.schedule([message, msg], 5)
 
 
 @Discordant.register_command("tag", ["t", "tags"], context=True)
@@ -792,42 +830,185 @@ async def _studying(self, args, message, context):
         await self.add_roles(context.author, role)
         msg = await self.send_message(message.channel, ":white_check_mark:")
     if message.server:
-        await _delete_after(self, 5, [message, msg])
+        await self.deletions.schedule([message, msg], 5)
 
 
-async def _google_search(self, args_tuple, message, cse_key):
+class _QuotaExhausted(Exception):
+    pass
+
+
+_quota_indexed = False
+
+
+def _cse_config(self):
+    return self.config.get("cache", {}).get("cse", {})
+
+
+def _quota_date():
+    # google resets custom search quotas at midnight pacific time
+    return datetime.now(pytz.timezone("US/Pacific")).strftime("%Y-%m-%d")
+
+
+async def _quota_used(self):
+    doc = await self.mongodb.cse_quota.find_one({"date": _quota_date()})
+    return doc["count"] if doc else 0
+
+
+async def _reserve_quota(self, limit):
+    """counts a query against today's quota, unless limit queries have been
+    made already. returns whether it did. the check and the count are one
+    update, so concurrent queries and other shards can't both take the
+    last one."""
+    global _quota_indexed
+    collection = self.mongodb.cse_quota
+    if not _quota_indexed:
+        await collection.create_index("date", unique=True)
+        _quota_indexed = True
+    for _ in range(2):
+        try:
+            await collection.find_one_and_update(
+                {"date": _quota_date(), "count": {"$lt": limit}},
+                {"$inc": {"count": 1}}, upsert=True)
+            return True
+        except mongo_errors.DuplicateKeyError:
+            # the upsert found today's count at the limit, or lost the race
+            # to create it, in which case trying again counts it
+            if await _quota_used(self) >= limit:
+                return False
+    return False
+
+
+async def _cse_items(self, cse_key, query):
+    cfg = _cse_config(self)
+    collection = self.mongodb.cse_cache
+    key = {"cse_key": cse_key, "query": " ".join(query.lower().split())}
+    cached = await collection.find_one(key)
+    if cached and datetime.utcnow() - cached["date"] < timedelta(
+            hours=cfg.get("ttl", 168)):
+        return cached["items"]
+    quota = cfg.get("daily_quota", 100)
+    # keep the rest of the quota for queries nobody has made before
+    if not await _reserve_quota(
+            self, quota - cfg.get("reserve", 10) if cached else quota):
+        if cached:
+            return cached["items"]
+        raise _QuotaExhausted()
     api_key = self.config["api-keys"]["google"]
     cse_id = self.config["api-keys"]["cse"][cse_key]
-    limit, query = args_tuple
     url = ("https://www.googleapis.com/customsearch/v1"
            "?key={}&cx={}&q={}&fields=items(title,link)".format(
               api_key, cse_id, urllib.parse.quote(query, encoding="utf-8")))
+    data = await web.fetch(self, url, "json")
+    items = data.get("items", []) if data else []
+    await collection.update_one(
+        key, {"$set": {"items": items, "date": datetime.utcnow()}},
+        upsert=True)
+    return items
+
+
+async def _google_search(self, args_tuple, message, cse_key):
+    limit, query = args_tuple
     try:
-        with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.json()
+        items = await self.single_flight.do(
+            ("cse", cse_key, query), lambda: _cse_items(self, cse_key, query))
+    except _QuotaExhausted:
+        await self.send_message(
+            message.channel,
+            "Daily search quota used up. Please try again tomorrow.")
+        return
     except Exception as e:
         await self.send_message(message.channel, "Request failed: " + str(e))
         return
-    if not data:
+    if not items:
         await self.send_message(message.channel, "No results found.")
         return
-    items = data["items"][:limit]
+    items = items[:limit]
     fmt = "**{index}.** {title} - <{link}>" \
         if len(items) > 1 else "{title} - {link}"
     results = [fmt.format(**x, index=i+1) for i, x in enumerate(items)]
     await self.send_message(message.channel, "\n".join(results))
 
 
-@Discordant.register_command("taekim", ["tk"], arg_func=_search_args)
+@Discordant.register_command("quota", perm_func=utils.is_controller)
+async def _quota(self, args, message):
+    """!quota
+    displays today's google custom search quota usage."""
+    cfg = _cse_config(self)
+    await self.send_message(
+        message.channel,
+        ("search quota used today: {}/{} ({} reserved for uncached queries)" +
+         "\ncached queries: {}").format(
+            await _quota_used(self), cfg.get("daily_quota", 100),
+            cfg.get("reserve", 10), await self.mongodb.cse_cache.count()))
+
+
+@Discordant.register_command("taekim", ["tk"], schema=_search_schema)
 async def _taekim_search(self, args_tuple, message):
-    """!taekim [limit] <query>
-    searches <http://guidetojapanese.org>."""
+    """searches <http://guidetojapanese.org>."""
     await _google_search(self, args_tuple, message, "taekim")
 
 
-@Discordant.register_command("google", ["g"], arg_func=_search_args)
+@Discordant.register_command("google", ["g"], schema=_search_schema)
 async def _web_search(self, args_tuple, message):
-    """!google [limit] <query>
-    searches the web through google."""
+    """searches the web through google."""
     await _google_search(self, args_tuple, message, "google")
+
+
+@Discordant.register_command(
+    "leaderboard", ["lb"], context=True, schema=arguments.Schema(
+        arguments.positional("days", int, optional=True, default=7, min=1,
+                             max=365)))
+async def _leaderboard(self, args, message, context):
+    """lists the most active members of the last [days] days (a week by
+    default)."""
+    counts = await rollups.totals(self.mongodb, rollups.USERS,
+                                  context.server.id,
+                                  rollups.days_ago(args.days))
+    output = ""
+    rank = 0
+    for user_id, count in counts:
+        member = context.server.get_member(user_id)
+        if not member or member.bot:
+            continue
+        rank += 1
+        output += "{}. {} - {} messages\n".format(rank, member.name, count)
+        if rank == 10:
+            break
+    await self.send_message(
+        message.channel,
+        "**most active in the last {} days**:\n{}".format(args.days, output)
+        if output else "No messages logged in the last {} days.".format(
+            args.days))
+
+
+@Discordant.register_command(
+    "activity", context=True, schema=arguments.Schema(
+        arguments.positional("target", optional=True, rest=True,
+                             label="user/channel"),
+        kwargs=[arguments.kwarg("days", int, default=14, min=1, max=90)]))
+async def _activity(self, args, message, context):
+    """shows messages per day for a user, a channel or the whole server."""
+    name, key, title = rollups.CHANNELS, None, context.server.name
+    if args.target:
+        user = None if args.target.startswith(("#", "<#")) else \
+            utils.get_user(args.target, context.server.members, message)
+        channel = None if user else utils.get_channel(
+            args.target, context.server.channels, message)
+        if not user and not channel:
+            await self.send_message(
+                message.channel, "User or channel could not be found.")
+            return
+        if user:
+            name, key, title = rollups.USERS, user.id, user.name
+        else:
+            key, title = channel.id, "#" + channel.name
+    days = await rollups.daily(self.mongodb, name, context.server.id,
+                               rollups.days_ago(args.days), key)
+    most = max(days.values()) or 1
+    output = "\n".join("{} {:>6} {}".format(
+        day.strftime("%Y/%m/%d"), count, "#" * math.ceil(count / most * 20))
+        for day, count in days.items())
+    # up to 90 days doesn't fit in one message
+    await utils.send_long_message(
+        self, message.channel, "**messages per day for {}**:\n{}".format(
+            title, utils.python_format(output)))
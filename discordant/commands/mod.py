@@ -4,12 +4,16 @@ from datetime import datetime
 
 import discord.game
 
+import discordant.arguments as arguments
+import discordant.confirmations as confirmations
+import discordant.export as export
+import discordant.guilds as guilds
+import discordant.logsearch as logsearch
 import discordant.utils as utils
 from discordant import Discordant
 
 
 def _punishment_format(self, server, document):
-    server = server if server else self.default_server
     if "user" not in document:
         user_id = document["user_id"]
         user = server.get_member(user_id)
@@ -52,17 +56,35 @@ def _can_ban(self, user):
     return utils.has_permission(user, "ban_members")
 
 
+_NO_REASON = "No reason given."
+_user_schema = arguments.Schema(arguments.positional("user", rest=True))
+_mod_schema = arguments.Schema(
+    arguments.positional("user"),
+    arguments.positional("reason", optional=True, rest=True,
+                         default=_NO_REASON),
+    kwargs=[arguments.kwarg("duration", float, min=0, label="hours"),
+            arguments.kwarg("reason")])
+_mod_remove_schema = arguments.Schema(
+    arguments.positional("user"),
+    arguments.positional("reason", optional=True, rest=True,
+                         default=_NO_REASON))
+_ban_schema = arguments.Schema(
+    arguments.positional("user", label="user/user id"),
+    arguments.positional("reason", optional=True, rest=True,
+                         default=_NO_REASON))
+
+
 #@Discordant.register_command("modhistory", ["modh"], context=True,
-                             arg_func=utils.has_args, perm_func=_can_kick)
+#                            schema=_user_schema, perm_func=_can_kick)
 async def _moderation_history(self, args, message, context):
-    """!modhistory <user>
-    displays punishment history for a user."""
-    user = utils.get_user(args, context.server.members, message)
+    """displays punishment history for a user."""
+    user = utils.get_user(args.user, context.server.members, message)
     if not user:
         await self.send_message(message.channel, "User could not be found.")
         return
     collection = self.mongodb.punishments
-    cursor = await collection.find({"user_id": user.id}).to_list(None)
+    cursor = await collection.find(
+        {"user_id": user.id, "server_id": context.server.id}).to_list(None)
     await self.send_message(
         message.channel,
         await _punishment_history(self, user, cursor)
@@ -77,16 +99,29 @@ _mod_cmd_to_action = {"warn": "warning",
                       "unban": "remove ban"}
 
 
+async def _confirm(self, message):
+    """the moderator's y/n reply, None if they didn't reply in time or
+    cancelled, or False if they already have too many prompts open."""
+    try:
+        return await self.confirmations.ask(message.channel, message.author)
+    except confirmations.TooManyPrompts as e:
+        await self.send_message(message.channel, str(e))
+        return False
+
+
+async def _get_guild(self, message, context):
+    guild = guilds.get_guild(self, context.server)
+    if not guild:
+        await self.send_message(
+            message.channel, "Moderation isn't set up for this server.")
+    return guild
+
+
 async def _mod_cmd(self, args, message, context):
-    keys = ["duration", "reason"]
-    kwargs = utils.get_kwargs(args, keys)
-    split = utils.try_shlex(args)
-    if not kwargs and len(split) > 1:
-        # has more than one pos arg, no kwargs
-        args = split[0] + ' reason="' + " ".join(split[1:]) + '"'
-        kwargs = utils.get_kwargs(args, keys)
-    user_search = utils.strip_kwargs(args, keys)
-    user = utils.get_user(user_search, context.server.members, message)
+    guild = await _get_guild(self, message, context)
+    if not guild:
+        return
+    user = utils.get_user(args.user, context.server.members, message)
     if not user:
         await self.send_message(message.channel, "User could not be found.")
         return
@@ -94,15 +129,11 @@ async def _mod_cmd(self, args, message, context):
         await self.send_message(
             message.channel, "Cannot {} {}".format(context.cmd_name, user.name))
         return
-    duration = utils.get_from_kwargs(
-        "duration", kwargs,
-        self.config["moderation"][context.cmd_name + "_duration"])
-    try:
-        duration = float(duration)
-    except ValueError:
-        await self.send_message(message.channel, "Invalid duration.")
-        return
-    reason = utils.get_from_kwargs("reason", kwargs, "No reason given.")
+    duration = args.duration
+    if duration is None:
+        duration = float(
+            guild.config["moderation"][context.cmd_name + "_duration"])
+    reason = args.reason
     action = _mod_cmd_to_action[context.cmd_name]
     collection = self.mongodb.punishments
     if await utils.is_punished(self, user, action):
@@ -111,23 +142,23 @@ async def _mod_cmd(self, args, message, context):
             user.name + " already has an active " + action + ".")
         return
     else:
-        cursor = await collection.find({"user_id": user.id}).to_list(None)
+        cursor = await collection.find(
+            {"user_id": user.id, "server_id": guild.id}).to_list(None)
         if cursor:
             await self.send_message(
                 message.channel,
                 user.name + " has a history of:\n" + await _punishment_history(
                     self, user, cursor) + "\n\nType y/n to continue.")
-            reply = await self.wait_for_message(
-                check=lambda m: m.author == message.author and
-                                (m.content.lower() == "y" or
-                                 m.content.lower() == "n"),
-                timeout=60)
+            reply = await _confirm(self, message)
+            if reply is False:
+                return
             if not reply or reply.content.lower() == "n":
                 await self.send_message(
                     message.channel, "Cancelled " + action + ".")
                 return
     document = {
         "user_id": user.id,
+        "server_id": guild.id,
         "action": action,
         "moderator_id": message.author.id,
         "date": datetime.utcnow(),
@@ -135,37 +166,36 @@ async def _mod_cmd(self, args, message, context):
         "reason": reason
     }
     await collection.insert_one(document)
-    role = utils.action_to_role(self, action)
+    role = utils.action_to_role(self, guild.server, action)
     not_warn = action != "warning"
     if role and not_warn:  # hide warning change
         await self.add_roles(user, role)
     await self.send_message(
-        self.log_channel if not_warn else self.warning_log_channel,
-        _punishment_format(self, message.server, document))
-    await utils.add_punishment_timer(self, user, action)
+        guild.log_channel if not_warn else guild.warning_log_channel,
+        _punishment_format(self, guild.server, document))
+    utils.spawn_punishment_timer(self, user, action)
 
 
 #@Discordant.register_command("warn", context=True,
-                             arg_func=utils.has_args, perm_func=_can_kick)
+#                            schema=_mod_schema, perm_func=_can_kick)
 async def _warn(self, args, message, context):
-    """!warn <user> [reason] or !warn <user> [duration=hours] [reason=str]
-    warns a user."""
+    """warns a user."""
     await _mod_cmd(self, args, message, context)
 
 
 #@Discordant.register_command("mute", context=True,
-                             arg_func=utils.has_args, perm_func=_can_kick)
+#                            schema=_mod_schema, perm_func=_can_kick)
 async def _mute(self, args, message, context):
-    """!mute <user> [reason] or !mute <user> [duration=hours] [reason=str]
-    mutes a user."""
+    """mutes a user."""
     await _mod_cmd(self, args, message, context)
 
 
 async def _mod_remove_cmd(self, args, message, context):
-    split = utils.try_shlex(args)
-    user_search = split[0]
-    reason = " ".join(split[1:]) if len(split) > 1 else "No reason given."
-    user = utils.get_user(user_search, context.server.members, message)
+    guild = await _get_guild(self, message, context)
+    if not guild:
+        return
+    reason = args.reason
+    user = utils.get_user(args.user, context.server.members, message)
     if not user:
         await self.send_message(message.channel, "User could not be found.")
         return
@@ -182,6 +212,7 @@ async def _mod_remove_cmd(self, args, message, context):
         return
     document = {
         "user_id": user.id,
+        "server_id": guild.id,
         "action": action,
         "moderator_id": message.author.id,
         "date": datetime.utcnow(),
@@ -189,39 +220,37 @@ async def _mod_remove_cmd(self, args, message, context):
         "reason": reason
     }
     await collection.insert_one(document)
-    role = utils.action_to_role(self, orig_action)
+    role = utils.action_to_role(self, guild.server, orig_action)
     not_warn = orig_action != "warning"
     if role and not_warn:  # hide warning change
         await self.remove_roles(user, role)
     await self.send_message(
-        self.log_channel if not_warn else self.warning_log_channel,
-        _punishment_format(self, message.server, document))
+        guild.log_channel if not_warn else guild.warning_log_channel,
+        _punishment_format(self, guild.server, document))
 
 
 #@Discordant.register_command("unwarn", context=True,
-                             arg_func=utils.has_args, perm_func=_can_kick)
+#                            schema=_mod_remove_schema, perm_func=_can_kick)
 async def _unwarn(self, args, message, context):
-    """!unwarn <user> [reason]
-    removes a warning for a user."""
+    """removes a warning for a user."""
     await _mod_remove_cmd(self, args, message, context)
 
 
 #@Discordant.register_command("unmute", context=True,
-                             arg_func=utils.has_args, perm_func=_can_kick)
+#                            schema=_mod_remove_schema, perm_func=_can_kick)
 async def _unmute(self, args, message, context):
-    """!unmute <user> [reason]
-    removes a mute for a user."""
+    """removes a mute for a user."""
     await _mod_remove_cmd(self, args, message, context)
 
 
 #@Discordant.register_command("ban", context=True,
-                             arg_func=utils.has_args, perm_func=_can_ban)
+#                            schema=_ban_schema, perm_func=_can_ban)
 async def _ban(self, args, message, context):
-    """!ban <user/user id> [reason]
-    bans a user."""
-    split = utils.try_shlex(args)
-    user_search = split[0]
-    reason = " ".join(split[1:]) if len(split) > 1 else "No reason given."
+    """bans a user."""
+    guild = await _get_guild(self, message, context)
+    if not guild:
+        return
+    user_search, reason = args.user, args.reason
     user = utils.get_user(user_search, context.server.members, message, True)
     if not user:
         await self.send_message(
@@ -229,10 +258,7 @@ async def _ban(self, args, message, context):
             "User could not be found. "
             "Please use an @ mention string or name#id.\n"
             "Search logs? Type y/n.")
-        reply = await self.wait_for_message(
-            check=lambda m: m.author == message.author and (
-                m.content.lower() == "y" or m.content.lower() == "n"),
-            timeout=60)
+        reply = await _confirm(self, message)
         if not reply:  # if no reply, cancel silently to avoid confusion
             return
         if reply.content.lower() == "n":
@@ -240,8 +266,7 @@ async def _ban(self, args, message, context):
             return
         authors = set()
         for channel in context.server.channels:
-            if channel in [self.staff_channel, self.testing_channel,
-                           self.log_channel, self.warning_log_channel] or \
+            if channel in guild.bot_channels or \
                             channel.type != discord.ChannelType.text:
                 continue
             async for msg in self.logs_from(channel, limit=500):
@@ -255,13 +280,15 @@ async def _ban(self, args, message, context):
         await self.send_message(message.channel, "Cannot ban " + user.name)
         return
     collection = self.mongodb.punishments
-    doc = await collection.find_one({"user_id": user.id, "action": "ban"})
+    doc = await collection.find_one(
+        {"user_id": user.id, "server_id": guild.id, "action": "ban"})
     if doc or user in await self.get_bans(context.server):
         await self.send_message(
             message.channel, user.name + " is already banned.")
         return
     document = {
         "user_id": user.id,
+        "server_id": guild.id,
         "action": "ban",
         "moderator_id": message.author.id,
         "date": datetime.utcnow(),
@@ -270,21 +297,21 @@ async def _ban(self, args, message, context):
     }
     await collection.insert_one(document)
     await self.send_message(
-        self.log_channel,
-        _punishment_format(self, message.server, document))
+        guild.log_channel,
+        _punishment_format(self, guild.server, document))
     await self.ban(user)
 
 
 #@Discordant.register_command("unban", context=True,
-                             arg_func=utils.has_args, perm_func=_can_ban)
+#                            schema=_ban_schema, perm_func=_can_ban)
 async def _unban(self, args, message, context):
-    """!unban <user/user id> [reason]
-    unbans a user."""
-    split = utils.try_shlex(args)
-    user_search = split[0]
-    reason = " ".join(split[1:]) if len(split) > 1 else "No reason given."
+    """unbans a user."""
+    guild = await _get_guild(self, message, context)
+    if not guild:
+        return
+    reason = args.reason
     bans = await self.get_bans(context.server)
-    user = utils.get_user(user_search, bans, message, True)
+    user = utils.get_user(args.user, bans, message, True)
     if not user:
         await self.send_message(message.channel,
                                 "User could not be found, or is not banned.")
@@ -292,12 +319,14 @@ async def _unban(self, args, message, context):
     collection = self.mongodb.punishments
     action = "remove ban"
     orig_action = "ban"
-    if not await utils.is_punished(self, user, orig_action):
+    if not await utils.is_punished(self, user, orig_action,
+                                   server=guild.server):
         await self.send_message(
             message.channel, user.name + " has no active " + orig_action + ".")
         return
     document = {
         "user_id": user.id,
+        "server_id": guild.id,
         "action": action,
         "moderator_id": message.author.id,
         "date": datetime.utcnow(),
@@ -305,20 +334,21 @@ async def _unban(self, args, message, context):
         "reason": reason
     }
     await collection.insert_one(document)
-    await self.send_message(self.log_channel, _punishment_format(
-        self, message.server, document))
+    await self.send_message(guild.log_channel, _punishment_format(
+        self, guild.server, document))
     await self.unban(context.server, user)
 
 
-@Discordant.register_command("bans", context=True, perm_func=_can_ban)
+@Discordant.register_command(
+    "bans", context=True, perm_func=_can_ban, schema=arguments.Schema(
+        arguments.positional("page", int, optional=True, min=1)))
 async def _bans(self, args, message, context):
-    """!bans [page]
-    lists the bans in this server."""
+    """lists the bans in this server."""
     page_length = 10
     bans = await self.get_bans(context.server)
     len_bans = len(bans)
     pages = -(-len_bans // page_length)  # ceil division
-    page = int(args) - 1 if args.isdigit() else pages - 1
+    page = args.page - 1 if args.page else pages - 1
     if page >= pages or page < 0:
         await self.send_message(
             message.channel, "There are only {} pages available.".format(pages))
@@ -333,24 +363,23 @@ async def _bans(self, args, message, context):
             "\npage {} out of {}".format(page + 1, pages)))
 
 
-#@Discordant.register_command("reason", context=True,
-                             arg_func=utils.has_args, perm_func=_can_kick)
+#@Discordant.register_command(
+#    "reason", context=True, perm_func=_can_kick, schema=arguments.Schema(
+#        arguments.positional("user"),
+#        arguments.positional("reason", rest=True)))
 async def _reason(self, args, message, context):
-    """!reason <user> <reason>
-    edits the reason of the given user's most recent punishment."""
-    split = utils.try_shlex(args)
-    if len(split) < 2:
-        await self.send_message(message.channel, context.cmd.help)
+    """edits the reason of the given user's most recent punishment."""
+    guild = await _get_guild(self, message, context)
+    if not guild:
         return
-    user_search = split[0]
-    reason = " ".join(split[1:])
+    user_search, reason = args.user, args.reason
     user = utils.get_user(user_search, context.server.members, message) or \
         utils.get_user(user_search, await self.get_bans(context.server))
     if not user:
         await self.send_message(message.channel, "User could not be found.")
         return
     collection = self.mongodb.punishments
-    query = {"user_id": user.id}
+    query = {"user_id": user.id, "server_id": guild.id}
     cursor = await collection.find(query).sort(
         "$natural", -1).limit(1).to_list(None)
     if not cursor:
@@ -376,5 +405,66 @@ async def _reason(self, args, message, context):
                 return True
         return False
 
-    if not await edit_message(self.log_channel):
-        await edit_message(self.warning_log_channel)
+    if not await edit_message(guild.log_channel):
+        await edit_message(guild.warning_log_channel)
+
+
+@Discordant.register_command("cancel", context=True, perm_func=_can_kick)
+async def _cancel(self, args, message, context):
+    """!cancel
+    cancels the confirmations you have waiting for a y/n reply."""
+    count = self.confirmations.cancel(message.author.id)
+    await self.send_message(
+        message.channel, "Cancelled {} pending confirmations.".format(count)
+        if count else "You have no pending confirmations.")
+
+
+@Discordant.register_command(
+    "logsearch", ["ls"], context=True, perm_func=_can_kick,
+    schema=arguments.Schema(
+        arguments.positional("query", rest=True),
+        kwargs=[arguments.kwarg("user"),
+                arguments.kwarg("channel"),
+                arguments.kwarg("after", export.parse_date,
+                                label="YYYY-MM-DD"),
+                arguments.kwarg("before", export.parse_date,
+                                label="YYYY-MM-DD"),
+                arguments.kwarg("page", int, default=1, min=1)]))
+async def _logsearch(self, args, message, context):
+    """searches this server's logged messages, newest first. words match
+    whole, japanese text matches anywhere."""
+    user_id = channel_id = None
+    if args.user:
+        user = utils.get_user(args.user, context.server.members, message)
+        user_id = user.id if user else args.user
+    if args.channel:
+        channel = utils.get_channel(
+            args.channel, context.server.channels, message)
+        if not channel:
+            await self.send_message(
+                message.channel, "Channel could not be found.")
+            return
+        channel_id = channel.id
+    query = logsearch.build_query(context.server.id, args.query, user_id,
+                                  channel_id, args.after, args.before)
+    if not query:
+        await self.send_message(message.channel, "Nothing to search for.")
+        return
+    documents, more = await logsearch.search(self.mongodb, query, args.page)
+    if not documents:
+        await self.send_message(message.channel, "No results found.")
+        return
+    output = ""
+    for document in documents:
+        channel = context.server.get_channel(document["channel_id"])
+        author = context.server.get_member(document["author_id"])
+        content = document["content"].replace("\n", " ")
+        output += "`{}` #{} **{}**: {}\n".format(
+            document["timestamp"].strftime("%Y/%m/%d %H:%M"),
+            channel.name if channel else document["channel_id"],
+            author.name if author else document["author_id"],
+            content if len(content) <= 200 else content[:199] + "…")
+    output += "page {}".format(args.page) + (
+        ", type the same search with page={} for more.".format(args.page + 1)
+        if more else "")
+    await utils.send_long_message(self, message.channel, output)
@@ -0,0 +1,74 @@
+import asyncio
+from collections import Counter
+
+
+class TooManyPrompts(Exception):
+    pass
+
+
+def is_yes_no(message):
+    return message.content.lower() in ("y", "n")
+
+
+class _Prompt:
+    def __init__(self, check):
+        self.check = check
+        self.future = asyncio.Future()
+
+
+class Confirmations:
+    """prompts waiting for a reply, keyed by (channel id, author id) so
+    on_message finds the one a message answers with a single lookup,
+    instead of testing every message against every waiter. a user has at
+    most one prompt per channel (a new one replaces the old) and at most
+    limit across channels."""
+
+    def __init__(self, limit=3):
+        self.limit = limit
+        self.pending = {}  # (channel id, author id) -> _Prompt
+        self.per_author = Counter()
+
+    async def ask(self, channel, author, check=is_yes_no, timeout=60):
+        """waits for author's next message in channel that passes check.
+        returns it, or None on timeout or cancellation."""
+        key = (channel.id, author.id)
+        old = self.pending.get(key)
+        if self.per_author[author.id] - bool(old) >= self.limit:
+            raise TooManyPrompts(
+                "You have too many pending confirmations. Answer or !cancel "
+                "them first.")
+        if old and not old.future.done():
+            old.future.set_result(None)
+        prompt = self.pending[key] = _Prompt(check)
+        self.per_author[author.id] += 1
+        try:
+            return await asyncio.wait_for(prompt.future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.per_author[author.id] -= 1
+            if not self.per_author[author.id]:
+                del self.per_author[author.id]
+            if self.pending.get(key) is prompt:
+                del self.pending[key]
+
+    def resolve(self, message):
+        """answers the prompt message replies to, if any. returns whether it
+        did, in which case the message shouldn't be handled otherwise."""
+        prompt = self.pending.get((message.channel.id, message.author.id))
+        if not prompt or prompt.future.done() or not prompt.check(message):
+            return False
+        prompt.future.set_result(message)
+        return True
+
+    def cancel(self, author_id, channel_id=None):
+        """cancels author's prompts, or only the one in a channel. returns
+        how many were cancelled."""
+        cancelled = 0
+        for (prompt_channel, prompt_author), prompt in list(
+                self.pending.items()):
+            if prompt_author == author_id and not prompt.future.done() and \
+                    channel_id in (None, prompt_channel):
+                prompt.future.set_result(None)
+                cancelled += 1
+        return cancelled
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+# discord's bulk delete takes 2 to 100 messages
+BULK_LIMIT = 100
+
+
+class DeletionScheduler:
+    """deletes messages once their delay is up. messages that come due are
+    collected per channel and removed with one bulk delete per channel
+    every interval, rather than a sleeping task and a delete call each.
+    pending deletions are also kept in mongo, so messages scheduled before
+    a restart still get deleted after it."""
+
+    def __init__(self, bot, interval=2.0):
+        self.bot = bot
+        self.interval = interval
+        self.pending = {}  # channel id -> {message id: due time}
+        self.deleted = 0
+        self.requests = 0
+
+    @property
+    def collection(self):
+        return self.bot.mongodb.pending_deletions
+
+    @property
+    def depth(self):
+        return sum(len(x) for x in self.pending.values())
+
+    async def schedule(self, messages, delay):
+        """deletes the messages (None entries are skipped) in delay seconds.
+        returns once the deletion is recorded, not once it's done."""
+        due = time.time() + delay
+        documents = []
+        for message in messages:
+            if message is None:
+                continue
+            self.pending.setdefault(message.channel.id, {})[message.id] = due
+            documents.append({
+                "message_id": message.id,
+                "channel_id": message.channel.id,
+                "server_id": message.server.id if message.server else None,
+                "due": due})
+        if documents:
+            await self.collection.insert_many(documents)
+
+    async def load(self, server_ids):
+        """picks up deletions persisted for the given servers. None stands
+        for private channels."""
+        documents = await self.collection.find(
+            {"server_id": {"$in": server_ids}}).to_list(None)
+        for document in documents:
+            self.pending.setdefault(document["channel_id"], {})[
+                document["message_id"]] = document["due"]
+        return len(documents)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self, now=None):
+        now = now or time.time()
+        for channel_id, messages in list(self.pending.items()):
+            due = [k for k, v in messages.items() if v <= now]
+            if not due:
+                continue
+            for i in range(0, len(due), BULK_LIMIT):
+                await self._delete(channel_id, due[i:i + BULK_LIMIT])
+            for message_id in due:
+                messages.pop(message_id, None)
+            if not messages and self.pending.get(channel_id) is messages:
+                del self.pending[channel_id]
+            await self.collection.delete_many({"message_id": {"$in": due}})
+
+    async def _delete(self, channel_id, message_ids):
+        if len(message_ids) > 1:
+            self.requests += 1
+            try:
+                await self.bot.http.delete_messages(channel_id, message_ids)
+                self.deleted += len(message_ids)
+                return
+            except discord.HTTPException as e:
+                # private channels and messages older than two weeks can't
+                # be bulk deleted, so fall back to deleting them one by one
+                logger.debug("Bulk delete in %s failed: %s", channel_id, e)
+        for message_id in message_ids:
+            self.requests += 1
+            try:
+                await self.bot.http.delete_message(channel_id, message_id)
+                self.deleted += 1
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                logger.warning("Couldn't delete message %s in %s: %s",
+                               message_id, channel_id, e)
@@ -1,9 +1,16 @@
 import asyncio
+import contextlib
+import functools
+import importlib.util
+import io
+import itertools
 import json
+import logging
 import re
 import sys
+import time
 import traceback
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 from inspect import iscoroutinefunction
 from os import path
 
@@ -11,11 +18,24 @@ import aiohttp
 import discord
 import motor.motor_asyncio
 
+import discordant.arguments as arguments
+import discordant.confirmations as confirmations
+import discordant.deletions as deletions
+import discordant.guilds as guilds
+import discordant.monitor as monitor
+import discordant.outbox as outbox
+import discordant.perf as perf
+import discordant.tasks as tasks
 import discordant.utils as utils
+import discordant.web as web
+
+logger = logging.getLogger(__name__)
 
 Command = namedtuple('Command', ['name', 'arg_func', 'aliases', 'section',
-                                 'help', 'context', 'perm_func'])
+                                 'help', 'context', 'perm_func', 'schema'])
 Context = namedtuple('Context', ['server', 'author', 'cmd', 'cmd_name'])
+Event = namedtuple('Event', ['name', 'func', 'background', 'restart',
+                             'per_guild'])
 
 
 def decorate_all_events():
@@ -36,9 +56,12 @@ class Discordant(discord.Client):
     _aliases = {}
     _triggers = set()
     _events = {}
+    _help = {}  # permission tier -> {section (None for all): help text}
+    _help_perm_funcs = []
 
-    def __init__(self, config_file='config.json'):
-        super().__init__()
+    def __init__(self, config_file='config.json', startup=None,
+                 shard_id=None, shard_count=None):
+        super().__init__(shard_id=shard_id, shard_count=shard_count)
 
         self.__email = ''  # prevent a conflict with discord.Client#email
         self._password = ''
@@ -47,14 +70,30 @@ class Discordant(discord.Client):
         self.controllers = []
         self.mongodb = None
         self.config = {}
-        self.default_server = None
+        self.guilds = OrderedDict()  # server id -> GuildState
+        self._documents_migrated = False
         self.commands_parsed = 0
-        self.log_channel = None
-        self.warning_log_channel = None
-        self.staff_channel = None
-        self.testing_channel = None
+        self.startup = startup or perf.StartupTimer()
+        self.metrics = perf.Metrics()
+        self.single_flight = web.SingleFlight(self.metrics.spawn)
+        self.outbox = outbox.Outbox(self.send_message)
+        self.deletions = deletions.DeletionScheduler(self)
+        self.http.request = self.metrics.wrap("discord", self.http.request)
+        self.tasks = tasks.Supervisor(self.loop, self.on_error)
+        if monitor.get_monitor():
+            monitor.get_monitor().labelers.extend(
+                [self.metrics.current, self.tasks.label])
 
         self.load_config(config_file)
+        self.confirmations = confirmations.Confirmations(
+            self.config.get("moderation", {}).get("max_prompts", 3))
+        self.startup.mark("config")
+
+    @property
+    def is_primary_shard(self):
+        """whether this process does the work that isn't tied to a server
+        and must only run once."""
+        return not self.shard_id
 
     def run(self):
         if self._token:
@@ -86,9 +125,9 @@ class Discordant(discord.Client):
             self._password = self.config['login']['password']
         self.command_char = self.config['commands']['command_char']
         self.controllers = self.config["client"]["controllers"]
-        self.mongodb = motor.motor_asyncio.AsyncIOMotorClient(
+        self.mongodb = perf.Timed(motor.motor_asyncio.AsyncIOMotorClient(
             self.config["api-keys"]["mongodb"]["uri"])[
-            self.config["api-keys"]["mongodb"]["db_name"]]
+            self.config["api-keys"]["mongodb"]["db_name"]], self.metrics)
         self.load_aliases()
 
     def load_aliases(self):
@@ -100,7 +139,108 @@ class Discordant(discord.Client):
 
             for alias in alias_list:
                 self._aliases[alias] = cmd_name
-                self._commands[cmd_name].aliases.append(alias)
+                if alias not in self._commands[cmd_name].aliases:
+                    self._commands[cmd_name].aliases.append(alias)
+        self.build_help()
+
+    @classmethod
+    def build_help(cls):
+        """renders the help menus once for every permission tier, which is
+        the set of permission checks a user passes."""
+        perm_funcs = list(OrderedDict.fromkeys(
+            x.perm_func for x in cls._commands.values() if x.perm_func))
+        menus = {}
+        for n in range(len(perm_funcs) + 1):
+            for tier in itertools.combinations(perm_funcs, n):
+                menus[frozenset(tier)] = utils.help_menus(
+                    [x for x in cls._commands.values()
+                     if not x.perm_func or x.perm_func in tier])
+        cls._help, cls._help_perm_funcs = menus, perm_funcs
+
+    def help_menus(self, member):
+        """the help menus for the commands member may use."""
+        return self._help[frozenset(
+            x for x in self._help_perm_funcs if x(self, member))]
+
+    # class attributes that make up the command, handler and event tables
+    _REGISTRIES = ('_handlers', '_commands', '_aliases', '_triggers',
+                   '_events', '_help', '_help_perm_funcs')
+    _REGISTERED_PREFIXES = ('_cmd_', '_trg_', '_evt_', 'on_')
+
+    @classmethod
+    def module_registrations(cls, module_name):
+        """the commands, handlers and events registered by a module."""
+        def owned(func_name):
+            return getattr(getattr(cls, func_name, None), '__module__',
+                           None) == module_name
+
+        return ([x for x in cls._commands if owned(x)],
+                [x for x in cls._handlers if owned(x)],
+                [(k, x) for k, v in cls._events.items() for x in v
+                 if x.func.__module__ == module_name])
+
+    @classmethod
+    def _unregister_module(cls, module_name):
+        commands, handlers, events = cls.module_registrations(module_name)
+        for func_name in commands:
+            del cls._commands[func_name]
+            delattr(cls, func_name)
+        cls._aliases = {k: v for k, v in cls._aliases.items()
+                        if v in cls._commands}
+        for func_name in handlers:
+            cls._triggers.discard(cls._handlers.pop(func_name).pattern)
+            delattr(cls, func_name)
+        for event_name, event in events:
+            cls._events[event_name].remove(event)
+            for attr in [k for k, v in vars(cls).items()
+                         if k.startswith('_evt_') and v is event.func]:
+                delattr(cls, attr)
+
+    def reload_module(self, name):
+        """re-imports a module that registers commands, handlers or events
+        (by its name or its last part, e.g. general) and swaps its
+        registrations for the new ones in one go, without yielding to the
+        loop. caches, background tasks and the connection are left alone.
+        if the new code fails to import or register, everything is put back
+        and the error is raised as a RuntimeError. returns the module."""
+        candidates = [name, "discordant.commands." + name, "discordant." + name]
+        # the tables live on Discordant itself, not on subclasses
+        cls = Discordant
+        module_name = next((x for x in candidates
+                            if x in sys.modules and
+                            any(cls.module_registrations(x))), None)
+        if not module_name:
+            raise ValueError("Not a command module: " + name)
+        old = sys.modules[module_name]
+        saved = {x: getattr(cls, x).copy() for x in self._REGISTRIES}
+        saved['_events'] = {k: list(v) for k, v in cls._events.items()}
+        saved_attrs = {k: v for k, v in vars(cls).items()
+                       if k.startswith(self._REGISTERED_PREFIXES)}
+        output = io.StringIO()
+        try:
+            cls._unregister_module(module_name)
+            spec = importlib.util.find_spec(module_name)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            # registration errors are printed before exiting
+            with contextlib.redirect_stdout(output):
+                spec.loader.exec_module(module)
+        except (Exception, SystemExit) as e:
+            sys.modules[module_name] = old
+            for attr in [k for k in vars(cls)
+                         if k.startswith(self._REGISTERED_PREFIXES)]:
+                if attr not in saved_attrs:
+                    delattr(cls, attr)
+            for attr, value in list(saved_attrs.items()) + \
+                    list(saved.items()):
+                setattr(cls, attr, value)
+            raise RuntimeError(output.getvalue().strip() or "{}: {}".format(
+                type(e).__name__, e)) from e
+        parent, _, child = module_name.rpartition(".")
+        setattr(sys.modules[parent], child, module)
+        self.load_aliases()
+        self.build_help()
+        return module
 
     async def on_error(self, event_method, *args, **kwargs):
         await super().on_error(event_method, *args, **kwargs)
@@ -108,29 +248,37 @@ class Discordant(discord.Client):
         try:
             zwsp = "​"  # zero width space
             for uid in self.controllers:
-                await self.send_message(
-                    self.default_server.get_member(uid),
-                    utils.python_format(traceback.format_exc()))
+                member = guilds.find_member(self, uid)
+                if member:
+                    await self.send_message(
+                        member, utils.python_format(traceback.format_exc()))
         except:
             print("Error in on_error:\n" + traceback.format_exc(),
                   file=sys.stderr)
 
     async def on_ready(self):
-        self.log_channel = self.get_channel(
-            self.config["moderation"]["log_channel"])
-        self.warning_log_channel = self.get_channel(
-            self.config["moderation"]["warning_log_channel"])
-        self.staff_channel = self.get_channel(
-            self.config["moderation"]["staff_channel"])
-        self.testing_channel = self.get_channel(
-            self.config["client"]["testing_channel"])
-        self.default_server = self.log_channel.server
+        # server objects are replaced on reconnect, so rebuild every time
+        self.guilds = guilds.load_guilds(self)
+        if not self._documents_migrated and self.is_primary_shard:
+            await guilds.migrate_documents(self)
+            self._documents_migrated = True
+        logger.info("Serving %d servers: %s", len(self.guilds),
+                    ", ".join(x.server.name for x in self.guilds.values()))
         await self.change_presence(
             game=discord.Game(name=self.config["client"]["game"])
             if self.config["client"]["game"] else None)
+        if not self.startup.done:
+            self.startup.done = True
+            self.startup.mark("gateway")
+            # motor connects lazily, so this is the first round trip
+            await self.mongodb.command("ping")
+            self.startup.mark("mongo connect")
+            logger.info("Startup times:\n%s", self.startup.report())
 
     async def on_message(self, message):
         # TODO: logging
+        if self.confirmations.resolve(message):
+            return
         if message.content.startswith(self.command_char) and \
                         message.author != self.user:
             await self.run_command(message)
@@ -152,31 +300,49 @@ class Discordant(discord.Client):
         if cmd_name in self._aliases:
             self.commands_parsed += 1
             cmd = self._commands[self._aliases[cmd_name]]
-            params = [args, message]
-            server = message.server or self.default_server
-            author = server.get_member(message.author.id)
-            if cmd.context:
-                params.append(Context(server, author, cmd, cmd_name))
-            if cmd.perm_func and not cmd.perm_func(self, author):
-                await self.send_message(
-                    message.channel,
-                    "You are not authorized to use this command.")
-                return
-            if cmd.arg_func:
-                res = cmd.arg_func(args)
-                if isinstance(res, tuple):
-                    params[0] = res[1]
-                    res = res[0]
-                if not res:
-                    await self.send_message(message.channel, cmd.help)
-                    return
-            await getattr(self, cmd.name)(*params)
+            timer = self.metrics.start(cmd.aliases[0])
+            try:
+                await self._run_command(cmd, cmd_name, args, message)
+            except:
+                timer.error = True
+                raise
+            finally:
+                self.metrics.stop(timer)
         else:
             msg = await self.send_message(
                 message.channel,
                 "Command not found. Type !help to see all commands.")
-            await asyncio.sleep(5)
-            await self.delete_message(msg)
+            await self.deletions.schedule([msg], 5)
+
+    async def _run_command(self, cmd, cmd_name, args, message):
+        params = [args, message]
+        server = message.server or guilds.server_for_user(
+            self, message.author.id)
+        author = server.get_member(message.author.id)
+        if cmd.context:
+            params.append(Context(server, author, cmd, cmd_name))
+        if cmd.perm_func and not cmd.perm_func(self, author):
+            await self.send_message(
+                message.channel,
+                "You are not authorized to use this command.")
+            return
+        if cmd.schema:
+            try:
+                params[0] = cmd.schema.parse(args)
+            except arguments.ArgumentError as e:
+                await self.send_message(
+                    message.channel,
+                    (str(e) + "\n" if args else "") + cmd.help)
+                return
+        elif cmd.arg_func:
+            res = cmd.arg_func(args)
+            if isinstance(res, tuple):
+                params[0] = res[1]
+                res = res[0]
+            if not res:
+                await self.send_message(message.channel, cmd.help)
+                return
+        await getattr(self, cmd.name)(*params)
 
     @classmethod
     def register_handler(cls, trigger, regex_flags=0):
@@ -210,7 +376,9 @@ class Discordant(discord.Client):
 
     @classmethod
     def register_command(cls, name, aliases=None, section=None, context=False,
-                         perm_func=None, arg_func=None):
+                         perm_func=None, arg_func=None, schema=None):
+        """schema is an arguments.Schema the command's arguments are parsed
+        with, which also writes the first (syntax) line of its help."""
         if not aliases:
             aliases = [name]
         else:
@@ -230,10 +398,13 @@ class Discordant(discord.Client):
                 func_name += '_'
 
             setattr(cls, func_name, func)
+            doc = func.__doc__
+            if schema:
+                doc = schema.syntax(name) + "\n" + doc
             cls._commands[func_name] = Command(
                 func_name, arg_func, aliases,
                 section or func.__module__.split(".")[-1],
-                utils.cmd_help_format(func.__doc__), context, perm_func)
+                utils.cmd_help_format(doc), context, perm_func, schema)
             # associate the given aliases with the command
             for alias in aliases:
                 if alias in cls._aliases:
@@ -247,11 +418,18 @@ class Discordant(discord.Client):
                            ' letters or numbers.'))
                     sys.exit(-1)
                 cls._aliases[alias] = func_name
+            cls.build_help()
 
         return wrapper
 
     @classmethod
-    def register_event(cls, name):
+    def register_event(cls, name, background=False, restart=False,
+                       per_guild=False):
+        """background handlers are long-running: they're started as
+        supervised tasks instead of holding up the event dispatch, and only
+        one instance of each can run at a time. per_guild handlers are
+        background handlers started once for every configured server, with
+        its GuildState as their first argument."""
         name = "on_" + name
 
         def wrapper(func):
@@ -274,22 +452,52 @@ class Discordant(discord.Client):
                 func_name += '_'
 
             setattr(cls, func_name, func)
+            event = Event(func.__name__, func, background or per_guild,
+                          restart, per_guild)
             if name in cls._events:
-                cls._events[name].append(func)
+                cls._events[name].append(event)
             else:
-                cls._events[name] = [func]
+                cls._events[name] = [event]
 
         return wrapper
 
     @classmethod
     def event_dispatch(cls, func):
-        async def wrapper(*args, **kwargs):
+        async def wrapper(self, *args, **kwargs):
             # only add large timers/loops through events,
             # not in Discordant methods.
-            await func(*args, **kwargs)
+            await func(self, *args, **kwargs)
             func_name = func.__name__
             if func_name in cls._events:
                 await asyncio.gather(
-                    *[f(*args, **kwargs) for f in cls._events[func_name]])
+                    *[self._run_event(func_name, event, *args, **kwargs)
+                      for event in cls._events[func_name]])
 
         return wrapper
+
+    async def _run_event(self, event_name, event, *args, **kwargs):
+        if event.per_guild:
+            for state in self.guilds.values():
+                self.tasks.spawn(
+                    "{}:{}".format(event.name, state.id), functools.partial(
+                        event.func, self, state, *args, **kwargs),
+                    event.restart)
+            return
+        if event.background:
+            self.tasks.spawn(event.name, lambda: event.func(
+                self, *args, **kwargs), event.restart)
+            return
+        timer = self.metrics.start(event_name + ":" + event.name, True)
+        try:
+            await event.func(self, *args, **kwargs)
+        except Exception:
+            timer.error = True
+            # keep one failing handler from taking down the others
+            await self.on_error(event.name, *args, **kwargs)
+        finally:
+            self.metrics.stop(timer)
+            elapsed = time.perf_counter() - timer.start
+            if elapsed > self.config.get("events", {}).get(
+                    "slow_handler", 1.0):
+                logger.warning("Slow event handler %s for %s: %.2f s",
+                               event.name, event_name, elapsed)
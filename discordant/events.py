@@ -4,15 +4,23 @@ import sys
 import aiohttp
 import discord
 
+import discordant.audiocache as audiocache
+import discordant.guilds as guilds
+import discordant.kanji as kanji
+import discordant.logsearch as logsearch
+import discordant.perf as perf
+import discordant.retention as retention
+import discordant.rollups as rollups
+import discordant.sentences as sentences
+import discordant.shards as shards
 import discordant.utils as utils
 from discordant import Discordant
 
 
-@Discordant.register_event("ready")
-async def load_voice_roles(self):
-    server = self.default_server
-    voice_role = discord.utils.get(server.roles, name="Voice")
-    voiced = [x for x in server.members
+@Discordant.register_event("ready", per_guild=True)
+async def load_voice_roles(self, guild):
+    voice_role = guild.role("Voice")
+    voiced = [x for x in guild.server.members
               if x.voice_channel or voice_role in x.roles]
     for user in voiced:
         await update_voice_roles(self, user)
@@ -26,46 +34,39 @@ async def _update_voice_roles(self, member, *roles):
 
 
 async def update_voice_roles(self, member):
-    voice_role = discord.utils.get(member.server.roles, name="Voice")
-    vc_role = discord.utils.get(member.server.roles, name="VC Shown")
-    roles = [voice_role]
+    guild = guilds.get_guild(self, member.server)
+    if not guild:
+        return
+    roles = [guild.role("Voice")]
+    vc_role = guild.role("VC Shown")
     doc = await self.mongodb.always_show_vc.find_one({"user_id": member.id})
     if not doc or not doc["value"]:
         roles.append(vc_role)
     await _update_voice_roles(self, member, *roles)
 
 
-_load_punishment_timers = False
-
-
-@Discordant.register_event("ready")
-async def load_punishment_timers(self):
-    global _load_punishment_timers
-    if not _load_punishment_timers:
-        _load_punishment_timers = True
-    else:
-        return
-    cursor = await self.mongodb.punishments.find().to_list(None)
+@Discordant.register_event("ready", per_guild=True)
+async def load_punishment_timers(self, guild):
+    cursor = await self.mongodb.punishments.find(
+        {"server_id": guild.id}).to_list(None)
     to_remove = {}
-    timers = []
     for document in reversed(cursor):
         action = document["action"]
         if action == "ban" or action.startswith("remove"):
             continue
-        member = self.default_server.get_member(document["user_id"])
+        member = guild.server.get_member(document["user_id"])
         if not member:
             continue
-        role = utils.action_to_role(self, action)
+        role = utils.action_to_role(self, guild.server, action)
         if await utils.is_punished(self, member, action):
             print("Adding punishment timer for " + str(member))
-            timers.append(utils.add_punishment_timer(self, member, action))
+            utils.spawn_punishment_timer(self, member, action)
         elif role and role in member.roles:
             if member.id not in to_remove:
                 to_remove[member.id] = []
             to_remove[member.id].append(role)
-    await asyncio.gather(*timers)
     for uid, roles in to_remove.items():
-        member = self.default_server.get_member(uid)
+        member = guild.server.get_member(uid)
         await asyncio.sleep(1)
         await self.remove_roles(member, *roles)
         print("Removed punishments for {}: {}".format(
@@ -73,6 +74,42 @@ async def load_punishment_timers(self):
             ", ".join([x.name for x in roles])))
 
 
+@Discordant.register_event("ready", background=True, restart=True)
+async def write_metrics(self):
+    cfg = self.config.get("metrics", {})
+    if not cfg.get("prometheus_file"):
+        return
+    path, labels = cfg["prometheus_file"], None
+    if self.shard_id is not None:
+        # the shard supervisor merges these into prometheus_file
+        path = shards.shard_metrics_file(path, self.shard_id)
+        labels = {"shard": self.shard_id}
+    while True:
+        await asyncio.sleep(cfg.get("interval", 60))
+        await self.loop.run_in_executor(
+            None, perf.write_file, path,
+            self.metrics.prometheus(labels) + self.outbox.prometheus(labels))
+
+
+@Discordant.register_event("ready", background=True, restart=True)
+async def delete_messages(self):
+    # private channels aren't tied to a shard, so the primary one has them
+    server_ids = list(self.guilds) + ([None] if self.is_primary_shard else [])
+    loaded = await self.deletions.load(server_ids)
+    if loaded:
+        print("Loaded {} pending message deletions".format(loaded))
+    await self.deletions.run()
+
+
+@Discordant.register_event("ready", background=True)
+async def warm_caches(self):
+    # every shard process has its own caches, so each loads them up front
+    # rather than on the first command that needs them
+    audiocache.get_audio_cache(self)
+    await kanji.get_kanjidic(self)
+    await sentences.get_sentence_index(self)
+
+
 _discordme_bump = False
 
 
@@ -116,36 +153,37 @@ async def discordme_bump(self):
 
 @Discordant.register_event("member_join")
 async def on_member_join(self, member):
+    guild = guilds.get_guild(self, member.server)
+    if not guild:
+        return
     punishments = []
     for action in ["ban", "warning", "mute"]:
         if await utils.is_punished(self, member, action):
             punishments.append(action)
     if punishments:
         await self.send_message(
-            self.staff_channel,
+            guild.staff_channel,
             "Punished user {0} ({0.id}) joined the server.".format(member))
         if "ban" in punishments:
             await self.ban(member)
             return
         else:
             to_add = []
-            timers = []
             for action in punishments:
-                role = utils.action_to_role(self, action)
+                role = utils.action_to_role(self, member.server, action)
                 if role:
                     to_add.append(role)
-                    timers.append(utils.add_punishment_timer(
-                        self, member, action))
+                    utils.spawn_punishment_timer(self, member, action)
             if to_add:
-                await asyncio.gather(self.add_roles(member, *to_add),
-                                     *timers)
+                await self.add_roles(member, *to_add)
 
 
 @Discordant.register_event("member_leave")
 async def on_member_leave(self, member):
-    if await utils.is_punished(self, member):
+    guild = guilds.get_guild(self, member.server)
+    if guild and await utils.is_punished(self, member):
         await self.send_message(
-            self.staff_channel,
+            guild.staff_channel,
             "Punished user {0} ({0.id}) left the server.".format(member))
 
 
@@ -155,21 +193,70 @@ async def on_voice_state_update(self, before, after):
         await update_voice_roles(self, after)
 
 
-@Discordant.register_event("ready")
-async def stats_update(self):
+def _clear_role_cache(self, role):
+    guild = guilds.get_guild(self, role.server)
+    if guild:
+        guild.clear_roles()
+
+
+@Discordant.register_event("server_role_create")
+async def on_server_role_create(self, role):
+    _clear_role_cache(self, role)
+
+
+@Discordant.register_event("server_role_delete")
+async def on_server_role_delete(self, role):
+    _clear_role_cache(self, role)
+
+
+@Discordant.register_event("server_role_update")
+async def on_server_role_update(self, before, after):
+    _clear_role_cache(self, after)
+
+
+@Discordant.register_event("ready", per_guild=True)
+async def index_logs(self, guild):
+    count = await logsearch.backfill(self.mongodb, guild.id)
+    if count:
+        print("Indexed {} logged messages for search in {}".format(
+            count, guild.server.name))
+
+
+@Discordant.register_event("ready", per_guild=True, restart=True)
+async def compact_logs(self, guild):
+    cfg = self.config.get("retention", {})
+    if not cfg.get("days"):
+        return
+    while True:
+        count = await retention.compact(
+            self.mongodb, guild.id, retention.cutoff(cfg["days"]),
+            cfg.get("pause", 0.5))
+        if count:
+            print("Compacted {} logged messages older than {} days in "
+                  "{}".format(count, cfg["days"], guild.server.name))
+        await asyncio.sleep(cfg.get("interval", 3600))
+
+
+@Discordant.register_event("ready", per_guild=True)
+async def stats_update(self, guild):
     if not self.user.bot:
         print("Stats logs cannot be fetched: please run through a bot account.")
         return
-    server = self.default_server
+    server = guild.server
+    counted = await rollups.backfill(self.mongodb, server.id)
+    if counted:
+        print("Counted {} logged messages into the activity rollups for "
+              "{}".format(counted, server.name))
     logs = []
     channels = []
     for channel in server.channels:
-        if channel in [self.staff_channel, self.testing_channel] \
+        if channel in [guild.staff_channel, guild.testing_channel] \
                 or channel.type != discord.ChannelType.text \
                 or not channel.permissions_for(server.get_member(
                     self.user.id)).read_messages:
             continue
-        channels.append({"channel_id": channel.id, "name": channel.name})
+        channels.append({"channel_id": channel.id, "name": channel.name,
+                         "server_id": server.id})
         search = await self.mongodb.logs.find({
             "$query": {"channel_id": channel.id},
             "$orderby": {"$natural": -1}
@@ -182,15 +269,27 @@ async def stats_update(self):
             except discord.NotFound:
                 pass
         limit, after = (sys.maxsize, last_msg) if last_msg else (100, None)
+        channel_logs = []
         async for message in self.logs_from(channel, limit, after=after):
-            logs.append({
+            channel_logs.append({
                 "message_id": message.id,
                 "author_id": message.author.id,
                 "channel_id": message.channel.id,
+                "server_id": server.id,
                 "timestamp": message.timestamp,
-                "content": message.clean_content
+                "content": message.clean_content,
+                "tokens": logsearch.tokens(message.clean_content)
             })
+        if not last_msg:
+            # the logged messages may all have been deleted since, in which
+            # case the latest ones are fetched again
+            logged = await retention.logged_ids(
+                self.mongodb, server.id, channel.id, channel_logs)
+            channel_logs = [x for x in channel_logs
+                            if x["message_id"] not in logged]
+        logs.extend(channel_logs)
     members = [{"user_id": x.id,
+                "server_id": server.id,
                 "name": x.name,
                 "discriminator": x.discriminator,
                 "nick": x.nick,
@@ -201,12 +300,13 @@ async def stats_update(self):
     if logs:
         await self.mongodb.logs.insert_many(
             sorted(logs, key=lambda x: x["timestamp"]))
+        await rollups.add(self.mongodb, server.id, logs)
     dct = {"channels": "channel_id", "members": "user_id"}
     for name, id_name in dct.items():
         count_name = name + "_updated"
         locals()[count_name] = 0
         for obj in locals()[name]:
-            query = {id_name: obj[id_name]}
+            query = {id_name: obj[id_name], "server_id": server.id}
             collection = self.mongodb[name]
             document = await collection.find_one(query)
             if document:
@@ -214,5 +314,7 @@ async def stats_update(self):
             if document != obj:
                 await collection.update_one(query, {"$set": obj}, upsert=True)
                 locals()[count_name] += 1
-    print("Updated stats: {} messages, {} channels, {} users updated.".format(
-        len(logs), locals()["channels_updated"], locals()["members_updated"]))
+    print("Updated stats for {}: {} messages, {} channels, {} users "
+          "updated.".format(server.name, len(logs),
+                            locals()["channels_updated"],
+                            locals()["members_updated"]))
@@ -0,0 +1,152 @@
+"""streams the punishments and logs collections into gzipped csv or json
+lines files. also runnable from the command line:
+
+    python -m discordant.export <punishments/logs> [-o file] [--format csv]
+        [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--user id]
+        [--channel id] [--server id] [-c config.json]
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import discordant.retention as retention
+
+# columns of each collection's csv, with the field dates are filtered on and
+# the one holding the user
+COLLECTIONS = {
+    "punishments": (["date", "server_id", "user_id", "moderator_id",
+                     "action", "duration", "reason"], "date", "user_id"),
+    "logs": (["timestamp", "server_id", "channel_id", "message_id",
+              "author_id", "content"], "timestamp", "author_id"),
+}
+FORMATS = ("csv", "jsonl")
+# rows rendered before they're handed to the writer thread
+BATCH_SIZE = 500
+
+
+def collection_name(s):
+    if s not in COLLECTIONS:
+        raise ValueError(s)
+    return s
+
+
+def export_format(s):
+    if s not in FORMATS:
+        raise ValueError(s)
+    return s
+
+
+def parse_date(s):
+    return datetime.strptime(s, "%Y-%m-%d")
+
+
+def build_query(collection, server_id=None, since=None, until=None,
+                user_id=None, channel_id=None):
+    """until is inclusive of the whole day."""
+    _, date_field, user_field = COLLECTIONS[collection]
+    query = {}
+    if server_id:
+        query["server_id"] = server_id
+    if user_id:
+        query[user_field] = user_id
+    if channel_id:
+        query["channel_id"] = channel_id
+    dates = {}
+    if since:
+        dates["$gte"] = since
+    if until:
+        dates["$lt"] = until + timedelta(days=1)
+    if dates:
+        query[date_field] = dates
+    return query
+
+
+def default_path(directory, collection, fmt, server_id=None):
+    return os.path.join(directory, "{}{}-{}.{}.gz".format(
+        collection, "-" + server_id if server_id else "",
+        time.strftime("%Y%m%d-%H%M%S"), fmt))
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_header(collection):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(COLLECTIONS[collection][0])
+    return buffer.getvalue()
+
+
+def _render(collection, fmt, documents):
+    buffer = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(buffer)
+        writer.writerows([[_value(x.get(k)) for k in COLLECTIONS[
+            collection][0]] for x in documents])
+    else:
+        for document in documents:
+            document.pop("_id", None)
+            document.pop("tokens", None)
+            buffer.write(json.dumps(document, default=_value,
+                                    ensure_ascii=False) + "\n")
+    return buffer.getvalue()
+
+
+async def export(db, collection, path, fmt="csv", query=None, loop=None):
+    """writes the matching documents to path, oldest first, and returns how
+    many there were. documents are read from the cursor and written in
+    batches, so memory use doesn't grow with the collection; compressing
+    and writing happens in an executor. compacted logs are written first,
+    a channel's day at a time."""
+    loop = loop or asyncio.get_event_loop()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    query = query or {}
+    date_field = COLLECTIONS[collection][1]
+    # without an index to walk, mongo sorts in memory and gives up on big
+    # collections
+    server = [("server_id", 1)] if "server_id" in query else []
+    await db[collection].create_index(server + [(date_field, 1)])
+    # the search tokens are only for the index
+    cursor = db[collection].find(
+        query, {"tokens": False} if collection == "logs" else None).sort(
+        date_field, 1)
+    count = 0
+    f = await loop.run_in_executor(
+        None, lambda: gzip.open(path, "wt", encoding="utf-8", newline=""))
+    try:
+        if fmt == "csv":
+            await loop.run_in_executor(
+                None, f.write, _csv_header(collection))
+        if collection == "logs":
+            await db[retention.BUCKETS].create_index(server + [("day", 1)])
+            buckets = db[retention.BUCKETS].find(
+                retention.bucket_query(query)).sort("day", 1)
+            while (await buckets.fetch_next):
+                logs = [x for x in retention.expand(buckets.next_object())
+                        if retention.matches(x, query)]
+                if logs:
+                    await loop.run_in_executor(
+                        None, f.write, _render(collection, fmt, logs))
+                    count += len(logs)
+        batch = []
+        while (await cursor.fetch_next):
+            batch.append(cursor.next_object())
+            if len(batch) >= BATCH_SIZE:
+                await loop.run_in_executor(
+                    None, f.write, _render(collection, fmt, batch))
+                count += len(batch)
+                batch = []
+        if batch:
+            await loop.run_in_executor(
+                None, f.write, _render(collection, fmt, batch))
+            count += len(batch)
+    finally:
+        await loop.run_in_executor(None, f.close)
+    return count
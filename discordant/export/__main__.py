@@ -0,0 +1,45 @@
+import argparse
+import asyncio
+import json
+
+import motor.motor_asyncio
+
+import discordant.export as export
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m discordant.export",
+        description="export punishments or message logs")
+    parser.add_argument("collection", type=export.collection_name,
+                        help="/".join(export.COLLECTIONS))
+    parser.add_argument("-c", "--config", default="config.json")
+    parser.add_argument("-o", "--output",
+                        help="file to write, by default in the export "
+                             "directory")
+    parser.add_argument("-f", "--format", type=export.export_format,
+                        default="csv", help="/".join(export.FORMATS))
+    parser.add_argument("--since", type=export.parse_date, help="YYYY-MM-DD")
+    parser.add_argument("--until", type=export.parse_date, help="YYYY-MM-DD")
+    parser.add_argument("--user", help="user id")
+    parser.add_argument("--channel", help="channel id")
+    parser.add_argument("--server", help="server id")
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config = json.load(f)
+    mongodb = config["api-keys"]["mongodb"]
+    db = motor.motor_asyncio.AsyncIOMotorClient(
+        mongodb["uri"])[mongodb["db_name"]]
+    path = args.output or export.default_path(
+        config.get("export", {}).get("directory", "exports"),
+        args.collection, args.format, args.server)
+    query = export.build_query(args.collection, args.server, args.since,
+                               args.until, args.user, args.channel)
+    loop = asyncio.get_event_loop()
+    count = loop.run_until_complete(
+        export.export(db, args.collection, path, args.format, query))
+    print("Exported {} documents to {}".format(count, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import logging
+from collections import OrderedDict
+
+import discord
+
+import discordant.perf as perf
+import discordant.shards as shards
+
+logger = logging.getLogger(__name__)
+
+# sections of the top level config that a server can override
+SECTIONS = ("moderation", "client")
+
+
+class GuildState:
+    """a server the bot is configured for, with its own config, channels
+    and role cache."""
+
+    def __init__(self, bot, server, config):
+        self.server = server
+        self.config = config
+        self.log_channel = bot.get_channel(
+            config["moderation"]["log_channel"])
+        self.warning_log_channel = bot.get_channel(
+            config["moderation"]["warning_log_channel"])
+        self.staff_channel = bot.get_channel(
+            config["moderation"]["staff_channel"])
+        self.testing_channel = bot.get_channel(
+            config["client"].get("testing_channel"))
+        self._roles = {}
+
+    @property
+    def id(self):
+        return self.server.id
+
+    @property
+    def bot_channels(self):
+        """channels the bot posts to, which logging and searches skip."""
+        return [self.staff_channel, self.testing_channel, self.log_channel,
+                self.warning_log_channel]
+
+    def role(self, name):
+        role = self._roles.get(name)
+        if role is None:
+            role = discord.utils.get(self.server.roles, name=name)
+            if role:
+                self._roles[name] = role
+        return role
+
+    def clear_roles(self):
+        self._roles.clear()
+
+
+def guild_config(config, server_id):
+    """the top level config sections, overridden by the server's entry in
+    the guilds section."""
+    overrides = config.get("guilds", {}).get(server_id, {})
+    return {section: dict(config.get(section, {}),
+                          **overrides.get(section, {}))
+            for section in SECTIONS}
+
+
+def on_this_shard(self, server_id):
+    return self.shard_count is None or \
+        shards.shard_of(server_id, self.shard_count) == self.shard_id
+
+
+def load_guilds(self):
+    """the configured servers on this shard. each server is only on one
+    shard, so nothing done per server runs twice."""
+    guilds = OrderedDict()
+    server_ids = list(self.config.get("guilds", {}))
+    if not server_ids:
+        # single server configs only name the server through its channels
+        channel = self.get_channel(self.config["moderation"]["log_channel"])
+        server_ids = [channel.server.id] if channel else []
+    for server_id in server_ids:
+        if not on_this_shard(self, server_id):
+            continue
+        server = self.get_server(server_id)
+        if server is None:
+            logger.warning("Not a member of configured server %s", server_id)
+            continue
+        guilds[server_id] = GuildState(
+            self, server, guild_config(self.config, server_id))
+    return guilds
+
+
+async def migrate_documents(self):
+    """documents from before multi-server support belong to the first
+    configured server, except logs, which go to their channel's server."""
+    server_ids = list(self.config.get("guilds", {})) or list(self.guilds)
+    if not server_ids:
+        return
+    server_id = server_ids[0]
+    old = {"server_id": {"$exists": False}}
+    # one channel at a time, so it's one query per channel, not per message
+    while True:
+        log = await self.mongodb.logs.find_one(old, {"channel_id": True})
+        if not log:
+            break
+        channel = self.get_channel(log["channel_id"])
+        await self.mongodb.logs.update_many(
+            dict(old, channel_id=log["channel_id"]),
+            {"$set": {"server_id": channel.server.id if channel
+                      else server_id}})
+    for name in ["punishments", "channels", "members"]:
+        await self.mongodb[name].update_many(
+            old, {"$set": {"server_id": server_id}})
+
+
+def get_guild(self, server):
+    return self.guilds.get(server.id) if server else None
+
+
+def find_member(self, user_id):
+    """the user as a member of the first configured server they're in."""
+    for state in self.guilds.values():
+        member = state.server.get_member(user_id)
+        if member:
+            return member
+    return None
+
+
+def server_for_user(self, user_id):
+    member = find_member(self, user_id)
+    if member:
+        return member.server
+    return next(iter(self.guilds.values())).server if self.guilds else None
+
+
+def memory_usage(self):
+    """approximate bytes used by each configured server's cached objects,
+    by server id. walks live objects, so run it in an executor."""
+    servers = [x.server for x in self.guilds.values()]
+    usage = OrderedDict()
+    for state in list(self.guilds.values()):
+        exclude = [self] + [x for x in servers if x is not state.server]
+        for _ in range(3):
+            try:
+                usage[state.id] = perf.deep_size(state.server, exclude)
+                break
+            except RuntimeError:  # mutated by the loop thread meanwhile
+                continue
+    return usage
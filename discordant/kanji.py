@@ -0,0 +1,237 @@
+import asyncio
+import os
+import re
+from collections import namedtuple
+
+from discordant.lazy import lazy_import
+
+etree = lazy_import("lxml.etree")
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+
+Kanji = namedtuple('Kanji', ['literal', 'meanings', 'on', 'kun', 'nanori',
+                             'strokes', 'radical', 'grade', 'jlpt', 'freq'])
+
+_SVG_NS = "http://www.w3.org/2000/svg"
+_KVG_NS = "http://kanjivg.tagaini.net"
+_PATH_TOKEN_REGEX = re.compile(
+    r"[MmCcSsLlHhVvZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+FRAME_SIZE = 109  # kanjivg viewbox width/height, same as jisho's frames
+_SCALE = 4  # supersampling factor for antialiased strokes
+
+_kanjidic = None
+_kanjidic_future = None
+
+
+def load_kanjidic(path):
+    index = {}
+    for _, elem in etree.iterparse(path, tag="character"):
+        literal = elem.findtext("literal")
+        readings = {"ja_on": [], "ja_kun": []}
+        for reading in elem.iterfind("reading_meaning/rmgroup/reading"):
+            if reading.get("r_type") in readings:
+                readings[reading.get("r_type")].append(reading.text)
+        radical = elem.findtext('radical/rad_value[@rad_type="classical"]')
+        grade = elem.findtext("misc/grade")
+        jlpt = elem.findtext("misc/jlpt")
+        freq = elem.findtext("misc/freq")
+        index[literal] = Kanji(
+            literal,
+            [x.text for x in elem.iterfind("reading_meaning/rmgroup/meaning")
+             if "m_lang" not in x.attrib],
+            readings["ja_on"],
+            readings["ja_kun"],
+            [x.text for x in elem.iterfind("reading_meaning/nanori")],
+            int(elem.findtext("misc/stroke_count")),
+            int(radical) if radical else None,
+            int(grade) if grade else None,
+            int(jlpt) if jlpt else None,
+            int(freq) if freq else None)
+        # iterparse keeps the whole tree around otherwise
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+    return index
+
+
+async def get_kanjidic(self):
+    global _kanjidic, _kanjidic_future
+    if _kanjidic is not None:
+        return _kanjidic
+    path = _data_path(self, "kanjidic")
+    if not path or not os.path.isfile(path):
+        return None
+    if _kanjidic_future is None:
+        _kanjidic_future = self.loop.run_in_executor(None, load_kanjidic, path)
+    future = _kanjidic_future
+    try:
+        _kanjidic = await asyncio.shield(future)
+    except Exception:
+        # let the next call try loading it again
+        if _kanjidic_future is future:
+            _kanjidic_future = None
+        raise
+    return _kanjidic
+
+
+def radical_char(number):
+    # kangxi radicals are laid out in order starting at U+2F00
+    return chr(0x2F00 + number - 1)
+
+
+def kanji_stats(kanji):
+    stats = []
+    if kanji.grade is not None:
+        if kanji.grade <= 6:
+            stats.append("Jōyō kanji, taught in grade {}".format(kanji.grade))
+        elif kanji.grade == 8:
+            stats.append("Jōyō kanji, taught in junior high")
+        else:
+            stats.append("Jinmeiyō kanji, used in names")
+    if kanji.jlpt is not None:
+        stats.append("Old JLPT level {}".format(kanji.jlpt))
+    if kanji.freq is not None:
+        stats.append("{} of 2500 most used kanji in newspapers".format(
+            kanji.freq))
+    return " ".join(x + "." for x in stats)
+
+
+def kanjivg_file(self, character):
+    directory = _data_path(self, "kanjivg")
+    if not directory:
+        return None
+    path = os.path.join(directory, "{:05x}.svg".format(ord(character)))
+    return path if os.path.isfile(path) else None
+
+
+def kanjivg_parts(path):
+    tree = etree.parse(path)
+    root = tree.find('.//{{{0}}}g[@id]/{{{0}}}g'.format(_SVG_NS))
+    if root is None:
+        return []
+    element = "{{{}}}element".format(_KVG_NS)
+    parts = []
+    for g in root.iter("{{{}}}g".format(_SVG_NS)):
+        part = g.get(element)
+        if part and part not in parts and g is not root:
+            parts.append(part)
+    return parts
+
+
+def kanjivg_strokes(path):
+    tree = etree.parse(path)
+    return [parse_svg_path(x.get("d"))
+            for x in tree.iter("{{{}}}path".format(_SVG_NS))]
+
+
+def parse_svg_path(d, steps=12):
+    """parses an svg path into a list of points, sampling bezier curves.
+    only the commands kanjivg actually uses are supported."""
+    tokens = _PATH_TOKEN_REGEX.findall(d)
+    points = []
+    pos = (0.0, 0.0)
+    start = pos
+    ctrl = None
+    cmd = None
+    i = 0
+
+    def read(n):
+        nonlocal i
+        values = [float(x) for x in tokens[i:i + n]]
+        i += n
+        return values
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            cmd = tokens[i]
+            i += 1
+        rel = cmd.islower()
+        ox, oy = pos if rel else (0.0, 0.0)
+        upper = cmd.upper()
+        if upper == "M":
+            x, y = read(2)
+            pos = start = (ox + x, oy + y)
+            points.append(pos)
+            cmd = "l" if rel else "L"  # implicit lineto after moveto
+            ctrl = None
+        elif upper == "L":
+            x, y = read(2)
+            pos = (ox + x, oy + y)
+            points.append(pos)
+            ctrl = None
+        elif upper == "H":
+            x, = read(1)
+            pos = (ox + x, pos[1])
+            points.append(pos)
+            ctrl = None
+        elif upper == "V":
+            y, = read(1)
+            pos = (pos[0], oy + y)
+            points.append(pos)
+            ctrl = None
+        elif upper in ("C", "S"):
+            if upper == "C":
+                x1, y1, x2, y2, x, y = read(6)
+                c1 = (ox + x1, oy + y1)
+            else:
+                x2, y2, x, y = read(4)
+                # reflection of the previous control point
+                c1 = (2 * pos[0] - ctrl[0], 2 * pos[1] - ctrl[1]) \
+                    if ctrl else pos
+            c2 = (ox + x2, oy + y2)
+            end = (ox + x, oy + y)
+            points.extend(_bezier(pos, c1, c2, end, steps))
+            pos = end
+            ctrl = c2
+        elif upper == "Z":
+            pos = start
+            points.append(pos)
+            ctrl = None
+        else:
+            raise ValueError("Unsupported path command: " + cmd)
+    return points
+
+
+def _bezier(p0, p1, p2, p3, steps):
+    points = []
+    for n in range(1, steps + 1):
+        t = n / steps
+        mt = 1 - t
+        a, b, c, d = mt ** 3, 3 * mt ** 2 * t, 3 * mt * t ** 2, t ** 3
+        points.append((a * p0[0] + b * p1[0] + c * p2[0] + d * p3[0],
+                       a * p0[1] + b * p1[1] + c * p2[1] + d * p3[1]))
+    return points
+
+
+def render_stroke_frames(strokes):
+    """renders a horizontal strip with one frame per stroke, the same
+    layout as the old jisho stroke diagrams."""
+    size = FRAME_SIZE * _SCALE
+    width = 3 * _SCALE
+    img = Image.new("RGBA", (size * len(strokes), size), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for frame in range(len(strokes)):
+        left = frame * size
+        # guide lines
+        draw.line([(left + size // 2, 0), (left + size // 2, size)],
+                  fill=(221, 221, 221, 255), width=_SCALE)
+        draw.line([(left, size // 2), (left + size, size // 2)],
+                  fill=(221, 221, 221, 255), width=_SCALE)
+        if frame:
+            draw.line([(left, 0), (left, size)],
+                      fill=(170, 170, 170, 255), width=_SCALE)
+        for index, stroke in enumerate(strokes[:frame + 1]):
+            current = index == frame
+            points = [(left + x * _SCALE, y * _SCALE) for x, y in stroke]
+            colour = (204, 0, 0, 255) if current else (0, 0, 0, 255)
+            draw.line(points, fill=colour, width=width, joint="curve")
+            if current:
+                x, y = points[0]
+                r = width
+                draw.ellipse([x - r, y - r, x + r, y + r], fill=colour)
+    return img.resize((FRAME_SIZE * len(strokes), FRAME_SIZE), Image.LANCZOS)
+
+
+def _data_path(self, key):
+    return self.config.get("data", {}).get(key)
@@ -0,0 +1,23 @@
+import importlib
+import logging
+import time
+import types
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule(types.ModuleType):
+    """stands in for a module until one of its attributes is first used,
+    then imports it. keeps heavy dependencies off the startup path."""
+
+    def __getattr__(self, name):
+        start = time.perf_counter()
+        module = importlib.import_module(self.__name__)
+        logger.debug("Imported %s on first use in %.0f ms", self.__name__,
+                     (time.perf_counter() - start) * 1000)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+def lazy_import(name):
+    return LazyModule(name)
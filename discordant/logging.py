@@ -1,21 +1,82 @@
+import atexit
+import copy
+import gzip
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 from sys import stdout
 from datetime import datetime
-import os
+
+import discordant.monitor as monitor
 
 
-def get_default_logfile():
+def get_default_logfile(name='discordant'):
     log_dir = 'logs'
     if not os.path.exists(log_dir):
         os.mkdir(log_dir)
     elif not os.path.isdir(log_dir):
         raise IOError('cannot write to default log directory (./{})'.format(
                 log_dir))
-    return '{}/{}.log'.format(log_dir, datetime.now()).replace(':', '.')
+    return '{}/{}.log'.format(log_dir, name)
+
+
+class JsonFormatter(logging.Formatter):
+    """formats records as one json object per line."""
+
+    def format(self, record):
+        entry = {"time": datetime.fromtimestamp(record.created).isoformat(),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "message": record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+_exc_formatter = logging.Formatter()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # render args and tracebacks while they're still valid, but leave
+        # the layout to the listener's formatters
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _stop_listener(listener):
+    if listener._thread is not None:
+        listener.stop()
 
 
 def configure_logging(logfile=None, logfile_level=logging.DEBUG,
-                      stdout_level=logging.INFO):
+                      stdout_level=logging.INFO, loop_monitor=True,
+                      lag_threshold=0.1, max_bytes=10 * 2 ** 20, when=None,
+                      backup_count=10, json_lines=False):
+    """records are only queued on the calling thread; a listener thread
+    formats and writes them. the log file is rotated when it reaches
+    max_bytes, or at the interval given by when (e.g. "midnight") if set,
+    and old files are gzipped. returns the started listener."""
     logger = logging.getLogger()
     logger.setLevel(logfile_level)
     format_str = '%(asctime)s (%(levelname)s) - %(name)s: %(message)s'
@@ -23,14 +84,33 @@ def configure_logging(logfile=None, logfile_level=logging.DEBUG,
     # log all messages to a log file
     if logfile is None:
         logfile = get_default_logfile()
-    file_handler = logging.FileHandler(filename=logfile, encoding='utf-8',
-                                       mode='w')
+    if when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            logfile, when=when, backupCount=backup_count, encoding='utf-8')
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            logfile, maxBytes=max_bytes, backupCount=backup_count,
+            encoding='utf-8')
+    file_handler.namer = _gzip_namer
+    file_handler.rotator = _gzip_rotator
     file_handler.setLevel(logfile_level)
-    file_handler.setFormatter(logging.Formatter(format_str))
-    logger.addHandler(file_handler)
+    file_handler.setFormatter(JsonFormatter() if json_lines
+                              else logging.Formatter(format_str))
 
     # log info or higher messages to stdout
     stdout_handler = logging.StreamHandler(stdout)
     stdout_handler.setLevel(stdout_level)
     stdout_handler.setFormatter(logging.Formatter(format_str))
-    logger.addHandler(stdout_handler)
+
+    log_queue = queue.Queue()
+    logger.addHandler(_QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stdout_handler, respect_handler_level=True)
+    listener.start()
+    # flushes whatever is still queued
+    atexit.register(_stop_listener, listener)
+
+    # watch the event loop for blocking calls
+    if loop_monitor:
+        monitor.install(threshold=lag_threshold)
+    return listener
@@ -0,0 +1,139 @@
+import asyncio
+import re
+from datetime import timedelta
+
+import discordant.retention as retention
+
+# hiragana, katakana, cjk ideographs and halfwidth katakana, which aren't
+# written with spaces, so they're indexed as n-grams instead of words
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f"
+_TOKEN = re.compile("([{0}]+)|([^\\W{0}]+)".format(_CJK))
+# logs are searched through this multikey index on each message's tokens
+INDEX = [("server_id", 1), ("tokens", 1), ("timestamp", -1)]
+# and compacted ones through the tokens of all the messages in each bucket
+BUCKET_INDEX = [("server_id", 1), ("tokens", 1), ("day", -1)]
+PAGE_SIZE = 10
+
+
+def tokens(text):
+    """the search terms a message is indexed under: lowercased words, and
+    every character and character pair of japanese text."""
+    result = set()
+    for match in _TOKEN.finditer(text):
+        run = match.group(1)
+        if run:
+            result.update(run)
+            result.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            result.add(match.group(2).lower())
+    return sorted(result)
+
+
+def bucket_tokens(logs):
+    """the tokens of every message in a bucket."""
+    result = set()
+    for log in logs:
+        result.update(tokens(log.get("content") or ""))
+    return sorted(result)
+
+
+def build_query(server_id, search, user_id=None, channel_id=None,
+                after=None, before=None):
+    """the mongo query for messages containing every word and piece of
+    japanese text in search, or None if there's nothing to search for.
+    character pairs can match out of order, so japanese text longer than
+    two characters is also matched against the content."""
+    terms, runs = set(), []
+    for match in _TOKEN.finditer(search):
+        run = match.group(1)
+        if run:
+            terms.update([run] if len(run) == 1 else
+                         [run[i:i + 2] for i in range(len(run) - 1)])
+            if len(run) > 2:
+                runs.append(run)
+        else:
+            terms.add(match.group(2).lower())
+    if not terms:
+        return None
+    query = {"server_id": server_id, "tokens": {"$all": sorted(terms)}}
+    if runs:
+        query["content"] = re.compile("".join(
+            "(?=.*{})".format(re.escape(x)) for x in runs), re.DOTALL)
+    if user_id:
+        query["author_id"] = user_id
+    if channel_id:
+        query["channel_id"] = channel_id
+    dates = {}
+    if after:
+        dates["$gte"] = after
+    if before:
+        dates["$lt"] = before + timedelta(days=1)
+    if dates:
+        query["timestamp"] = dates
+    return query
+
+
+def matches(log, query):
+    """whether a message expanded from a bucket matches the query."""
+    content = log.get("content") or ""
+    return retention.matches(log, query) and \
+        set(query["tokens"]["$all"]).issubset(tokens(content)) and \
+        ("content" not in query or bool(query["content"].search(content)))
+
+
+async def search(db, query, page=1, page_size=PAGE_SIZE):
+    """a page of matching messages, newest first, and whether there are
+    more after it. messages in the logs collection come first, then the
+    compacted ones, which are older but for each channel's last message."""
+    start = (page - 1) * page_size
+    documents = await db.logs.find(query).sort("timestamp", -1).skip(
+        start).limit(page_size + 1).to_list(page_size + 1)
+    if len(documents) > page_size:
+        return documents[:page_size], True
+    # the rest of the page comes from the buckets
+    skip = 0 if documents else max(start - await db.logs.count(query), 0)
+    wanted = page_size + 1 - len(documents)
+    bucket_query = dict(retention.bucket_query(query), tokens=query["tokens"])
+    buckets = db[retention.BUCKETS].find(bucket_query).sort("day", -1)
+    day, logs = None, []
+    while (await buckets.fetch_next):
+        bucket = buckets.next_object()
+        # a day has a bucket per channel, so only whole days are taken
+        if bucket["day"] != day and len(logs) >= skip + wanted:
+            break
+        day = bucket["day"]
+        logs.extend(x for x in retention.expand(bucket) if matches(x, query))
+    logs.sort(key=lambda x: x["timestamp"], reverse=True)
+    documents += logs[skip:skip + wanted]
+    return documents[:page_size], len(documents) > page_size
+
+
+async def backfill(db, server_id, batch_size=500, pause=0.1):
+    """adds tokens to the server's messages logged before they were
+    indexed, and to buckets compacted before then, a batch at a time so it
+    doesn't hog the database. returns how many messages were updated."""
+    await db.logs.create_index(INDEX)
+    await db[retention.BUCKETS].create_index(BUCKET_INDEX)
+    count = 0
+    unindexed = {"server_id": server_id, "tokens": {"$exists": False}}
+    while True:
+        documents = await db.logs.find(
+            unindexed, {"content": True}).limit(batch_size).to_list(
+            batch_size)
+        if not documents:
+            break
+        for document in documents:
+            await db.logs.update_one(
+                {"_id": document["_id"]},
+                {"$set": {"tokens": tokens(document.get("content") or "")}})
+        count += len(documents)
+        await asyncio.sleep(pause)
+    while True:
+        bucket = await db[retention.BUCKETS].find_one(unindexed)
+        if not bucket:
+            return count
+        await db[retention.BUCKETS].update_one(
+            {"_id": bucket["_id"]},
+            {"$set": {"tokens": bucket_tokens(retention.expand(bucket))}})
+        count += bucket["count"]
+        await asyncio.sleep(pause)
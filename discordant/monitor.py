@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import discordant.perf as perf
+
+logger = logging.getLogger(__name__)
+
+_current_task = getattr(asyncio, "current_task", None) or \
+    asyncio.Task.current_task
+
+_monitor = None
+
+
+class LoopMonitor:
+    """measures event loop scheduling lag. a watchdog thread snapshots the
+    loop thread's stack while it's blocked, so stalls longer than threshold
+    get reported with the code and the command/event that caused them."""
+
+    def __init__(self, loop, interval=0.25, threshold=0.1, samples=4096):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = deque(maxlen=samples)
+        self.stalls = 0
+        # maps a task to a label, e.g. the command running in it
+        self.labelers = []
+        self._heartbeat = time.monotonic()
+        self._loop_thread = None
+        self._snapshot = None
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._measure(), loop=self.loop)
+        thread = threading.Thread(target=self._watchdog, name="loop-watchdog",
+                                  daemon=True)
+        thread.start()
+
+    def percentiles(self, *ps):
+        return perf.percentiles(self.samples, *ps)
+
+    def label(self, task):
+        if task is None:
+            return "no task (callback)"
+        for labeler in self.labelers:
+            try:
+                label = labeler(task)
+            except RuntimeError:  # mutated by the loop thread meanwhile
+                continue
+            if label:
+                return label
+        coro = getattr(task, "_coro", None)
+        return getattr(coro, "__qualname__", repr(task))
+
+    async def _measure(self):
+        self._loop_thread = threading.get_ident()
+        while True:
+            start = self.loop.time()
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self.loop.time() - start - self.interval)
+            self.samples.append(lag)
+            snapshot, self._snapshot = self._snapshot, None
+            if lag >= self.threshold:
+                self.stalls += 1
+                if snapshot:
+                    logger.warning(
+                        "Event loop blocked for %.0f ms in %s:\n%s",
+                        lag * 1000, *snapshot)
+                else:
+                    logger.warning("Event loop blocked for %.0f ms.",
+                                   lag * 1000)
+
+    def _watchdog(self):
+        while True:
+            time.sleep(self.threshold / 2)
+            if self._loop_thread is None or self._snapshot:
+                continue
+            late = time.monotonic() - self._heartbeat - self.interval
+            if late < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame, limit=8))
+            try:
+                task = _current_task(self.loop)
+            except RuntimeError:
+                task = None
+            self._snapshot = (self.label(task), stack)
+
+
+def install(loop=None, interval=0.25, threshold=0.1):
+    global _monitor
+    if _monitor is None:
+        _monitor = LoopMonitor(loop or asyncio.get_event_loop(), interval,
+                               threshold)
+        _monitor.start()
+    return _monitor
+
+
+def get_monitor():
+    return _monitor
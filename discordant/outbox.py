@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import discordant.utils as utils
+
+logger = logging.getLogger(__name__)
+
+
+class _ChannelQueue:
+    def __init__(self, channel):
+        self.channel = channel
+        self.pending = deque()  # (text, max_chars, future)
+        self.sent_at = deque()  # times of the latest sends, for rate limiting
+        self.task = None
+        self.sent = 0
+
+
+class Outbox:
+    """outbound text queues, one per channel. text queued while a channel's
+    previous messages are still going out is packed together into as few
+    messages as possible. each channel is held to rate messages per per
+    seconds (discord's per channel limit) by its own worker task, so a
+    busy channel doesn't hold up any other."""
+
+    def __init__(self, send, rate=5, per=5.0):
+        self.send_message = send
+        self.rate = rate
+        self.per = per
+        self.queues = {}  # channel id -> _ChannelQueue
+
+    def send(self, channel, text, max_chars=2000):
+        """returns a future for the messages text went out in."""
+        queue = self.queues.get(channel.id)
+        if queue is None:
+            self._prune()
+            queue = self.queues[channel.id] = _ChannelQueue(channel)
+        future = asyncio.Future()
+        queue.pending.append((text, max_chars, future))
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.ensure_future(self._run(queue))
+        return future
+
+    @property
+    def depth(self):
+        return sum(len(x.pending) for x in self.queues.values())
+
+    def busiest(self, n=5):
+        """(channel, queued texts) of the n channels with the most queued."""
+        return sorted([(x.channel, len(x.pending))
+                       for x in self.queues.values() if x.pending],
+                      key=lambda x: x[1], reverse=True)[:n]
+
+    def prometheus(self, labels=None):
+        extra = "".join(',{}="{}"'.format(k, v)
+                        for k, v in sorted((labels or {}).items()))
+        return ("# HELP discordant_outbox_depth "
+                "Texts waiting in outbound channel queues.\n"
+                "# TYPE discordant_outbox_depth gauge\n"
+                "discordant_outbox_depth{{{}}} {}\n").format(
+            extra.lstrip(","), self.depth)
+
+    async def _run(self, queue):
+        while queue.pending:
+            batch = list(queue.pending)
+            queue.pending.clear()
+            chunks = utils.pack_message(
+                "\n".join(x[0] for x in batch), min(x[1] for x in batch))
+            messages = []
+            try:
+                for chunk in chunks:
+                    await self._wait_turn(queue)
+                    messages.append(await self.send_message(
+                        queue.channel, chunk))
+                    queue.sent += 1
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result(messages)
+
+    def _prune(self):
+        # queues are kept while their sends still count toward the limit
+        now = time.monotonic()
+        for channel_id, queue in list(self.queues.items()):
+            if not queue.pending and (
+                    queue.task is None or queue.task.done()) and (
+                    not queue.sent_at or queue.sent_at[-1] + self.per < now):
+                del self.queues[channel_id]
+
+    async def _wait_turn(self, queue):
+        if len(queue.sent_at) >= self.rate:
+            wait = queue.sent_at[0] + self.per - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            queue.sent_at.popleft()
+        queue.sent_at.append(time.monotonic())
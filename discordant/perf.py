@@ -0,0 +1,261 @@
+import asyncio
+import inspect
+import os
+import sys
+import time
+import types
+from collections import OrderedDict, deque
+
+UPSTREAMS = ("http", "mongo", "discord")
+# prometheus histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           float("inf"))
+
+_current_task = getattr(asyncio, "current_task", None) or \
+    asyncio.Task.current_task
+
+
+class CommandStats:
+    def __init__(self, samples=1024):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.upstream = dict.fromkeys(UPSTREAMS, 0.0)
+        self.samples = deque(maxlen=samples)
+
+    def add(self, duration, upstream, error):
+        self.count += 1
+        self.errors += error
+        self.total += duration
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                self.buckets[i] += 1
+                break
+        for name, value in upstream.items():
+            self.upstream[name] += value
+        self.samples.append(duration)
+
+    def percentiles(self, *ps):
+        return percentiles(self.samples, *ps)
+
+
+class _Timer:
+    def __init__(self, name, task, parent, handler):
+        self.name = name
+        self.task = task
+        self.parent = parent  # timer of a command running this one
+        self.handler = handler
+        self.upstream = dict.fromkeys(UPSTREAMS, 0.0)
+        self.start = time.perf_counter()
+        self.error = False
+
+
+class Metrics:
+    """per command counts, error counts and latency, with the time spent
+    waiting on upstream http, mongo and discord calls split out."""
+
+    def __init__(self):
+        self.commands = {}
+        self.handlers = {}  # same as commands, for event handlers
+        self._timers = {}  # task -> timer of the command running in it
+
+    def start(self, name, handler=False):
+        task = _current_task()
+        timer = _Timer(name, task, self._timers.get(task), handler)
+        self._timers[task] = timer
+        return timer
+
+    def stop(self, timer):
+        if timer.parent:
+            self._timers[timer.task] = timer.parent
+        else:
+            self._timers.pop(timer.task, None)
+        stats = self.handlers if timer.handler else self.commands
+        if timer.name not in stats:
+            stats[timer.name] = CommandStats()
+        stats[timer.name].add(time.perf_counter() - timer.start,
+                              timer.upstream, timer.error)
+
+    def current(self, task=None):
+        timer = self._timers.get(task or _current_task())
+        return timer.name if timer else None
+
+    async def track(self, upstream, awaitable):
+        timer = self._timers.get(_current_task())
+        if timer is None:
+            return await awaitable
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            timer.upstream[upstream] += time.perf_counter() - start
+
+    def spawn(self, coro):
+        """schedules coro as a task that shares the current command timer,
+        so upstream time spent in the task is still attributed to it."""
+        timer = self._timers.get(_current_task())
+        task = asyncio.ensure_future(coro)
+        if timer is not None:
+            self._timers[task] = timer
+            task.add_done_callback(lambda t: self._timers.pop(t, None))
+        return task
+
+    def wrap(self, upstream, func):
+        async def wrapper(*args, **kwargs):
+            return await self.track(upstream, func(*args, **kwargs))
+
+        return wrapper
+
+    def prometheus(self, labels=None):
+        extra = "".join(',{}="{}"'.format(k, v)
+                        for k, v in sorted((labels or {}).items()))
+        lines = ["# HELP discordant_command_duration_seconds "
+                 "Command latency.",
+                 "# TYPE discordant_command_duration_seconds histogram"]
+        for name, stats in sorted(self.commands.items()):
+            label = 'command="{}"{}'.format(name, extra)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(
+                    'discordant_command_duration_seconds_bucket'
+                    '{{{},le="{}"}} {}'.format(
+                        label, "+Inf" if bound == float("inf") else bound,
+                        cumulative))
+            lines.append("discordant_command_duration_seconds_sum{{{}}} "
+                         "{}".format(label, stats.total))
+            lines.append("discordant_command_duration_seconds_count{{{}}} "
+                         "{}".format(label, stats.count))
+        lines += ["# HELP discordant_command_errors_total "
+                  "Commands that raised an exception.",
+                  "# TYPE discordant_command_errors_total counter"]
+        lines += ['discordant_command_errors_total{{command="{}"{}}} {}'.format(
+            name, extra, stats.errors)
+                  for name, stats in sorted(self.commands.items())]
+        lines += ["# HELP discordant_command_upstream_seconds_total "
+                  "Time commands spent waiting on upstream calls.",
+                  "# TYPE discordant_command_upstream_seconds_total counter"]
+        for name, stats in sorted(self.commands.items()):
+            for upstream in UPSTREAMS:
+                lines.append(
+                    'discordant_command_upstream_seconds_total'
+                    '{{command="{}",upstream="{}"{}}} {}'.format(
+                        name, upstream, extra, stats.upstream[upstream]))
+        return "\n".join(lines) + "\n"
+
+
+class StartupTimer:
+    """time spent in each startup phase, marked in order. start is the
+    time.perf_counter() value the first phase began at."""
+
+    def __init__(self, start=None):
+        self.start = self.last = start or time.perf_counter()
+        self.phases = []
+        self.done = False
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        lines = ["{:<16} {:>8.0f} ms".format(phase, duration * 1000)
+                 for phase, duration in self.phases]
+        lines.append("{:<16} {:>8.0f} ms".format(
+            "ready", (self.last - self.start) * 1000))
+        return "\n".join(lines)
+
+
+def percentiles(samples, *ps):
+    ordered = sorted(samples)
+    if not ordered:
+        return [0.0 for _ in ps]
+    return [ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+            for p in ps]
+
+
+def merge_prometheus(texts):
+    """merges metrics files written by several processes, whose samples
+    are told apart by their labels, grouping the samples by metric."""
+    families = OrderedDict()
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                name = line.split(None, 3)[2]
+                family = families.setdefault(name, ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line and family is not None:
+                family[1].append(line)
+    lines = []
+    for meta, samples in families.values():
+        lines += meta + samples
+    return "\n".join(lines) + "\n"
+
+
+_NOT_OWNED = (type, types.ModuleType, types.FunctionType, types.MethodType,
+              types.BuiltinFunctionType)
+
+
+def deep_size(obj, exclude=()):
+    """approximate bytes used by obj and everything reachable from it,
+    except through the objects in exclude."""
+    seen = set(id(x) for x in exclude)
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _NOT_OWNED):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        if hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+        for cls in type(obj).__mro__:
+            slots = cls.__dict__.get("__slots__", ())
+            for name in [slots] if isinstance(slots, str) else slots:
+                if hasattr(obj, name):
+                    stack.append(getattr(obj, name))
+    return size
+
+
+def write_file(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class Timed:
+    """proxy around a motor database, collection or cursor which records
+    the time spent awaiting its operations as mongo time."""
+    proxied_types = ("AsyncIOMotor",)  # class name prefixes to proxy
+
+    def __init__(self, obj, metrics):
+        self._obj = obj
+        self._metrics = metrics
+
+    def _wrap(self, value):
+        if inspect.isawaitable(value):
+            return self._metrics.track("mongo", value)
+        if type(value).__name__.startswith(self.proxied_types):
+            return Timed(value, self._metrics)
+        if callable(value):
+            def wrapper(*args, **kwargs):
+                return self._wrap(value(*args, **kwargs))
+
+            return wrapper
+        return value
+
+    def __getattr__(self, name):
+        return self._wrap(getattr(self._obj, name))
+
+    def __getitem__(self, name):
+        return self._wrap(self._obj[name])
@@ -0,0 +1,149 @@
+"""compacts logged messages older than the retention age into one
+compressed document per channel and day, in the log_buckets collection.
+the activity rollups are kept separately and aren't touched, and buckets
+list their authors and search tokens so messages can still be found by
+user and by logsearch."""
+import asyncio
+import json
+import zlib
+from datetime import datetime, timedelta
+
+import discordant.rollups as rollups
+from discordant.lazy import lazy_import
+
+# logsearch reads buckets through this module, so it can't be imported here
+# while it's still loading
+logsearch = lazy_import("discordant.logsearch")
+
+BUCKETS = "log_buckets"
+_FIELDS = ("message_id", "author_id", "timestamp", "content")
+
+
+def _pack(logs):
+    return zlib.compress(json.dumps(
+        [[x["message_id"], x["author_id"], x["timestamp"].isoformat(),
+          x["content"]] for x in logs], ensure_ascii=False).encode(), 9)
+
+
+def _parse_time(s):
+    return datetime.strptime(
+        s, "%Y-%m-%dT%H:%M:%S.%f" if "." in s else "%Y-%m-%dT%H:%M:%S")
+
+
+def expand(bucket):
+    """the bucket's messages as log documents, oldest first."""
+    logs = []
+    for values in json.loads(zlib.decompress(bucket["messages"]).decode()):
+        log = dict(zip(_FIELDS, values))
+        log["timestamp"] = _parse_time(log["timestamp"])
+        log.update(server_id=bucket["server_id"],
+                   channel_id=bucket["channel_id"])
+        logs.append(log)
+    return logs
+
+
+def bucket_query(query):
+    """the buckets that can hold messages matching a logs query made of
+    server, channel, author and timestamp conditions."""
+    result = {k: v for k, v in query.items()
+              if k in ("server_id", "channel_id")}
+    if "author_id" in query:
+        result["authors"] = query["author_id"]
+    if "timestamp" in query:
+        days = {}
+        if "$gte" in query["timestamp"]:
+            days["$gte"] = rollups.day_of(query["timestamp"]["$gte"])
+        if "$lt" in query["timestamp"]:
+            days["$lt"] = query["timestamp"]["$lt"]
+        result["day"] = days
+    return result
+
+
+def matches(log, query):
+    """whether an expanded log matches the query bucket_query was given."""
+    for key in ("channel_id", "author_id"):
+        if key in query and log[key] != query[key]:
+            return False
+    dates = query.get("timestamp", {})
+    return not ("$gte" in dates and log["timestamp"] < dates["$gte"] or
+                "$lt" in dates and log["timestamp"] >= dates["$lt"])
+
+
+async def _compact_day(db, server_id, channel_id, day, cutoff):
+    logs = await db.logs.find({
+        "server_id": server_id, "channel_id": channel_id,
+        "timestamp": {"$gte": day, "$lt": min(day + timedelta(days=1),
+                                              cutoff)}}).to_list(None)
+    # the channel's last logged message is where stats_update picks up
+    # logging again, so it has to stay
+    newest = await db.logs.find(
+        {"server_id": server_id, "channel_id": channel_id}).sort(
+        "timestamp", -1).limit(1).to_list(1)
+    logs = [x for x in logs if x["_id"] != newest[0]["_id"]]
+    if not logs:
+        return 0
+    query = {"server_id": server_id, "channel_id": channel_id, "day": day}
+    bucket = await db[BUCKETS].find_one(query)
+    merged = {x["message_id"]: x for x in expand(bucket)} if bucket else {}
+    merged.update((x["message_id"], x) for x in logs)
+    merged = sorted(merged.values(), key=lambda x: x["timestamp"])
+    # the bucket is written before the messages are removed, so stopping
+    # in between only leaves messages that are merged in again next time
+    await db[BUCKETS].update_one(query, {"$set": {
+        "count": len(merged),
+        "authors": sorted({x["author_id"] for x in merged}),
+        "tokens": logsearch.bucket_tokens(merged),
+        "messages": _pack(merged)}}, upsert=True)
+    await db.logs.delete_many({"_id": {"$in": [x["_id"] for x in logs]}})
+    return len(logs)
+
+
+async def compact(db, server_id, cutoff, pause=0.5):
+    """compacts the server's messages from before cutoff, oldest day first,
+    one channel and day at a time with a pause in between, so no single
+    write holds the collection for long. returns how many were compacted."""
+    await db.logs.create_index([("server_id", 1), ("timestamp", 1)])
+    await db[BUCKETS].create_index(
+        [("server_id", 1), ("channel_id", 1), ("day", 1)], unique=True)
+    await db[BUCKETS].create_index([("server_id", 1), ("authors", 1)])
+    total = 0
+    skip = 0
+    while True:
+        oldest = await db.logs.find(
+            {"server_id": server_id, "timestamp": {"$lt": cutoff}}).sort(
+            "timestamp", 1).skip(skip).limit(1).to_list(1)
+        if not oldest:
+            return total
+        count = await _compact_day(
+            db, server_id, oldest[0]["channel_id"],
+            rollups.day_of(oldest[0]["timestamp"]), cutoff)
+        if not count:
+            skip += 1  # a channel's last message, which is kept
+        total += count
+        await asyncio.sleep(pause)
+
+
+async def logged_ids(db, server_id, channel_id, logs):
+    """the message ids of logs that are already logged, whether in the logs
+    collection or compacted."""
+    if not logs:
+        return set()
+    ids = [x["message_id"] for x in logs]
+    first = min(x["timestamp"] for x in logs)
+    last = max(x["timestamp"] for x in logs)
+    found = await db.logs.find({
+        "server_id": server_id, "channel_id": channel_id,
+        "timestamp": {"$gte": first, "$lte": last},
+        "message_id": {"$in": ids}}, {"message_id": True}).to_list(None)
+    logged = {x["message_id"] for x in found}
+    buckets = await db[BUCKETS].find({
+        "server_id": server_id, "channel_id": channel_id,
+        "day": {"$gte": rollups.day_of(first), "$lte": last}}).to_list(None)
+    for bucket in buckets:
+        logged.update(x["message_id"] for x in expand(bucket))
+    return logged.intersection(ids)
+
+
+def cutoff(days):
+    """the start of the oldest day that's kept uncompacted."""
+    return rollups.day_of(datetime.utcnow()) - timedelta(days=days)
@@ -0,0 +1,107 @@
+"""daily message counts per user and per channel, kept up to date as
+messages are logged, so activity questions don't scan the logs."""
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+
+from discordant.lazy import lazy_import
+
+# retention uses this module, so it can't be imported here while it's still
+# loading
+retention = lazy_import("discordant.retention")
+
+USERS = "activity_users"
+CHANNELS = "activity_channels"
+_KEYS = {USERS: "user_id", CHANNELS: "channel_id"}
+
+
+def day_of(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def days_ago(days):
+    return day_of(datetime.utcnow()) - timedelta(days=days - 1)
+
+
+def count(logs):
+    """(user id, day) and (channel id, day) message counts of log
+    documents."""
+    users, channels = Counter(), Counter()
+    for log in logs:
+        day = day_of(log["timestamp"])
+        users[log["author_id"], day] += 1
+        channels[log["channel_id"], day] += 1
+    return users, channels
+
+
+async def add(db, server_id, logs):
+    """adds newly logged messages to the rollups."""
+    for name, counts in zip((USERS, CHANNELS), count(logs)):
+        for (key, day), n in counts.items():
+            await db[name].update_one(
+                {"server_id": server_id, _KEYS[name]: key, "day": day},
+                {"$inc": {"count": n}}, upsert=True)
+
+
+async def backfill(db, server_id):
+    """builds the rollups from messages logged before they existed, once,
+    including ones already compacted. streams the logs and buckets, so
+    only the counts are held in memory."""
+    for name, key in _KEYS.items():
+        await db[name].create_index([("server_id", 1), (key, 1), ("day", 1)])
+        await db[name].create_index([("server_id", 1), ("day", 1)])
+    if await db[USERS].find_one({"server_id": server_id}):
+        return 0
+    users, channels = Counter(), Counter()
+    cursor = db.logs.find({"server_id": server_id},
+                          {"author_id": True, "channel_id": True,
+                           "timestamp": True})
+    total = 0
+    while (await cursor.fetch_next):
+        log = cursor.next_object()
+        day = day_of(log["timestamp"])
+        users[log["author_id"], day] += 1
+        channels[log["channel_id"], day] += 1
+        total += 1
+    buckets = db[retention.BUCKETS].find({"server_id": server_id})
+    while (await buckets.fetch_next):
+        for log in retention.expand(buckets.next_object()):
+            day = day_of(log["timestamp"])
+            users[log["author_id"], day] += 1
+            channels[log["channel_id"], day] += 1
+            total += 1
+    for name, counts in zip((USERS, CHANNELS), (users, channels)):
+        documents = [{"server_id": server_id, _KEYS[name]: key, "day": day,
+                      "count": n} for (key, day), n in counts.items()]
+        if documents:
+            await db[name].insert_many(documents)
+    return total
+
+
+async def totals(db, name, server_id, since):
+    """message counts since the day since by user or channel id, highest
+    first."""
+    counts = Counter()
+    cursor = db[name].find({"server_id": server_id, "day": {"$gte": since}})
+    while (await cursor.fetch_next):
+        document = cursor.next_object()
+        counts[document[_KEYS[name]]] += document["count"]
+    return counts.most_common()
+
+
+async def daily(db, name, server_id, since, key=None):
+    """message counts for each day since the day since, for one user or
+    channel id, or the whole server if key is None."""
+    query = {"server_id": server_id, "day": {"$gte": since}}
+    if key:
+        query[_KEYS[name]] = key
+    days = OrderedDict()
+    day = since
+    while day <= day_of(datetime.utcnow()):
+        days[day] = 0
+        day += timedelta(days=1)
+    cursor = db[name].find(query)
+    while (await cursor.fetch_next):
+        document = cursor.next_object()
+        days[document["day"]] = days.get(document["day"], 0) + \
+            document["count"]
+    return days
@@ -0,0 +1,150 @@
+import asyncio
+import csv
+import os
+import re
+import unicodedata
+from array import array
+from collections import OrderedDict, namedtuple
+
+Sentence = namedtuple('Sentence', ['id', 'japanese', 'english'])
+
+_CJK_REGEX = re.compile(r"[぀-ヿ㐀-䶿一-鿿ｦ-ﾟ]")
+_WORD_REGEX = re.compile(r"[a-z0-9']+")
+
+_index = None
+_index_future = None
+
+
+def normalize(text):
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def japanese_grams(text):
+    """character unigrams and bigrams; japanese isn't space segmented, so
+    any substring query of length >= 2 is covered by its bigrams."""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    grams.discard(" ")
+    return grams
+
+
+def english_grams(text):
+    return {"\0" + x for x in _WORD_REGEX.findall(text)}
+
+
+def query_grams(term):
+    if _CJK_REGEX.search(term):
+        if len(term) == 1:
+            return {term}
+        return {term[i:i + 2] for i in range(len(term) - 1)}
+    return english_grams(term)
+
+
+class SentenceIndex:
+    def __init__(self, cache_size=256):
+        self.sentences = []
+        self._normalized = []
+        self._postings = {}
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def add(self, sentence_id, japanese, english):
+        index = len(self.sentences)
+        self.sentences.append(Sentence(sentence_id, japanese, english))
+        jp, en = normalize(japanese), normalize(english)
+        self._normalized.append((jp, en))
+        for gram in japanese_grams(jp) | english_grams(en):
+            lst = self._postings.get(gram)
+            if lst is None:
+                lst = self._postings[gram] = array("I")
+            lst.append(index)
+
+    def search(self, query, limit=None):
+        """returns matching sentences ranked best first. the full ranking is
+        cached per query, so different limits don't re-scan the index."""
+        terms = tuple(normalize(query).split())
+        if not terms:
+            return []
+        if terms in self._cache:
+            self._cache.move_to_end(terms)
+            return self._cache[terms][:limit]
+        postings = [self._postings.get(gram, ())
+                    for term in terms for gram in query_grams(term)]
+        postings.sort(key=len)
+        results = []
+        if postings and postings[0]:
+            candidates = set(postings[0])
+            for lst in postings[1:]:
+                candidates.intersection_update(lst)
+                if not candidates:
+                    break
+            checks = [(True, x) if _CJK_REGEX.search(x) else
+                      (False, re.compile(
+                          r"(?<!\w)" + re.escape(x) + r"(?!\w)"))
+                      for x in terms]
+            results = [i for i in candidates if self._matches(i, checks)]
+            # shorter sentences are the more useful examples
+            results.sort(key=lambda i: (len(self.sentences[i].japanese), i))
+            results = [self.sentences[i] for i in results]
+        self._cache[terms] = results
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return results[:limit]
+
+    def _matches(self, i, checks):
+        jp, en = self._normalized[i]
+        for japanese, check in checks:
+            if japanese:
+                if check not in jp:
+                    return False
+            elif not check.search(en):
+                return False
+        return True
+
+
+def highlight_regex(query):
+    terms = sorted(set(query.split()), key=len, reverse=True)
+    return re.compile("(" + "|".join(re.escape(x) for x in terms) + ")",
+                      re.I)
+
+
+def load_tatoeba(path):
+    """loads a tatoeba sentence pairs export, one pair per line:
+    jpn id, japanese text, eng id, english text (tab separated).
+    multiple translations of the same sentence are merged."""
+    index = SentenceIndex()
+    previous = None
+    translations = []
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            if len(row) < 4:
+                continue
+            if previous and previous[0] != row[0]:
+                index.add(int(previous[0]), previous[1], " / ".join(
+                    translations))
+                translations = []
+            previous = row
+            translations.append(row[3])
+    if previous:
+        index.add(int(previous[0]), previous[1], " / ".join(translations))
+    return index
+
+
+async def get_sentence_index(self):
+    global _index, _index_future
+    if _index is not None:
+        return _index
+    path = self.config.get("data", {}).get("tatoeba")
+    if not path or not os.path.isfile(path):
+        return None
+    if _index_future is None:
+        _index_future = self.loop.run_in_executor(None, load_tatoeba, path)
+    future = _index_future
+    try:
+        _index = await asyncio.shield(future)
+    except Exception:
+        # let the next call try loading it again
+        if _index_future is future:
+            _index_future = None
+        raise
+    return _index
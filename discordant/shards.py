@@ -0,0 +1,113 @@
+import logging
+import os
+import signal
+import subprocess
+import time
+
+import discordant.perf as perf
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(server_id, shard_count):
+    # the same mapping discord uses to route a server's events to a shard
+    return (int(server_id) >> 22) % shard_count
+
+
+def shard_metrics_file(path, shard_id):
+    return "{}.shard{}".format(path, shard_id)
+
+
+class Shard:
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.restart_at = 0.0
+        self.backoff = 1
+
+
+class ShardSupervisor:
+    """runs every shard as a child process, restarts the ones that exit
+    with exponential backoff, and merges their metrics files into one.
+    command(shard_id) gives the child's argument list."""
+
+    def __init__(self, command, shard_count, metrics_file=None, interval=60,
+                 max_backoff=300, healthy_after=60):
+        self.command = command
+        self.shards = [Shard(i) for i in range(shard_count)]
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.healthy_after = healthy_after
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        next_merge = time.monotonic() + self.interval
+        try:
+            while not self._stopping:
+                now = time.monotonic()
+                for shard in self.shards:
+                    self._check(shard, now)
+                if self.metrics_file and now >= next_merge:
+                    self.merge_metrics()
+                    next_merge = now + self.interval
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10):
+        running = [x.process for x in self.shards if x.process]
+        for process in running:
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in running:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def merge_metrics(self):
+        texts = []
+        for shard in self.shards:
+            path = shard_metrics_file(self.metrics_file, shard.shard_id)
+            if os.path.isfile(path):
+                with open(path) as f:
+                    texts.append(f.read())
+        lines = ["# HELP discordant_shard_restarts_total "
+                 "Times a shard process was restarted.",
+                 "# TYPE discordant_shard_restarts_total counter"]
+        lines += ['discordant_shard_restarts_total{{shard="{}"}} {}'.format(
+            x.shard_id, x.restarts) for x in self.shards]
+        texts.append("\n".join(lines) + "\n")
+        perf.write_file(self.metrics_file, perf.merge_prometheus(texts))
+
+    def _on_signal(self, signum, frame):
+        self._stopping = True
+
+    def _start(self, shard):
+        logger.info("Starting shard %d", shard.shard_id)
+        shard.process = subprocess.Popen(self.command(shard.shard_id))
+        shard.started = time.monotonic()
+
+    def _check(self, shard, now):
+        if shard.process is None:
+            if now >= shard.restart_at:
+                self._start(shard)
+            return
+        code = shard.process.poll()
+        if code is None:
+            if now - shard.started >= self.healthy_after:
+                shard.backoff = 1
+            return
+        logger.warning("Shard %d exited with code %d, restarting in %d s",
+                       shard.shard_id, code, shard.backoff)
+        shard.process = None
+        shard.restarts += 1
+        shard.restart_at = now + shard.backoff
+        shard.backoff = min(shard.backoff * 2, self.max_backoff)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SupervisedTask:
+    def __init__(self, name, func, restart):
+        self.name = name
+        self.func = func
+        self.restart = restart
+        self.task = None
+        self.started = time.time()
+        self.runs = 0
+        self.failures = 0
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+
+class Supervisor:
+    """runs long-running background coroutines by name. a name can only
+    have one running task, so handlers spawning them on every reconnect
+    don't pile up. failed tasks are reported and, if asked, restarted
+    with exponential backoff. tasks that aren't restarted are forgotten
+    once they finish, so one-off timers don't pile up either."""
+
+    def __init__(self, loop, on_error=None, max_backoff=300):
+        self.loop = loop
+        self.on_error = on_error
+        self.max_backoff = max_backoff
+        self.tasks = {}
+
+    def spawn(self, name, func, restart=False):
+        """func is a coroutine function taking no arguments. returns False if
+        a task with this name is already running."""
+        entry = self.tasks.get(name)
+        if entry and entry.running:
+            return False
+        entry = SupervisedTask(name, func, restart)
+        entry.task = asyncio.ensure_future(self._run(entry), loop=self.loop)
+        self.tasks[name] = entry
+        return True
+
+    def label(self, task):
+        for entry in list(self.tasks.values()):
+            if entry.task is task:
+                return "task " + entry.name
+
+    def cancel(self, name):
+        entry = self.tasks.get(name)
+        if not entry or not entry.running:
+            return False
+        entry.task.cancel()
+        return True
+
+    def cancel_all(self):
+        for name in list(self.tasks):
+            self.cancel(name)
+
+    async def _run(self, entry):
+        try:
+            await self._supervise(entry)
+        finally:
+            if not entry.restart and self.tasks.get(entry.name) is entry:
+                del self.tasks[entry.name]
+
+    async def _supervise(self, entry):
+        backoff = 1
+        while True:
+            entry.runs += 1
+            try:
+                await entry.func()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                entry.failures += 1
+                entry.last_error = "{}: {}".format(type(e).__name__, e)
+                logger.exception("Background task %s failed", entry.name)
+                if self.on_error:
+                    await self.on_error(entry.name)
+            if not entry.restart:
+                return
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
@@ -1,6 +1,7 @@
 import asyncio
 import re
 import shlex
+from collections import OrderedDict
 from datetime import datetime
 
 import discord
@@ -14,10 +15,67 @@ def is_url(s):  # good enough for now lmao
     return bool(re.match(r'^https?:\/\/.*', s))
 
 
+_FENCE = "```"
+_FENCE_LANG_REGEX = re.compile(r"[\w+#.-]*\n?$")
+_FENCE_TOKEN_REGEX = re.compile(_FENCE + r"[\w+#.-]*")
+
+
+def _fence_opener(piece):
+    """the fence token that opens the block piece ends inside of, with its
+    language if it has one, e.g. ```py."""
+    rest = piece[piece.rindex(_FENCE) + len(_FENCE):]
+    if _FENCE_LANG_REGEX.match(rest):
+        return _FENCE + rest.rstrip("\n")
+    return _FENCE
+
+
+def _blank(chunk):
+    # an empty code block is as good as an empty message
+    return not _FENCE_TOKEN_REGEX.sub("", chunk).strip()
+
+
+def pack_message(text, max_chars=2000):
+    """splits text into as few messages of at most max_chars as it can,
+    breaking at line ends, or at spaces within lines that don't fit. code
+    blocks that get split are closed and reopened so both halves render.
+    blank messages, which discord rejects, are left out."""
+    chunks = []
+    chunk = ""
+    fresh = True  # chunk has nothing but a reopened code fence
+    fence = None  # fence that opened the code block chunk ends inside of
+    reserve = len("\n" + _FENCE)
+    for line in text.splitlines(True):
+        while line:
+            room = max_chars - len(chunk) - reserve
+            if len(line) <= room:
+                piece, line = line, ""
+            elif not fresh:
+                if not _blank(chunk):
+                    chunks.append(chunk.rstrip("\n") +
+                                  ("\n" + _FENCE if fence else ""))
+                chunk = fence + "\n" if fence else ""
+                fresh = True
+                continue
+            else:
+                cut = line.rfind(" ", 0, room) + 1 or max(room, 1)
+                piece, line = line[:cut], line[cut:]
+            chunk += piece
+            fresh = False
+            count = piece.count(_FENCE)
+            if count:
+                # the block is open after piece if it toggled an odd number
+                # of times from how it was before
+                fence = _fence_opener(piece) \
+                    if bool(fence) != bool(count % 2) else None
+    if not fresh and not _blank(chunk):
+        chunks.append(chunk.rstrip("\n"))
+    return chunks
+
+
 def long_message(output, truncate=False, max_chars=2000,
                  err_msg="... *Message truncated. PM me to show more!"):
     if not truncate:
-        return split_every(output, max_chars)
+        return pack_message(output, max_chars)
     elif len(output) > max_chars:
         output = output[:max_chars - len(err_msg)]
         return output[:output.rindex("\n") + 1] + err_msg
@@ -26,9 +84,13 @@ def long_message(output, truncate=False, max_chars=2000,
 
 async def send_long_message(self, channel, message, truncate=False,
                             max_chars=2000):
-    long_msg = long_message(message, truncate, max_chars)
-    for msg in ([long_msg] if type(long_msg) is str else long_msg):
-        await self.send_message(channel, msg)
+    """queues message on the channel's outbox, which packs it together with
+    anything else waiting to go to the channel. waits until it's sent."""
+    if truncate:
+        await self.send_message(channel, long_message(
+            message, True, max_chars))
+        return
+    await self.outbox.send(channel, message, max_chars)
 
 
 def get_kwargs(args_str, keys=None):
@@ -89,13 +151,16 @@ def _general_search(search, seq):
     return None
 
 
-async def is_punished(self, member, *actions):
+async def is_punished(self, member, *actions, server=None):
+    """server defaults to the member's; it's needed for users that aren't
+    members, like banned ones."""
     punishments = ["ban", "warning", "mute"]
     if not set(actions) <= set(punishments):
         raise ValueError("Invalid action, must be one of: " +
                          ", ".join(punishments))
+    server = server or member.server
     cursor = await self.mongodb.punishments.find(
-        {"user_id": member.id}).to_list(None)
+        {"user_id": member.id, "server_id": server.id}).to_list(None)
     cursor.reverse()
     if not cursor:
         return False
@@ -126,7 +191,8 @@ async def _is_punished(cursor, action):
 
 
 async def add_punishment_timer(self, member, action):
-    role = action_to_role(self, action)
+    role = action_to_role(self, member.server, action)
+    guild = self.guilds.get(member.server.id)
     while True:
         punished = await is_punished(self, member, action)
         if not punished:
@@ -134,11 +200,17 @@ async def add_punishment_timer(self, member, action):
             if role:
                 await self.remove_roles(member, role)
             break
-        await asyncio.sleep(
-            self.config["moderation"]["punishment_check_rate"])
+        await asyncio.sleep((guild.config if guild else self.config)[
+            "moderation"]["punishment_check_rate"])
+
+
+def spawn_punishment_timer(self, member, action):
+    self.tasks.spawn("punishment:{}:{}:{}".format(
+        member.server.id, member.id, action),
+                     lambda: add_punishment_timer(self, member, action))
 
 
-def action_to_role(self, action):
+def action_to_role(self, server, action):
     dct = {
         # "warning": "Warned",
         "mute": "Muted"
@@ -147,7 +219,7 @@ def action_to_role(self, action):
         return None
         # raise ValueError("Invalid action {}, must be one of: {}".format(
         #     action, ", ".join(dct.keys())))
-    return discord.utils.get(self.default_server.roles, name=dct[action])
+    return discord.utils.get(server.roles, name=dct[action])
 
 
 def get_cmd(self, cmd_name):
@@ -165,6 +237,43 @@ def cmd_help_format(cmd):
         return cmd.help
 
 
+HELP_FOOTER = (
+    "type !help [command/section] to display more information "
+    "about a certain command or section.\n\n"
+    "**command help syntax**:\n"
+    "[]     optional argument\n"
+    "<>    required argument\n"
+    "\\*       any number of arguments\n"
+    "k=v  kwargs style argument (each key-value pair is "
+    "separated by space, and the key and value are separated by the"
+    " \"=\" character).\n"
+    "\\*\\*     any number of kwargs")
+
+
+def help_menu(sections):
+    output = "**commands**:"
+    for section, cmd_list in sections.items():
+        tab_4 = " " * 4
+        output += "\n  __{}__:\n".format(section) + \
+                  "\n".join([tab_4 + "*{}* - ".format(cmd.aliases[0]) +
+                             cmd.help.replace("\n", tab_4 + "\n").split(
+                                 " - ", 1)[1] for cmd in cmd_list])
+    return output
+
+
+def help_menus(commands):
+    """the full help text and each section's, keyed by section name (None
+    for the full one)."""
+    sections = OrderedDict()
+    for cmd in commands:
+        sections.setdefault(cmd.section, []).append(cmd)
+    menus = {None: help_menu(sections) + "\n\n" + HELP_FOOTER}
+    for section, cmd_list in sections.items():
+        menus[section] = help_menu({section: cmd_list}) + "\n\n" + \
+            HELP_FOOTER
+    return menus
+
+
 async def send_help(self, message, cmd_name):
     await self.send_message(message.channel, cmd_help_format(get_cmd(
         self, cmd_name)))
@@ -179,6 +288,13 @@ def python_format(code):
     return "```py\n{}\n```".format(str(code).replace("`", "`" + zwsp))
 
 
+def bot_colour(self, server):
+    """the bot's role colour in server, or the default one outside of
+    servers."""
+    member = server.get_member(self.user.id) if server else None
+    return member.colour if member else discord.Colour.default()
+
+
 def get_avatar_url(user):
     return user.avatar_url if user.avatar else user.default_avatar_url
 
@@ -189,7 +305,7 @@ def datetime_floor_microseconds(dt, digits=3):
 
 
 def geq_role(self, user, author):
-    self_user = self.default_server.get_member(self.user.id)
+    self_user = author.server.get_member(self.user.id)
     return user.top_role >= min(self_user.top_role, author.top_role)
 
 
@@ -199,7 +315,7 @@ def gt_role(self, author, user, include_self=False):
 
     author_rank = rank(author)
     if include_self:
-        self_user = self.default_server.get_member(self.user.id)
+        self_user = author.server.get_member(self.user.id)
         author_rank = min(rank(self_user), author_rank)
     return author_rank > rank(user)
 
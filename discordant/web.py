@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import json
+import os
+
+import aiohttp
+
+from discordant.lazy import lazy_import
+
+html = lazy_import("lxml.html")
+
+_transport = None
+
+
+class NotFound(Exception):
+    def __init__(self, url):
+        super().__init__("404 Not Found: " + url)
+        self.url = url
+
+
+class BadStatus(Exception):
+    def __init__(self, url, status):
+        super().__init__("HTTP {}: {}".format(status, url))
+        self.url = url
+        self.status = status
+
+
+class MissingFixture(Exception):
+    def __init__(self, url):
+        super().__init__("No recorded response for " + url)
+        self.url = url
+
+
+class SingleFlight:
+    """coalesces concurrent calls with the same key into one call. every
+    waiter gets the same result, or the same exception."""
+
+    def __init__(self, spawn=asyncio.ensure_future):
+        self.spawn = spawn
+        self.calls = 0  # calls that actually went upstream
+        self.shared = 0  # calls that were served by another in-flight call
+        self._flights = {}
+
+    async def do(self, key, func):
+        future = self._flights.get(key)
+        if future is None:
+            self.calls += 1
+            future = self.spawn(func())
+            self._flights[key] = future
+            future.add_done_callback(lambda f: self._flights.pop(key, None))
+        else:
+            self.shared += 1
+        # shielded so one waiter getting cancelled doesn't cancel the others
+        return await asyncio.shield(future)
+
+    @property
+    def in_flight(self):
+        return len(self._flights)
+
+
+class Response:
+    """a response held in memory, as served from fixtures. has the parts
+    of the aiohttp response interface the bot uses."""
+
+    def __init__(self, url, status, content_type, body):
+        self.url = url
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+        self.content = _Content(body)
+
+    @property
+    def charset(self):
+        for param in self.content_type.split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "charset":
+                return value.strip('"')
+        return "utf-8"
+
+    async def read(self):
+        return self.body
+
+    async def text(self):
+        return self.body.decode(self.charset, "replace")
+
+    async def json(self):
+        return json.loads(await self.text())
+
+
+class _Content:
+    def __init__(self, body):
+        self._body = body
+        self._offset = 0
+
+    async def read(self, n=-1):
+        end = len(self._body) if n < 0 else self._offset + n
+        chunk = self._body[self._offset:end]
+        self._offset += len(chunk)
+        return chunk
+
+
+class LiveTransport:
+    """does real requests. get returns an async context manager yielding
+    the aiohttp response."""
+
+    def get(self, url):
+        return _LiveRequest(url)
+
+
+class _LiveRequest:
+    def __init__(self, url):
+        self.url = url
+        self._session = None
+        self._request = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession()
+        try:
+            self._request = self._session.get(self.url)
+            return await self._request.__aenter__()
+        except:
+            self._session.close()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        try:
+            await self._request.__aexit__(*exc_info)
+        finally:
+            self._session.close()
+
+
+class RecordTransport:
+    """does real requests through transport, saving every successful or
+    not found response as a fixture in directory for ReplayTransport to
+    serve later."""
+
+    def __init__(self, directory, transport=None):
+        self.directory = directory
+        self.transport = transport or LiveTransport()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def get(self, url):
+        return _Request(self._record(url))
+
+    async def _record(self, url):
+        async with self.transport.get(url) as response:
+            recorded = Response(url, response.status,
+                                response.headers.get("Content-Type", ""),
+                                await response.read())
+        # other errors are usually passing, so they aren't replayed
+        if 200 <= recorded.status < 300 or recorded.status == 404:
+            save_fixture(self.directory, recorded)
+        return recorded
+
+
+class ReplayTransport:
+    """serves responses recorded by RecordTransport, each taking latency
+    seconds. urls that weren't recorded raise MissingFixture."""
+
+    def __init__(self, directory, latency=0.0):
+        self.directory = directory
+        self.latency = latency
+        self._responses = {}
+
+    def get(self, url):
+        return _Request(self._replay(url))
+
+    async def _replay(self, url):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if url not in self._responses:
+            self._responses[url] = load_fixture(self.directory, url)
+        response = self._responses[url]
+        # every caller gets its own stream position
+        return Response(url, response.status, response.content_type,
+                        response.body)
+
+
+class _Request:
+    def __init__(self, coro):
+        self._coro = coro
+
+    async def __aenter__(self):
+        return await self._coro
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+def fixture_path(directory, url):
+    return os.path.join(
+        directory, hashlib.sha1(url.encode("utf-8")).hexdigest()[:16])
+
+
+def save_fixture(directory, response):
+    path = fixture_path(directory, response.url)
+    with open(path + ".body", "wb") as f:
+        f.write(response.body)
+    with open(path + ".json", "w") as f:
+        json.dump({"url": response.url, "status": response.status,
+                   "content_type": response.content_type}, f, indent=2)
+
+
+def load_fixture(directory, url):
+    path = fixture_path(directory, url)
+    if not os.path.exists(path + ".json"):
+        raise MissingFixture(url)
+    with open(path + ".json") as f:
+        meta = json.load(f)
+    with open(path + ".body", "rb") as f:
+        body = f.read()
+    return Response(url, meta["status"], meta["content_type"], body)
+
+
+def get_transport(self):
+    """the transport picked by the "http" config section. mode is "live"
+    (the default), "record" or "replay"."""
+    global _transport
+    if _transport is None:
+        cfg = self.config.get("http", {})
+        mode = cfg.get("mode", "live")
+        directory = cfg.get("fixtures", "fixtures/http")
+        if mode == "record":
+            _transport = RecordTransport(directory)
+        elif mode == "replay":
+            _transport = ReplayTransport(directory, cfg.get("latency", 0.0))
+        else:
+            _transport = LiveTransport()
+    return _transport
+
+
+async def fetch(self, url, kind="text"):
+    """GETs a url through the bot's single-flight group and transport.
+    kind is one of "text", "json", "bytes" or "html" (a parsed lxml tree,
+    which must not be modified since it can be shared between callers)."""
+    transport = get_transport(self)
+    return await self.metrics.track("http", self.single_flight.do(
+        (url, kind), lambda: _fetch(transport, url, kind)))
+
+
+async def _fetch(transport, url, kind):
+    async with transport.get(url) as response:
+        if response.status == 404:
+            raise NotFound(url)
+        if not 200 <= response.status < 300:
+            # error pages mustn't be handed out, or cached, as results
+            raise BadStatus(url, response.status)
+        if kind == "json":
+            return await response.json()
+        if kind == "bytes":
+            return await response.read()
+        text = await response.text()
+    return html.fromstring(text) if kind == "html" else text
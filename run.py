@@ -1,11 +1,59 @@
 #!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import time
+
+start = time.perf_counter()
+
+import discordant.perf as perf
+import discordant.shards as shards
 from discordant import Discordant, configure_logging
+from discordant.logging import get_default_logfile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", default="config.json")
+    parser.add_argument("-s", "--shards", type=int, default=1,
+                        help="number of shard processes to run")
+    parser.add_argument("--shard-id", type=int,
+                        help="run only this shard (used by the supervisor)")
+    return parser.parse_args()
+
+
+def run_supervisor(args):
+    configure_logging(loop_monitor=False)
+    metrics = {}
+    if os.path.isfile(args.config):
+        with open(args.config) as f:
+            metrics = json.load(f).get("metrics", {})
+
+    def command(shard_id):
+        return [sys.executable, os.path.abspath(__file__),
+                "--config", args.config, "--shards", str(args.shards),
+                "--shard-id", str(shard_id)]
+
+    shards.ShardSupervisor(command, args.shards,
+                           metrics.get("prometheus_file"),
+                           metrics.get("interval", 60)).run()
 
 
 if __name__ == '__main__':
-    configure_logging()
+    args = parse_args()
+    if args.shards > 1 and args.shard_id is None:
+        run_supervisor(args)
+        sys.exit()
+    sharded = args.shard_id is not None
+    configure_logging(get_default_logfile(
+        "discordant.shard{}".format(args.shard_id)) if sharded else None)
+    startup = perf.StartupTimer(start)
+    startup.mark("import")
 
-    bot = Discordant()
+    bot = Discordant(args.config, startup=startup,
+                     shard_id=args.shard_id if sharded else None,
+                     shard_count=args.shards if sharded else None)
     try:
         bot.run()
     except KeyboardInterrupt:
@@ -0,0 +1,84 @@
+import unittest
+
+from discordant import arguments
+from discordant.arguments import ArgumentError, Schema, kwarg, positional
+
+_mod = Schema(
+    positional("user"),
+    positional("reason", optional=True, rest=True, default="none"),
+    kwargs=[kwarg("duration", float, min=0, label="hours"),
+            kwarg("reason")])
+_search = Schema(
+    positional("limit", int, optional=True, default=1, min=1),
+    positional("query", rest=True),
+    kwargs=[kwarg("context", arguments.boolean, default=False)])
+
+
+class SchemaParseTest(unittest.TestCase):
+    def test_positionals_and_kwargs(self):
+        args = _mod.parse('bob spamming duration=2.5')
+        self.assertEqual(args, ("bob", "spamming", 2.5))
+
+    def test_defaults(self):
+        self.assertEqual(_mod.parse("bob"), ("bob", "none", None))
+        self.assertEqual(_search.parse("word"), (1, "word", False))
+
+    def test_optional_skipped_for_required(self):
+        self.assertEqual(_search.parse("5"), (1, "5", False))
+        self.assertEqual(_search.parse("5 study"), (5, "study", False))
+
+    def test_optional_of_wrong_type_skipped(self):
+        self.assertEqual(_search.parse("study hard"), (1, "study hard", False))
+
+    def test_quoted_words(self):
+        self.assertEqual(_mod.parse('"some one" reason="a b c"'),
+                         ("some one", "a b c", None))
+
+    def test_rest_keeps_spacing(self):
+        args = _mod.parse("bob  spam\n  and   more")
+        self.assertEqual(args.reason, "spam\n  and   more")
+
+    def test_rest_leaves_out_kwargs(self):
+        args = _mod.parse("bob spam duration=3   more")
+        self.assertEqual(args.reason, "spam more")
+        self.assertEqual(args.duration, 3)
+
+    def test_kwarg_for_positional(self):
+        self.assertEqual(_mod.parse("bob reason=x").reason, "x")
+
+    def test_kwarg_and_positional_clash(self):
+        with self.assertRaises(ArgumentError):
+            _mod.parse("bob reason=x more words")
+
+    def test_missing_required(self):
+        with self.assertRaises(ArgumentError):
+            _mod.parse("")
+        with self.assertRaises(ArgumentError):
+            _search.parse("context=true")
+
+    def test_bounds_and_types(self):
+        with self.assertRaises(ArgumentError):
+            _mod.parse("bob duration=-1")
+        with self.assertRaises(ArgumentError):
+            _mod.parse("bob duration=soon")
+        with self.assertRaises(ArgumentError):
+            _search.parse("study context=maybe")
+        self.assertTrue(_search.parse("study context=yes").context)
+
+    def test_unexpected_argument(self):
+        with self.assertRaises(ArgumentError):
+            Schema(positional("user")).parse("bob alice")
+
+
+class SchemaSyntaxTest(unittest.TestCase):
+    def test_syntax(self):
+        self.assertEqual(_search.syntax("jisho"),
+                         "!jisho [limit] <query> [context=bool]")
+
+    def test_kwarg_named_like_positional_listed_once(self):
+        self.assertEqual(_mod.syntax("warn"),
+                         "!warn <user> [reason] [duration=hours]")
+
+
+if __name__ == "__main__":
+    unittest.main()
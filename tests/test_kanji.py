@@ -0,0 +1,39 @@
+import unittest
+
+from discordant.kanji import parse_svg_path, radical_char
+
+
+class ParseSvgPathTest(unittest.TestCase):
+    def test_lines(self):
+        self.assertEqual(parse_svg_path("M10,20L30,40h5v-10z"), [
+            (10, 20), (30, 40), (35, 40), (35, 30), (10, 20)])
+
+    def test_relative_and_implicit_lineto(self):
+        self.assertEqual(parse_svg_path("m10,20 5,5 5,0"),
+                         [(10, 20), (15, 25), (20, 25)])
+
+    def test_curves_end_on_their_end_point(self):
+        points = parse_svg_path("M0,0C0,10,10,10,10,0s10,-10,10,0", 4)
+        self.assertEqual(len(points), 1 + 4 + 4)
+        self.assertEqual(points[4], (10, 0))
+        self.assertEqual(points[-1], (20, 0))
+        # the smooth curve reflects the previous control point
+        self.assertLess(points[6][1], 0)
+
+    def test_kanjivg_number_format(self):
+        self.assertEqual(parse_svg_path("M1.5-2.5l.5-1e1"),
+                         [(1.5, -2.5), (2.0, -12.5)])
+
+    def test_unsupported_command(self):
+        with self.assertRaises(ValueError):
+            parse_svg_path("M0,0A1,1,0,0,0,1,1")
+
+
+class RadicalTest(unittest.TestCase):
+    def test_radical_char(self):
+        self.assertEqual(radical_char(1), "⼀")
+        self.assertEqual(radical_char(214), "⿕")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from datetime import datetime
+
+from discordant import logsearch, retention
+
+
+class TokensTest(unittest.TestCase):
+    def test_words_lowercased(self):
+        self.assertEqual(logsearch.tokens("Hello, hello World"),
+                         ["hello", "world"])
+
+    def test_japanese_ngrams(self):
+        self.assertEqual(logsearch.tokens("日本語"),
+                         ["日", "日本", "本", "本語", "語"])
+
+
+class BuildQueryTest(unittest.TestCase):
+    def test_nothing_to_search_for(self):
+        self.assertIsNone(logsearch.build_query("s", " ?! "))
+
+    def test_terms(self):
+        query = logsearch.build_query("s", "Hello 日本")
+        self.assertEqual(query["tokens"], {"$all": ["hello", "日本"]})
+        self.assertNotIn("content", query)
+
+    def test_long_japanese_also_matches_content(self):
+        query = logsearch.build_query("s", "日本語")
+        self.assertEqual(query["tokens"], {"$all": ["日本", "本語"]})
+        self.assertTrue(query["content"].search("x日本語x"))
+        self.assertFalse(query["content"].search("本語日本"))
+
+    def test_filters(self):
+        query = logsearch.build_query(
+            "s", "hi", "u", "c", datetime(2020, 1, 1), datetime(2020, 1, 2))
+        self.assertEqual(query["author_id"], "u")
+        self.assertEqual(query["channel_id"], "c")
+        self.assertEqual(query["timestamp"], {"$gte": datetime(2020, 1, 1),
+                                              "$lt": datetime(2020, 1, 3)})
+
+
+class BucketTest(unittest.TestCase):
+    logs = [{"message_id": "1", "author_id": "a", "content": "hello 日本語",
+             "timestamp": datetime(2020, 1, 1, 12, 30, 15, 250)},
+            {"message_id": "2", "author_id": "b", "content": "bye",
+             "timestamp": datetime(2020, 1, 1, 13)}]
+
+    def _bucket(self):
+        return {"server_id": "s", "channel_id": "c",
+                "day": datetime(2020, 1, 1),
+                "messages": retention._pack(self.logs)}
+
+    def test_pack_and_expand(self):
+        expanded = retention.expand(self._bucket())
+        self.assertEqual(expanded, [dict(x, server_id="s", channel_id="c")
+                                    for x in self.logs])
+
+    def test_bucket_tokens(self):
+        self.assertEqual(logsearch.bucket_tokens(self.logs), sorted(
+            set(logsearch.tokens("hello 日本語")) | {"bye"}))
+
+    def test_matches(self):
+        first, second = retention.expand(self._bucket())
+        query = logsearch.build_query("s", "日本語")
+        self.assertTrue(logsearch.matches(first, query))
+        self.assertFalse(logsearch.matches(second, query))
+        query = logsearch.build_query("s", "hello", user_id="b")
+        self.assertFalse(logsearch.matches(first, query))
+        query = logsearch.build_query("s", "bye",
+                                      after=datetime(2020, 1, 2))
+        self.assertFalse(logsearch.matches(second, query))
+
+
+if __name__ == "__main__":
+    unittest.main()
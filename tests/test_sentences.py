@@ -0,0 +1,49 @@
+import unittest
+
+from discordant.sentences import SentenceIndex, highlight_regex
+
+
+def _index():
+    index = SentenceIndex()
+    index.add(1, "私は毎日ご飯を食べる。", "I eat rice every day.")
+    index.add(2, "食べた？", "Did you eat?")
+    index.add(3, "彼は勉強している。", "He is studying.")
+    index.add(4, "もう食べ終わった。", "I've already eaten.")
+    return index
+
+
+class SentenceSearchTest(unittest.TestCase):
+    def test_japanese_substring(self):
+        self.assertEqual([x.id for x in _index().search("食べ")], [2, 4, 1])
+        self.assertEqual([x.id for x in _index().search("食")], [2, 4, 1])
+        self.assertEqual(_index().search("食べない"), [])
+
+    def test_english_whole_words(self):
+        self.assertEqual([x.id for x in _index().search("eat")], [2, 1])
+        self.assertEqual([x.id for x in _index().search("eaten")], [4])
+
+    def test_terms_ending_in_punctuation(self):
+        self.assertEqual([x.id for x in _index().search("eat?")], [2])
+        self.assertEqual([x.id for x in _index().search("day.")], [1])
+
+    def test_every_term_must_match(self):
+        self.assertEqual([x.id for x in _index().search("ご飯 eat")], [1])
+        self.assertEqual(_index().search("ご飯 studying"), [])
+
+    def test_normalized(self):
+        self.assertEqual([x.id for x in _index().search("EAT")], [2, 1])
+
+    def test_limit_and_cache(self):
+        index = _index()
+        self.assertEqual(len(index.search("食べ", 1)), 1)
+        self.assertEqual(len(index.search("食べ")), 3)
+        self.assertEqual(index.search("   "), [])
+
+    def test_highlight_regex(self):
+        regex = highlight_regex("eat eaten")
+        self.assertEqual(regex.sub(r"**\1**", "I've eaten"),
+                         "I've **eaten**")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from discordant.utils import pack_message
+
+
+class PackMessageTest(unittest.TestCase):
+    def test_blank_text_gives_no_messages(self):
+        self.assertEqual(pack_message(""), [])
+        self.assertEqual(pack_message("\n\n", 5), [])
+        self.assertEqual(pack_message("  \n \t\n", 5), [])
+
+    def test_blank_line_before_long_line(self):
+        chunks = pack_message("\n" + "word " * 10, 20)
+        self.assertTrue(chunks)
+        for chunk in chunks:
+            self.assertTrue(chunk.strip())
+            self.assertLessEqual(len(chunk), 20)
+
+    def test_no_empty_code_blocks(self):
+        chunks = pack_message("```py\n" + "a" * 10 + "\n\n" + "b" * 30 +
+                              "\n```", 20)
+        for chunk in chunks:
+            self.assertNotEqual(chunk.replace("```py", "").strip("`\n"), "")
+
+    def test_reopens_with_fence_token(self):
+        text = "a ```py x ``` b ```py\n" + "\n".join(
+            "line {}".format(i) for i in range(40)) + "\n```"
+        chunks = pack_message(text, 40)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 40)
+            self.assertTrue(chunk.endswith("```"))
+        for chunk in chunks[1:]:
+            self.assertTrue(chunk.startswith("```py\nline"))
+
+    def test_keeps_short_text_whole(self):
+        text = "hi\n```\ncode\n```\nbye"
+        self.assertEqual(pack_message(text), [text])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+
+from discordant.web import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.group = SingleFlight()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_concurrent_calls_share_one(self):
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = self.loop.run_until_complete(asyncio.gather(
+            *[self.group.do("key", func) for _ in range(5)]))
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((self.group.calls, self.group.shared), (1, 4))
+        self.assertEqual(self.group.in_flight, 0)
+
+    def test_exception_shared(self):
+        async def func():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        results = self.loop.run_until_complete(asyncio.gather(
+            *[self.group.do("key", func) for _ in range(3)],
+            return_exceptions=True))
+        self.assertEqual([type(x) for x in results], [ValueError] * 3)
+        self.assertEqual(self.group.calls, 1)
+
+    def test_cancelled_waiter_leaves_others(self):
+        async def func():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def run():
+            first = asyncio.ensure_future(self.group.do("key", func))
+            second = asyncio.ensure_future(self.group.do("key", func))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(self.loop.run_until_complete(run()), "result")
+
+    def test_later_calls_run_again(self):
+        async def func():
+            return "result"
+
+        self.loop.run_until_complete(self.group.do("key", func))
+        self.loop.run_until_complete(self.group.do("key", func))
+        self.assertEqual(self.group.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()